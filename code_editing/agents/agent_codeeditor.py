@@ -1,17 +1,27 @@
+import asyncio
+import functools
 import logging
-from typing import Callable, Dict
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
 
-from hydra.utils import instantiate
-from langchain_core.runnables import RunnableConfig, RunnableLambda
+from hydra.utils import get_class, instantiate
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
 
-from code_editing.agents.agent_graph import AgentGraphPartial
-from code_editing.agents.run import AgentRunManager
+from code_editing.agents.agent_graph import AgentGraph, AgentGraphPartial
+from code_editing.agents.context_providers.context_provider import ContextProvider
+from code_editing.agents.context_providers.lazy import LazyContextProvider
+from code_editing.agents.context_providers.pool import ContextProviderPool
+from code_editing.agents.run import RUN_MANAGER_KEY, AgentRunManager
 from code_editing.agents.utils.checkout_extractor import CheckoutExtractor
 from code_editing.agents.utils.tool_factory import ToolFactory
-from code_editing.code_editor import CEInput, CEOutput, CodeEditor
+from code_editing.code_editor import CEInput, CEOutput, CodeEditor, PreparedRun
 from code_editing.configs.agents.context_providers.context_config import ContextConfig
 from code_editing.utils.file_log import MyFileCallbackHandler
 from code_editing.utils.git_utils import get_head_diff_unsafe
+from code_editing.utils.tracing import span
+from code_editing.utils.workspace import use_workspace
+from code_editing.utils.write_journal import WriteJournal
 
 
 class AgentCodeEditor(CodeEditor):
@@ -22,7 +32,19 @@ class AgentCodeEditor(CodeEditor):
         data_path: str,
         context_providers_cfg: Dict[str, ContextConfig] = None,
         runnable_config: RunnableConfig = None,
+        context_pool: Optional[ContextProviderPool] = None,
+        lazy_context: bool = False,
+        speculative_context: bool = False,
+        reuse_graph: bool = False,
     ):
+        """
+        @param context_pool: Pool of warm context providers reused by the runs at the same commit (None to build them
+            for every run)
+        @param lazy_context: Build the context providers on their first use instead of before the run
+        @param speculative_context: Start building the lazy context providers in the background as the run starts
+        @param reuse_graph: Compile the graph once and share it between the runs if it keeps no per-run state (the
+            run manager is passed to it in the runnable config)
+        """
         if context_providers_cfg is None:
             context_providers_cfg = {}
 
@@ -34,8 +56,65 @@ class AgentCodeEditor(CodeEditor):
 
         self.context_providers_cfg = context_providers_cfg
         self.runnable_config = runnable_config
+        self.context_pool = context_pool
+        self.lazy_context = lazy_context
+        self.reuse_graph = reuse_graph
+        self._graph_template: Optional[AgentGraph] = None
+        self._graph_template_lock = threading.Lock()
+        self.speculative_executor = (
+            ThreadPoolExecutor(thread_name_prefix="context") if lazy_context and speculative_context else None
+        )
 
-    def generate_diff(self, req: CEInput) -> CEOutput:
+    def _build_context_provider(self, name: str, cfg: ContextConfig, repo_path: str) -> ContextProvider:
+        with span(f"context_provider:{name}") as provider_span:
+            if self.context_pool is None:
+                return instantiate(cfg, repo_path=repo_path, data_path=self.data_path)
+            provider, warm = self.context_pool.acquire(cfg, repo_path, self.data_path)
+            if provider_span is not None:
+                provider_span.set(warm=warm)
+            return provider
+
+    def _build_context_providers(self, repo_path: str) -> Dict[str, ContextProvider]:
+        if self.lazy_context:
+            journal = WriteJournal(repo_path)
+            return {
+                k: LazyContextProvider(
+                    k,
+                    get_class(v["_target_"]),
+                    functools.partial(self._build_context_provider, k, v, repo_path),
+                    is_workspace_clean=lambda: journal.read() == [],
+                )
+                for k, v in self.context_providers_cfg.items()
+            }
+        context_providers = {}
+        try:
+            for k, v in self.context_providers_cfg.items():
+                context_providers[k] = self._build_context_provider(k, v, repo_path)
+        except Exception:
+            self._release_context_providers(context_providers)
+            raise
+        return context_providers
+
+    def _release_context_providers(self, context_providers: Dict[str, ContextProvider]) -> None:
+        for provider in context_providers.values():
+            dirty = False
+            if isinstance(provider, LazyContextProvider):
+                dirty = provider.built_on_dirty_workspace
+                provider = provider.unwrap()
+                if provider is None:
+                    # Never used in the run
+                    continue
+            if self.context_pool is None:
+                # Dropped with the run, its pending work must not outlive the run's workspace
+                provider.close()
+            elif dirty:
+                # Its state depends on the edits of the run
+                self.context_pool.discard(provider)
+            else:
+                self.context_pool.release(provider)
+
+    def _prepare_run(self, req: CEInput) -> Tuple[Runnable, RunnableConfig, AgentRunManager]:
+        """Build the context providers, the tools and the graph for the request."""
         # Get repository full path
         repo_path = req["code_base"].get(CheckoutExtractor.REPO_KEY, None)
         if repo_path is None:
@@ -44,8 +123,22 @@ class AgentCodeEditor(CodeEditor):
         generation_kwargs = {"repo_path": repo_path, "data_path": self.data_path}
 
         # Context providers that help the agent to search for the code
-        context_providers = {k: instantiate(v, **generation_kwargs) for k, v in self.context_providers_cfg.items()}
+        context_providers = self._build_context_providers(repo_path)
+        try:
+            res = self._prepare_graph(req, generation_kwargs, context_providers)
+        except Exception:
+            self._release_context_providers(context_providers)
+            raise
+        if self.speculative_executor is not None:
+            # Overlap the builds with the first LLM call
+            for provider in context_providers.values():
+                provider.speculate(self.speculative_executor)
+        return res
 
+    def _prepare_graph(
+        self, req: CEInput, generation_kwargs: Dict[str, str], context_providers: Dict[str, ContextProvider]
+    ) -> Tuple[Runnable, RunnableConfig, AgentRunManager]:
+        repo_path = generation_kwargs["repo_path"]
         run_manager = AgentRunManager(
             **generation_kwargs,
             context_providers=context_providers,
@@ -54,11 +147,15 @@ class AgentCodeEditor(CodeEditor):
         )
 
         # Tools available to the agent
-        tools = self.tool_factory.build(
-            run_manager=run_manager,
-        )
+        with span("build_tools"):
+            tools = self.tool_factory.build(
+                run_manager=run_manager,
+            )
+        run_manager.tools = {tool.name: tool for tool in tools}
 
-        app = self.agent_graph_partial(tools=tools, run_manager=run_manager)
+        app = self._get_graph_template()
+        if app is None:
+            app = self.agent_graph_partial(tools=tools, run_manager=run_manager)
 
         # Diff collection
         def to_ceoutput(state):
@@ -78,12 +175,70 @@ class AgentCodeEditor(CodeEditor):
         # update runnable config
         runnable_config = self.runnable_config.copy()
         runnable_config["run_name"] = f"{runnable_config['run_name']}.{run_manager.instance_id}"
+        runnable_config["configurable"] = {**runnable_config.get("configurable", {}), RUN_MANAGER_KEY: run_manager}
         runnable_config.setdefault("callbacks", [])
         # noinspection PyTypeChecker
-        runnable_config["callbacks"].append(MyFileCallbackHandler(run_manager.get_log_path()))
+        runnable_config["callbacks"] = runnable_config["callbacks"] + [
+            MyFileCallbackHandler(run_manager.get_log_path())
+        ]
+
+        return app | RunnableLambda(to_ceoutput, name="Collect Diff"), runnable_config, run_manager
 
-        # Invoke the graph
-        return (app | RunnableLambda(to_ceoutput, name="Collect Diff")).invoke(
-            input={"instruction": req["instruction"]},
-            config=runnable_config,
+    def _get_graph_template(self) -> Optional[AgentGraph]:
+        """The graph shared by the runs, compiled on the first call, or None if it has to be built for every run."""
+        if not self.reuse_graph:
+            return None
+        with self._graph_template_lock:
+            if self._graph_template is None:
+                template = self.agent_graph_partial(tools=self.tool_factory.templates, run_manager=None)
+                if not template.reusable:
+                    logging.info(f"The {template.name} graph keeps per-run state, it is built for every run")
+                    self.reuse_graph = False
+                    return None
+                template.compile()
+                self._graph_template = template
+            return self._graph_template
+
+    def generate_diff(self, req: CEInput) -> CEOutput:
+        with span("generate_diff"):
+            with span("prepare_run"):
+                runnable, runnable_config, run_manager = self._prepare_run(req)
+            return self._invoke(req, runnable, runnable_config, run_manager)
+
+    def _invoke(
+        self, req: CEInput, runnable: Runnable, runnable_config: RunnableConfig, run_manager: AgentRunManager
+    ) -> CEOutput:
+        try:
+            # Invoke the graph
+            with use_workspace(run_manager.workspace):
+                return runnable.invoke(input={"instruction": req["instruction"]}, config=runnable_config)
+        finally:
+            self._release_context_providers(run_manager.context_providers)
+
+    def prepare_run(self, req: CEInput) -> PreparedRun:
+        with span("prepare_run"):
+            runnable, runnable_config, run_manager = self._prepare_run(req)
+            try:
+                # The indexes are built here rather than on the first use by the agent
+                for provider in run_manager.context_providers.values():
+                    if isinstance(provider, LazyContextProvider):
+                        provider.get()
+            except Exception:
+                self._release_context_providers(run_manager.context_providers)
+                raise
+        return PreparedRun(
+            functools.partial(self._invoke, req, runnable, runnable_config, run_manager),
+            release=functools.partial(self._release_context_providers, run_manager.context_providers),
         )
+
+    async def agenerate_diff(self, req: CEInput) -> CEOutput:
+        with span("generate_diff"):
+            # Context providers may index the repository, so they are built in the executor
+            with span("prepare_run"):
+                runnable, runnable_config, run_manager = await asyncio.to_thread(self._prepare_run, req)
+            try:
+                # Tools offload their blocking work to the executor as well, see CEBaseTool._arun
+                with use_workspace(run_manager.workspace):
+                    return await runnable.ainvoke(input={"instruction": req["instruction"]}, config=runnable_config)
+            finally:
+                await asyncio.to_thread(self._release_context_providers, run_manager.context_providers)
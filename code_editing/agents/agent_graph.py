@@ -8,9 +8,10 @@ from langchain_core.tools import BaseTool
 from langgraph.prebuilt import create_react_agent
 
 from code_editing.agents.context_providers.context_provider import ContextProvider
-from code_editing.agents.run import AgentRunManager
+from code_editing.agents.run import AgentRunManager, get_current_run_manager
 from code_editing.agents.tools.common import dummy
 from code_editing.scripts.common import logger
+from code_editing.utils.tracing import span
 
 
 class AgentInput(TypedDict):
@@ -24,9 +25,15 @@ class AgentGraph(Runnable, ABC):
     This is a helper class for making a langgraph runnable for code editing.
 
     The runnable accepts an input of type AgentInput.
+
+    A graph built without a run manager is a template shared by the runs: it gets the run manager of the current run
+    from the runnable config (see get_current_run_manager) and calls the tools of the run through the tool templates.
+    Only the graphs that keep no per-run state in the runnable can be shared, see `reusable`.
     """
 
     name = "base_agentgraph"
+    # Whether the runnable keeps no per-run state, so that it can be compiled once and shared by the runs
+    reusable: bool = False
 
     def __init__(
         self,
@@ -46,15 +53,24 @@ class AgentGraph(Runnable, ABC):
     def _runnable(self) -> Runnable:
         pass
 
-    def invoke(self, *args, **kwargs):
+    def compile(self) -> Runnable:
         if self.__cached_runnable is None or not self.do_cache:
-            self.__cached_runnable = self._runnable
-        return self.__cached_runnable.invoke(*args, **kwargs)
+            with span("compile_graph", graph=self.name):
+                self.__cached_runnable = self._runnable
+        return self.__cached_runnable
+
+    def invoke(self, *args, **kwargs):
+        return self.compile().invoke(*args, **kwargs)
 
     async def ainvoke(self, *args, **kwargs):
-        if self.__cached_runnable is None or not self.do_cache:
-            self.__cached_runnable = self._runnable
-        return await self.__cached_runnable.ainvoke(*args, **kwargs)
+        return await self.compile().ainvoke(*args, **kwargs)
+
+    @property
+    def current_run_manager(self) -> AgentRunManager:
+        """Run manager of the graph or, for a template, of the current run. Call it from the runnable only."""
+        if self.run_manager is not None:
+            return self.run_manager
+        return get_current_run_manager()
 
     @property
     def root_params(self):
@@ -87,7 +103,7 @@ class AgentGraph(Runnable, ABC):
     T = TypeVar("T", bound=ContextProvider)
 
     def get_ctx_provider(self, ctx_provider_name: Union[str, Type[T]]) -> T:
-        return self.run_manager.get_ctx_provider(ctx_provider_name)
+        return self.current_run_manager.get_ctx_provider(ctx_provider_name)
 
 
 AgentGraphPartial = Callable[..., AgentGraph]
@@ -1,4 +1,5 @@
-from typing import Dict, List
+import functools
+from typing import Dict, List, Tuple
 
 from langchain_core.runnables import Runnable, RunnableLambda
 from langgraph.graph import END, StateGraph
@@ -21,10 +22,18 @@ class CollectEdit(AgentGraph):
         self.editor = editor
         self.only_collect = only_collect
 
+    @functools.cached_property
+    def _nodes(self) -> Tuple[AgentGraph, AgentGraph]:
+        return self.context_collector(**self.root_params), self.editor(**self.root_params)
+
+    @property
+    def reusable(self) -> bool:
+        context_collector, editor = self._nodes
+        return context_collector.reusable and (self.only_collect or editor.reusable)
+
     @property
     def _runnable(self) -> Runnable:
-        context_collector = self.context_collector(**self.root_params)
-        editor = self.editor(**self.root_params)
+        context_collector, editor = self._nodes
 
         workflow = StateGraph(dict)
 
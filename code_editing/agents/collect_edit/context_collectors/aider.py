@@ -15,6 +15,7 @@ logger = logging.getLogger(__name__)
 
 class AiderRetrieval(AgentGraph):
     name = "aider_retrieval"
+    reusable = True
 
     def __init__(self, select_prompt: PromptWrapper, **kwargs):
         super().__init__(**kwargs)
@@ -22,10 +23,8 @@ class AiderRetrieval(AgentGraph):
 
     @property
     def _runnable(self):
-        aider = self.get_ctx_provider(AiderRepoMap)
-        repo_map = aider.get_repo_map()
-
         def to_viewed_lines(state: dict):
+            aider = self.get_ctx_provider(AiderRepoMap)
             files = set(state["matches"])
             viewed_lines = {}
             for file in files:
@@ -38,7 +37,10 @@ class AiderRetrieval(AgentGraph):
             return {"collected_context": viewed_lines}
 
         return (
-            {"repo_map": lambda _: repo_map, "instruction": itemgetter("instruction")}
+            {
+                "repo_map": lambda _: self.get_ctx_provider(AiderRepoMap).get_repo_map(),
+                "instruction": itemgetter("instruction"),
+            }
             | self.select_prompt.as_runnable()
             | self.llm
             | TagParser(tag="file")
@@ -10,6 +10,7 @@ from code_editing.utils.tokenization_utils import TokenizationUtils
 
 class AsIsRetrieval(AgentGraph):
     name = "as_is_retrieval"
+    reusable = True
 
     def __init__(self, k: Optional[int] = 10, total_context: Optional[int] = None, **kwargs):
         super().__init__(**kwargs)
@@ -21,9 +22,8 @@ class AsIsRetrieval(AgentGraph):
 
     @property
     def _runnable(self):
-        retrieval_helper = self.get_ctx_provider(RetrievalHelper)
-
         def search(state: CollectEditState, config) -> CollectEditState:
+            retrieval_helper = self.get_ctx_provider(RetrievalHelper)
             if self.k is not None:
                 docs = retrieval_helper.search(state["instruction"], k=self.k, callbacks=config["callbacks"])
             else:
@@ -1,9 +1,10 @@
 # Original:
 import ast
 import inspect
+import json
 import logging
 import re
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
@@ -15,6 +16,7 @@ from code_editing.agents.agent_graph import AgentGraph
 from code_editing.agents.context_providers.acr_search.search_manage import SearchManager
 from code_editing.agents.context_providers.acr_search.search_utils import to_relative_path
 from code_editing.agents.run import ToolUseStatus
+from code_editing.utils.concurrency import map_concurrently
 
 SYSTEM_PROMPT = """You are a software developer maintaining a large project.
 You are working on an issue submitted to your project.
@@ -156,9 +158,10 @@ def remove_unwanted_lines(text: str, word: str) -> str:
 class ACRRetrieval(AgentGraph):
     name = "acr_retrieval"
 
-    def __init__(self, max_tries: int = 5, use_show_definition: bool = False, **kwargs):
+    def __init__(self, max_tries: int = 5, use_show_definition: bool = False, max_search_workers: int = 4, **kwargs):
         super().__init__(**kwargs)
         self.max_tries = max_tries
+        self.max_search_workers = max_search_workers
         self.prompt = prompt
         self.proxy_prompt = PROXY_PROMPT
         if not use_show_definition:
@@ -200,6 +203,24 @@ class ACRRetrieval(AgentGraph):
 
         messages: List[BaseMessage] = [SystemMessage(SYSTEM_PROMPT)]
 
+        # Bug location -> result or error of the lookup and the lines viewed by it, reused by collect_context
+        bug_location_cache: Dict[str, Tuple[Any, Optional[Exception], List[Tuple[str, int, int]]]] = {}
+
+        def locate(bug_location: dict) -> Tuple[Any, List[Tuple[str, int, int]]]:
+            key = json.dumps(bug_location, sort_keys=True, default=str)
+            cached = bug_location_cache.get(key)
+            if cached is None:
+                with search_manager.capture_viewed_lines() as viewed:
+                    try:
+                        cached = (search_for_bug_location(search_manager, bug_location), None, viewed)
+                    except Exception as e:
+                        cached = (None, e, viewed)
+                bug_location_cache[key] = cached
+            res, error, viewed = cached
+            if error is not None:
+                raise error
+            return res, viewed
+
         def start(state):
             nonlocal messages
             instruction = state["instruction"]
@@ -231,14 +252,17 @@ class ACRRetrieval(AgentGraph):
                 state["bug_locations"] = bug_locations
 
                 if bug_locations:
-                    collated_tool_response = ""
                     # check bug locations
-                    for bug_location in bug_locations:
+                    def check_bug_location(bug_location):
                         try:
-                            tool_output, *_ = search_for_bug_location(search_manager, bug_location)
+                            tool_output, *_ = locate(bug_location)[0]
                         except Exception as e:
                             tool_output = f"Cound not find bug location: {e}"
-                        collated_tool_response += f"\n\n{tool_output}\n"
+                        return f"\n\n{tool_output}\n"
+
+                    collated_tool_response = "".join(
+                        map_concurrently(check_bug_location, bug_locations, self.max_search_workers)
+                    )
 
                     if "Unknown function" in collated_tool_response or "Could not" in collated_tool_response:
                         messages.append(
@@ -250,28 +274,30 @@ class ACRRetrieval(AgentGraph):
 
                 return state
 
+        def run_api_call(api_call: str) -> str:
+            try:
+                func_name, func_args = parse_function_invocation(api_call)
+                function = getattr(search_manager, func_name)
+                try:
+                    run_manager.log_tool_use(func_name, ToolUseStatus.CALL)
+                    res, summary, ok = function(*func_args)
+                    if ok:
+                        run_manager.log_tool_use(func_name, ToolUseStatus.OK)
+                    else:
+                        run_manager.log_tool_use(func_name, ToolUseStatus.FAIL)
+                except Exception:
+                    run_manager.log_tool_use(func_name, ToolUseStatus.THROWN)
+                    raise
+                return f"Result of {func_name}({', '.join(func_args)}):\n{res}\n"
+            except Exception as e:
+                return f"Error in {api_call}: {e}\n"
+
         def do_search(state):
             nonlocal messages, llm, run_manager
             api_calls = state["api_calls"]
             if api_calls:
-                tool_output = ""
-                for api_call in api_calls:
-                    try:
-                        func_name, func_args = parse_function_invocation(api_call)
-                        function = getattr(search_manager, func_name)
-                        try:
-                            run_manager.log_tool_use(func_name, ToolUseStatus.CALL)
-                            res, summary, ok = function(*func_args)
-                            if ok:
-                                run_manager.log_tool_use(func_name, ToolUseStatus.OK)
-                            else:
-                                run_manager.log_tool_use(func_name, ToolUseStatus.FAIL)
-                        except Exception:
-                            run_manager.log_tool_use(func_name, ToolUseStatus.THROWN)
-                            raise
-                        tool_output += f"Result of {func_name}({', '.join(func_args)}):\n{res}\n"
-                    except Exception as e:
-                        tool_output += f"Error in {api_call}: {e}\n"
+                # The calls are independent lookups, the results are kept in the order of the calls
+                tool_output = "".join(map_concurrently(run_api_call, api_calls, self.max_search_workers))
                 messages.append(HumanMessage(tool_output))
                 messages.append(HumanMessage("Let's analyze collected context first"))
                 res = llm.invoke(messages)
@@ -293,11 +319,12 @@ class ACRRetrieval(AgentGraph):
 
         def collect_context(state):
             bug_locations = state.get("bug_locations", [])
-            search_manager.is_tracking = True
-            for bug_location in bug_locations:
-                search_for_bug_location(search_manager, bug_location)
-            # compile into dict of lines
-            segments = search_manager.viewed_lines
+            # The locations found by the search phase are not looked up again
+            segments = [
+                segment
+                for _, viewed in map_concurrently(locate, bug_locations, self.max_search_workers)
+                for segment in viewed
+            ]
             ctx = {}
             for file_name, st, end in segments:
                 fname = to_relative_path(file_name, self.run_manager.repo_path).replace("\\", "/")
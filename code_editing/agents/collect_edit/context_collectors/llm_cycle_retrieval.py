@@ -13,6 +13,7 @@ from code_editing.agents.utils import PromptWrapper
 
 class LLMCycleRetrieval(LLMRetrieval):
     name = "llm_cycle_retrieval"
+    reusable = False
 
     def __init__(self, review_prompt: PromptWrapper, max_tries: int = 5, **kwargs):
         super().__init__(**kwargs)
@@ -9,6 +9,7 @@ from code_editing.utils.tokenization_utils import TokenizationUtils
 
 class LLMFixedCtxRetrieval(LLMRetrieval):
     name = "llm_fixed_ctx_retrieval"
+    reusable = False
 
     def __init__(self, total_context: int = 10000, max_searches=10, **kwargs):
         super().__init__(**kwargs)
@@ -8,6 +8,7 @@ from code_editing.agents.utils import PromptWrapper
 
 class LLMRetrieval(AgentGraph):
     name = "llm_retrieval"
+    reusable = True
 
     def __init__(self, search_prompt: PromptWrapper, do_review: bool = True, **kwargs):
         super().__init__(**kwargs)
@@ -16,15 +17,16 @@ class LLMRetrieval(AgentGraph):
 
     @property
     def _runnable(self):
-        retrieval_helper = self.get_ctx_provider("retrieval_helper")
-
         return (
             self.search_prompt.as_runnable(to_dict=True)
-            | self.react_agent(tools=self.get_llm_retrieval_tools(retrieval_helper))
-            | {"collected_context": lambda _: retrieval_helper.viewed_lines}
+            | self.react_agent(tools=self.get_llm_retrieval_tools())
+            | {"collected_context": lambda _: self.get_ctx_provider("retrieval_helper").viewed_lines}
         )
 
-    def get_llm_retrieval_tools(self, retrieval_helper):
+    def get_llm_retrieval_tools(self, retrieval_helper=None):
+        """
+        @param retrieval_helper: Retrieval helper of the run (by default, the one of the current run is used)
+        """
         # Find the code search tool
         search_tools = [t for t in self.tools if "search" in t.name]
 
@@ -34,8 +36,9 @@ class LLMRetrieval(AgentGraph):
 
             Accepts the file name, start line and end line (exclusive) of the code snippet.
             """
+            helper = retrieval_helper or self.get_ctx_provider("retrieval_helper")
             try:
-                file = parse_file(file_name, retrieval_helper.repo_path)
+                file = parse_file(file_name, helper.repo_path)
                 contents = read_file_full(file)
                 num_lines = len(contents.split("\n"))
             except ToolException as e:
@@ -46,7 +49,7 @@ class LLMRetrieval(AgentGraph):
                 return "End line must be greater than the start line"
             if end_line > num_lines:
                 return f"End line is greater than the number of lines in the file ({num_lines})"
-            retrieval_helper.add_viewed_doc(file_name, start_line, end_line)
+            helper.add_viewed_doc(file_name, start_line, end_line)
             return (
                 "Code snippet has been added to the context. You can add more snippets or finish the run if you "
                 "think you have found all relevant code."
@@ -14,6 +14,7 @@ from code_editing.agents.agent_graph import AgentGraph
 from code_editing.agents.context_providers.acr_search.search_manage import SearchManager
 from code_editing.agents.context_providers.retrieval.retrieval_helper import RetrievalHelper
 from code_editing.agents.tools.common import lines_format_document
+from code_editing.utils.concurrency import map_concurrently
 
 SYSTEM_PROMPT = """You are a software developer maintaining a large project.
 You are working on an issue submitted to your project.
@@ -146,10 +147,11 @@ class RetrievalSearchManager:
 class MyACRRetrieval(AgentGraph):
     name = "my_acr_retrieval"
 
-    def __init__(self, max_tries: int = 5, max_iters: int = 15, **kwargs):
+    def __init__(self, max_tries: int = 5, max_iters: int = 15, max_search_workers: int = 4, **kwargs):
         super().__init__(**kwargs)
         self.max_tries = max_tries
         self.max_iters = max_iters
+        self.max_search_workers = max_search_workers
 
     def proxy_run(self, text: str) -> Optional[dict]:
         messages = [SystemMessage(PROXY_PROMPT)]
@@ -223,15 +225,18 @@ class MyACRRetrieval(AgentGraph):
             nonlocal messages, llm, search_manager
             api_calls = state["api_calls"]
             if api_calls:
-                tool_output = ""
-                for api_call in api_calls:
+
+                def run_api_call(api_call: str) -> str:
                     try:
                         func_name, func_args = parse_function_invocation(api_call)
                         function = getattr(search_manager, func_name)
                         res = function(*func_args, run_manager=run_manager)
-                        tool_output += f"Result of {func_name}({', '.join(func_args)}):\n{res}\n"
+                        return f"Result of {func_name}({', '.join(func_args)}):\n{res}\n"
                     except Exception as e:
-                        tool_output += f"Error in {api_call}: {e}\n"
+                        return f"Error in {api_call}: {e}\n"
+
+                # The searches wait for the embeddings independently, the results are kept in the order of the calls
+                tool_output = "".join(map_concurrently(run_api_call, api_calls, self.max_search_workers))
                 messages.append(HumanMessage(tool_output))
                 messages.append(HumanMessage("Let's analyze collected context first"))
                 res = llm.invoke(messages)
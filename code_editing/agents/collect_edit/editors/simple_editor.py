@@ -97,7 +97,8 @@ class SimpleEditor(AgentGraph):
                     print(e)
 
             # Write the new code to the file
-            write_file_full(file, new_code)
+            self.run_manager.before_write()
+            write_file_full(file, new_code, self.run_manager.journal)
             # Update the state
             res = state.copy()
             res["edited_files"] = list(edited_files | {file_name})
@@ -5,6 +5,7 @@ from langchain_core.exceptions import OutputParserException
 from langchain_core.output_parsers import BaseOutputParser
 
 from code_editing.agents.tools.common import read_file_full
+from code_editing.utils.piece_table import PieceTable
 
 
 def process_edit(file, lines_to_edit: List[int], edit_func: Callable[[str, str], str]) -> str:
@@ -21,27 +22,21 @@ def process_edit(file, lines_to_edit: List[int], edit_func: Callable[[str, str],
     """
     # Read the file
     code = read_file_full(file)
-    code_lines = code.split("\n")
-    # Result code
-    result_code = code_lines
+    # The segments address the original lines, the edits are collected in a piece table
+    result_code = PieceTable(code)
     # Split the lines to edit into segments of contiguous lines
     segments = split_into_segments(lines_to_edit)
-    # Delta lines (number of lines added or removed)
-    delta_lines = -1  # -1 because the first line is 0
     # Process the segments
     for start, end in segments:
         assert start > 0, f"Line numbers should be 1-based, got {start}."
         # Get the snippet of code
-        len1 = end - start
-        snippet = "\n".join(code_lines[start + delta_lines : end + delta_lines])
+        snippet = result_code.original_lines(start - 1, end - 1)
         # Edit the snippet
         edited_snippet = edit_func(file, snippet)
         # Replace the snippet in the result code
-        len2 = edited_snippet.count("\n") + 1
-        result_code = result_code[: start + delta_lines] + edited_snippet.split("\n") + result_code[end + delta_lines :]
-        delta_lines += len2 - len1
+        result_code.replace_lines(start - 1, end - 1, edited_snippet)
     # Save the edited code
-    return "\n".join(result_code)
+    return result_code.text()
 
 
 def split_into_segments(lines: List[int]) -> List[Tuple[int, int]]:
@@ -1,13 +1,18 @@
 # Original: https://github.com/nus-apr/auto-code-rover/blob/main/app/search/search_manage.py
 import os.path
+import threading
 from collections import defaultdict, namedtuple
 from collections.abc import MutableMapping
-from typing import List, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
 
 import jedi
 
 from code_editing.agents.context_providers.acr_search import search_utils
 from code_editing.agents.context_providers.acr_search.search_utils import SearchResult
+from code_editing.agents.context_providers.context_provider import ContextProvider
+from code_editing.utils.tracing import span
 
 LineRange = namedtuple("LineRange", ["start", "end"])
 
@@ -17,8 +22,11 @@ FuncIndexType = MutableMapping[str, list[tuple[str, LineRange]]]
 
 RESULT_SHOW_LIMIT = 3
 
+# Lines viewed by the searches in the current context, see SearchManager.capture_viewed_lines
+_viewed_capture: ContextVar[Optional[List[Tuple[str, int, int]]]] = ContextVar("acr_viewed_capture", default=None)
 
-class SearchManager:
+
+class SearchManager(ContextProvider):
     def __init__(self, repo_path: str, show_lineno: bool = False, **kwargs):
         self.project_path = repo_path
         # list of all files ending with .py, which are likely not test files
@@ -36,13 +44,45 @@ class SearchManager:
 
         # function name -> [(file_name, line_range)]
         self.function_index: FuncIndexType = {}
-        self._build_index()
+        with span("acr_index") as index_span:
+            self._build_index()
+            if index_span is not None:
+                index_span.set(files=len(self.parsed_files))
         self.viewed_lines: List[Tuple[str, int, int]] = []
 
         self.is_tracking = False
         self.show_lineno = show_lineno
 
         self.jedi_project = jedi.Project(self.project_path)
+        # jedi is not thread-safe, while the searches may run concurrently
+        self._jedi_lock = threading.Lock()
+
+    def reset(self) -> None:
+        self.viewed_lines = []
+        self.is_tracking = False
+
+    @contextmanager
+    def capture_viewed_lines(self):
+        """Collect the lines viewed by the searches made in this context into the yielded list."""
+        viewed: List[Tuple[str, int, int]] = []
+        token = _viewed_capture.set(viewed)
+        try:
+            yield viewed
+        finally:
+            _viewed_capture.reset(token)
+
+    def _add_viewed_lines(self, file_path: str, start_line: int, end_line: int) -> None:
+        if self.is_tracking:
+            self.viewed_lines.append((file_path, start_line, end_line))
+        captured = _viewed_capture.get()
+        if captured is not None:
+            captured.append((file_path, start_line, end_line))
+
+    def memory_usage(self) -> int:
+        # Roughly 200 bytes per (file, line range) entry of the indices
+        entries = sum(len(v) for v in self.class_index.values()) + sum(len(v) for v in self.function_index.values())
+        entries += sum(len(v) for methods in self.class_func_index.values() for v in methods.values())
+        return 200 * entries
 
     def _build_index(self):
         """
@@ -231,8 +271,7 @@ class SearchManager:
 
         search_res: list[SearchResult] = []
         for fname, (start, end) in self.class_index[class_name]:
-            if self.is_tracking:
-                self.viewed_lines.append((fname, start, end))
+            self._add_viewed_lines(fname, start, end)
             # there are some classes; we return their signatures
             code = search_utils.get_class_signature(fname, class_name, show_lineno=self.show_lineno)
             res = SearchResult(fname, class_name, None, code)
@@ -473,8 +512,9 @@ class SearchManager:
             return tool_output, summary, False
 
         col_offset = line.index(symbol)
-        jedi_script = jedi.Script(path=full_file_path, project=self.jedi_project)
-        definitions = jedi_script.infer(line_number, col_offset)
+        with self._jedi_lock:
+            jedi_script = jedi.Script(path=full_file_path, project=self.jedi_project)
+            definitions = jedi_script.infer(line_number, col_offset)
         if not definitions:
             tool_output = f"Could not find definition of symbol `{symbol}` in line {line_number} of file {file_path}."
             summary = tool_output
@@ -500,8 +540,7 @@ class SearchManager:
         return tool_output, summary, True
 
     def retrieve_code_snippet(self, file_path: str, start_line: int, end_line: int) -> str:
-        if self.is_tracking:
-            self.viewed_lines.append((file_path, start_line, end_line))
+        self._add_viewed_lines(file_path, start_line, end_line)
         return search_utils.get_code_snippets(file_path, start_line, end_line, show_lineno=self.show_lineno)
 
 
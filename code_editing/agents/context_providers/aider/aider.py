@@ -26,6 +26,10 @@ class AiderRepoMap(ContextProvider):
             # max_context_window=120000
         )
 
+    def memory_usage(self) -> int:
+        # Roughly 200 bytes per cached tag, the tags are cached by file modification time
+        return 200 * sum(len(entry["data"]) for entry in getattr(self.rm, "TAGS_CACHE", {}).values())
+
     def get_repo_map(self) -> str:
         fnames = find_src_files(self.repo_path)
         repo_map = self.rm.get_repo_map([], fnames)
@@ -1,9 +1,31 @@
 from abc import ABC, ABCMeta, abstractmethod
+from typing import Tuple
 
 
 class ContextProvider(ABC):
     __metaclass__ = ABCMeta
 
+    # Methods that can be called before a lazy provider is built, their calls are replayed after the build
+    deferred_methods: Tuple[str, ...] = ()
+    # Whether a lazy provider has to be built before the run writes to the workspace (e.g. it saves a shared index)
+    needs_clean_build: bool = False
+
     @abstractmethod
     def __init__(self, repo_path: str, data_path: str, *args, **kwargs):
         pass
+
+    def reset(self) -> None:
+        """Clear the per-run state (e.g. viewed lines), so that the provider can be reused by another run."""
+        pass
+
+    def close(self) -> None:
+        """Stop the background work of the run (e.g. queued reindexing) before the provider is reused or dropped."""
+        pass
+
+    def is_dirty(self) -> bool:
+        """Whether the shared state no longer matches the clean repository (e.g. after reindexing edited files)."""
+        return False
+
+    def memory_usage(self) -> int:
+        """Approximate size of the provider in bytes."""
+        return 0
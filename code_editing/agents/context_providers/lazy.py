@@ -0,0 +1,110 @@
+import contextvars
+import logging
+import threading
+from concurrent.futures import Executor
+from typing import Any, Callable, List, Optional, Tuple, Type
+
+from code_editing.agents.context_providers.context_provider import ContextProvider
+
+logger = logging.getLogger("agents.lazy_context")
+
+
+class LazyContextProvider:
+    """
+    Proxy of a context provider that is built on the first access to it, e.g. when a tool uses it.
+
+    The class of the provider is known in advance, so the providers can be looked up by type without building them.
+    Calls of the provider's `deferred_methods` made before it is built are replayed right after the build. A provider
+    built after the run has written to the workspace is marked as dirty, as its state does not match the clean commit.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        provider_cls: Type[ContextProvider],
+        build: Callable[[], ContextProvider],
+        is_workspace_clean: Callable[[], bool],
+    ):
+        """
+        @param name: Name of the provider in the config
+        @param provider_cls: Class of the provider
+        @param build: Builds the provider
+        @param is_workspace_clean: Whether the workspace is still at the clean commit
+        """
+        object.__setattr__(self, "_lazy_name", name)
+        object.__setattr__(self, "_lazy_cls", provider_cls)
+        object.__setattr__(self, "_lazy_build", build)
+        object.__setattr__(self, "_lazy_is_workspace_clean", is_workspace_clean)
+        object.__setattr__(self, "_lazy_provider", None)
+        object.__setattr__(self, "_lazy_dirty", False)
+        object.__setattr__(self, "_lazy_deferred", [])
+        object.__setattr__(self, "_lazy_lock", threading.RLock())
+
+    @property
+    def provider_cls(self) -> Type[ContextProvider]:
+        return self._lazy_cls
+
+    @property
+    def is_built(self) -> bool:
+        return self._lazy_provider is not None
+
+    @property
+    def built_on_dirty_workspace(self) -> bool:
+        return self._lazy_dirty
+
+    def get(self) -> ContextProvider:
+        """Build the provider if it is not built yet."""
+        provider = self._lazy_provider
+        if provider is not None:
+            return provider
+        with self._lazy_lock:
+            if self._lazy_provider is None:
+                dirty = not self._lazy_is_workspace_clean()
+                provider = self._lazy_build()
+                deferred: List[Tuple[str, tuple, dict]] = self._lazy_deferred
+                for method, args, kwargs in deferred:
+                    getattr(provider, method)(*args, **kwargs)
+                deferred.clear()
+                object.__setattr__(self, "_lazy_dirty", dirty)
+                object.__setattr__(self, "_lazy_provider", provider)
+            return self._lazy_provider
+
+    def unwrap(self) -> Optional[ContextProvider]:
+        """The built provider or None if it has not been built. Waits for a build in progress."""
+        with self._lazy_lock:
+            return self._lazy_provider
+
+    def speculate(self, executor: Executor) -> None:
+        """Start building the provider in the background, e.g. while the first LLM call is in flight."""
+        ctx = contextvars.copy_context()
+
+        def build():
+            try:
+                ctx.run(self.get)
+            except Exception as e:
+                # The build is retried (and the error is raised) on the first access
+                logger.warning(f"Speculative build of {self._lazy_name} failed", exc_info=e)
+
+        executor.submit(build)
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_lazy_"):
+            raise AttributeError(name)
+        if self._lazy_provider is None and name in self._lazy_cls.deferred_methods:
+
+            def defer(*args, **kwargs):
+                with self._lazy_lock:
+                    if self._lazy_provider is None:
+                        self._lazy_deferred.append((name, args, kwargs))
+                        return None
+                return getattr(self._lazy_provider, name)(*args, **kwargs)
+
+            return defer
+        return getattr(self.get(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self.get(), name, value)
+
+    def __repr__(self) -> str:
+        state = "built" if self.is_built else "not built"
+        return f"LazyContextProvider({self._lazy_name}: {self._lazy_cls.__name__}, {state})"
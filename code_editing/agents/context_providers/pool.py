@@ -0,0 +1,105 @@
+import collections
+import logging
+import threading
+from typing import Any, Dict, Hashable, List, Tuple
+
+from hydra.utils import instantiate
+from omegaconf import DictConfig, OmegaConf
+
+from code_editing.agents.context_providers.context_provider import ContextProvider
+from code_editing.utils.git_utils import get_head_sha_unsafe
+
+logger = logging.getLogger("agents.context_pool")
+
+
+class ContextProviderPool:
+    """
+    Pool of warm context providers keyed by (provider config, repository path, head commit).
+
+    A provider is used by one run at a time. When the run is over, the provider is reset and kept for the next run at
+    the same commit, unless the run has made it dirty. Idle providers are evicted in the LRU order when there are more
+    than [max_size] of them or their approximate memory usage exceeds [max_memory_mb]. Thread-safe.
+    """
+
+    def __init__(self, max_size: int = 16, max_memory_mb: int = 4096):
+        self.max_size = max_size
+        self.max_memory = max_memory_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        # Key -> idle providers, in the LRU order of the keys
+        self._idle: "collections.OrderedDict[Hashable, List[ContextProvider]]" = collections.OrderedDict()
+        self._memory: Dict[int, int] = {}
+        # Providers in use -> their keys (the providers are referenced, so that their ids are not reused)
+        self._in_use: Dict[int, Tuple[Hashable, ContextProvider]] = {}
+        self.stats = {"hits": 0, "misses": 0, "discarded": 0, "evicted": 0}
+
+    @staticmethod
+    def _config_key(cfg: Any) -> str:
+        if isinstance(cfg, DictConfig):
+            return OmegaConf.to_yaml(cfg, resolve=True)
+        return repr(cfg)
+
+    def acquire(self, cfg: Any, repo_path: str, data_path: str) -> Tuple[ContextProvider, bool]:
+        """Get a clean provider for the repository at its current head. Returns the provider and whether it was warm."""
+        key = (self._config_key(cfg), repo_path, get_head_sha_unsafe(repo_path, data_path))
+        provider = None
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                provider = idle.pop()
+                self._memory.pop(id(provider), None)
+                if not idle:
+                    del self._idle[key]
+                self.stats["hits"] += 1
+            else:
+                self.stats["misses"] += 1
+        warm = provider is not None
+        if provider is None:
+            provider = instantiate(cfg, repo_path=repo_path, data_path=data_path)
+        with self._lock:
+            self._in_use[id(provider)] = key, provider
+        return provider, warm
+
+    def release(self, provider: ContextProvider) -> None:
+        """Return a provider after the run. Dirty providers are discarded."""
+        with self._lock:
+            key, _ = self._in_use.pop(id(provider), (None, None))
+        if key is None:
+            return
+        # The pending work of the run would touch the workspace of the next one
+        provider.close()
+        if provider.is_dirty():
+            with self._lock:
+                self.stats["discarded"] += 1
+            return
+        provider.reset()
+        memory = provider.memory_usage()
+        with self._lock:
+            self._idle.setdefault(key, []).append(provider)
+            self._idle.move_to_end(key)
+            self._memory[id(provider)] = memory
+            self._evict()
+
+    def discard(self, provider: ContextProvider) -> None:
+        """Drop a provider after the run instead of returning it to the pool."""
+        provider.close()
+        with self._lock:
+            if self._in_use.pop(id(provider), None) is not None:
+                self.stats["discarded"] += 1
+
+    def _evict(self):
+        while self._idle and (
+            sum(len(idle) for idle in self._idle.values()) > self.max_size
+            or sum(self._memory.values()) > self.max_memory
+        ):
+            key, idle = next(iter(self._idle.items()))
+            provider = idle.pop(0)
+            self._memory.pop(id(provider), None)
+            if not idle:
+                del self._idle[key]
+            self.stats["evicted"] += 1
+            logger.debug(f"Evicted {type(provider).__name__} for {key[1]}@{key[2][:8]}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._idle.clear()
+            self._memory.clear()
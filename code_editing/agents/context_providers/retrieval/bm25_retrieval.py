@@ -7,7 +7,7 @@ from code_editing.agents.context_providers.retrieval.retrieval_helper import Ret
 
 
 class BM25Retrieval(RetrievalHelper):
-    def search(self, query: str, k: int, run_manager=None, callbacks=None) -> List[Document]:
+    def _search(self, query: str, k: int, run_manager=None, callbacks=None) -> List[Document]:
         if run_manager is not None:
             callbacks = run_manager.get_child()
 
@@ -4,6 +4,7 @@ import shutil
 import tempfile
 from typing import List
 
+from filelock import FileLock
 from langchain.indexes import SQLRecordManager, index
 from langchain_community.vectorstores.faiss import FAISS
 from langchain_core.documents import Document
@@ -11,6 +12,7 @@ from langchain_openai import OpenAIEmbeddings
 from sqlalchemy import create_engine
 
 from code_editing.agents.context_providers.retrieval.retrieval_helper import RetrievalHelper
+from code_editing.utils.tracing import span
 from code_editing.utils.wandb_utils import get_current_ms
 
 
@@ -20,37 +22,48 @@ class FaissRetrieval(RetrievalHelper):
         super().__init__(**kwargs)
 
     db: FAISS = None
+    _dirty: bool = False
+    # The first build saves the vector store of the base commit
+    needs_clean_build = True
 
-    def search(self, query: str, k: int, run_manager=None, callbacks=None) -> List[Document]:
+    def _search(self, query: str, k: int, run_manager=None, callbacks=None) -> List[Document]:
         if run_manager is not None:
             callbacks = run_manager.get_child()
         return self.db.as_retriever(k=k).get_relevant_documents(query, callbacks=callbacks)
 
     def _init_db(self):
         logging.getLogger("faiss.loader").setLevel(logging.WARNING)
+        # Worktrees of the same repository at the same commit share the namespace, only one of them builds the store
+        with FileLock(os.path.join(self.vector_path, f"{self.namespace}.lock")):
+            self._init_db_unsafe()
+        with span("faiss_record_manager"):
+            self._init_record_manager()
+
+    def _init_db_unsafe(self):
         # Invariant: the saved db contents correspond to the unchanged state of the repo at base commit
         is_first_time = not os.path.exists(os.path.join(self.vector_path, f"{self.namespace}.faiss"))
         if is_first_time:
             # Create a new vector store with placeholder documents
             self.logger.info(f"No vector store found for {self.namespace}. Creating a new one. This may take a while.")
             start_ms = get_current_ms()
-            self.db = FAISS.from_documents(self._placeholder_docs(), self.embeddings)
-            self.db.as_retriever()
-            # Connect to the global record manager and initialize a corresponding namespace
-            db_url = "sqlite:///" + self.global_record_manager_path
-            global_record_manager = SQLRecordManager(self.namespace, db_url=db_url)
-            global_record_manager.create_schema()
-            # Index all the documents, save the record manager for the future use
-            self._reindex_full(global_record_manager)
-            # Save the db to the disk
-            self.db.save_local(self.vector_path, index_name=self.namespace)
+            with span("faiss_build"):
+                self.db = FAISS.from_documents(self._placeholder_docs(), self.embeddings)
+                self.db.as_retriever()
+                # Connect to the global record manager and initialize a corresponding namespace
+                db_url = "sqlite:///" + self.global_record_manager_path
+                global_record_manager = SQLRecordManager(self.namespace, db_url=db_url)
+                global_record_manager.create_schema()
+                # Index all the documents, save the record manager for the future use
+                self._reindex_full(global_record_manager)
+                # Save the db to the disk
+                self.db.save_local(self.vector_path, index_name=self.namespace)
             self.logger.info(
                 f"Vector store created for {self.namespace} in {round((get_current_ms() - start_ms) / 1000, 2)} seconds."
             )
         else:
             # Load the existing vector store
-            self.db = FAISS.load_local(self.vector_path, self.embeddings, index_name=self.namespace)
-        self._init_record_manager()
+            with span("faiss_load"):
+                self.db = FAISS.load_local(self.vector_path, self.embeddings, index_name=self.namespace)
 
     def __del__(self):
         if hasattr(self, "record_manager"):
@@ -86,4 +99,16 @@ class FaissRetrieval(RetrievalHelper):
         index(docs, record_manager, self.db, cleanup="full", source_id_key="source")
 
     def reindex_incremental(self, docs: List[Document]):
+        # The store no longer matches the base commit, so it can not be reused by other runs
+        self._dirty = True
         index(docs, self.record_manager, self.db, cleanup="incremental", source_id_key="source")
+
+    def is_dirty(self) -> bool:
+        # The queued changes would make it dirty as soon as they are reindexed
+        with self._index_lock.read():
+            return self._dirty or self.has_pending_reindex()
+
+    def memory_usage(self) -> int:
+        index_size = self.db.index.ntotal * self.db.index.d * 4
+        docs_size = sum(len(doc.page_content) for doc in self.db.docstore._dict.values())
+        return index_size + docs_size
@@ -1,7 +1,8 @@
 import logging
 import os.path
+import threading
 from abc import abstractmethod
-from typing import List
+from typing import Dict, List, Optional
 
 from hydra.utils import get_class
 from langchain.text_splitter import TextSplitter
@@ -13,19 +14,42 @@ from code_editing.agents.context_providers.context_provider import ContextProvid
 from code_editing.agents.context_providers.retrieval.file_extensions import extensions, filter_docs
 from code_editing.agents.tools.common import parse_file, read_file
 from code_editing.configs.agents.context_providers.loader_config import LoaderConfig
+from code_editing.utils.concurrency import ReadWriteLock
 from code_editing.utils.git_utils import get_head_sha_unsafe
+from code_editing.utils.tracing import span
 
 
 class RetrievalHelper(ContextProvider):
-    def __init__(self, repo_path: str, data_path: str, splitter: TextSplitter, loader: LoaderConfig):
+    # Changed files are reindexed after the build
+    deferred_methods = ("add_changed_file",)
+
+    def __init__(
+        self,
+        repo_path: str,
+        data_path: str,
+        splitter: TextSplitter,
+        loader: LoaderConfig,
+        reindex_delay: float = 1.0,
+    ):
         """
         RetrievalHelper
 
         Helper class for retrieving documents using Faiss vector store.
         Handles loading, embedding, indexing, db saving and loading.
+
+        Changed files are reindexed in the background [reindex_delay] seconds after the last change, and before the
+        next search at the latest.
         """
         self.repo_path = repo_path
         self.data_path = data_path
+        self.reindex_delay = reindex_delay
+
+        # Changed files waiting for the reindexing (an ordered set), the index is updated and read under _index_lock,
+        # the searches run concurrently (e.g. while waiting for the query embeddings)
+        self._pending: Dict[str, None] = {}
+        self._pending_lock = threading.Lock()
+        self._index_lock = ReadWriteLock()
+        self._reindex_timer: Optional[threading.Timer] = None
 
         # Create a vector store directory
         self.vector_path = os.path.join(data_path, "vector_store")
@@ -62,8 +86,24 @@ class RetrievalHelper(ContextProvider):
     def _init_db(self):
         pass
 
-    @abstractmethod
+    def close(self) -> None:
+        # The changes of the run that are not reindexed yet are dropped with the run's workspace, a reindex in progress
+        # is waited for
+        with self._index_lock.write():
+            self._take_pending()
+
+    def reset(self) -> None:
+        self.close()
+        self.viewed_lines = {}
+
     def search(self, query: str, k: int, run_manager=None, callbacks=None) -> List[Document]:
+        """Search the index, after reindexing the changed files."""
+        self.flush_reindex()
+        with self._index_lock.read():
+            return self._search(query, k, run_manager=run_manager, callbacks=callbacks)
+
+    @abstractmethod
+    def _search(self, query: str, k: int, run_manager=None, callbacks=None) -> List[Document]:
         pass
 
     @abstractmethod
@@ -81,8 +121,54 @@ class RetrievalHelper(ContextProvider):
         self.reindex_incremental(docs)
 
     def add_changed_file(self, file: str):
-        """Update the vector store with the changed file. Also save the changed file for reset."""
-        self.reindex_files([file])
+        """Queue the changed file for reindexing. The changes of the same file are reindexed once."""
+        with self._pending_lock:
+            self._pending[file] = None
+            # Debounce: a burst of edits is reindexed at once after the last one
+            if self._reindex_timer is not None:
+                self._reindex_timer.cancel()
+            self._reindex_timer = threading.Timer(self.reindex_delay, self._background_reindex)
+            self._reindex_timer.daemon = True
+            self._reindex_timer.start()
+
+    def _take_pending(self) -> List[str]:
+        with self._pending_lock:
+            files = list(self._pending)
+            self._pending.clear()
+            if self._reindex_timer is not None:
+                self._reindex_timer.cancel()
+                self._reindex_timer = None
+        return files
+
+    def has_pending_reindex(self) -> bool:
+        with self._pending_lock:
+            return bool(self._pending)
+
+    def flush_reindex(self) -> None:
+        """Reindex the queued changed files."""
+        # The searches take the exclusive lock only when there is something to reindex, so they do not queue up
+        if not self.has_pending_reindex():
+            return
+        with self._index_lock.write():
+            files = self._take_pending()
+            if not files:
+                return
+            with span("reindex", files=len(files)):
+                self.reindex_files(files)
+
+    def _background_reindex(self):
+        with self._index_lock.write():
+            files = self._take_pending()
+            if not files:
+                return
+            try:
+                self.reindex_files(files)
+            except Exception as e:
+                # Retried by the next search
+                self.logger.warning(f"Failed to reindex {len(files)} changed files", exc_info=e)
+                with self._pending_lock:
+                    for file in files:
+                        self._pending.setdefault(file, None)
 
     def add_viewed_docs(self, docs: List[Document]):
         """Save the viewed lines for the localization evaluation."""
@@ -6,6 +6,7 @@ from code_editing.agents.utils.user_prompt import PromptWrapper
 
 class AgentOnly(AgentGraph):
     name = "agent_only"
+    reusable = True
 
     def __init__(self, agent_prompt: PromptWrapper, **kwargs):
         super().__init__(**kwargs)
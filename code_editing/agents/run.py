@@ -1,12 +1,18 @@
 import collections
 import os
+import threading
 from enum import Enum
-from typing import Dict, Optional, Type, TypedDict, TypeVar, Union
+from typing import Any, Dict, Optional, Type, TypedDict, TypeVar, Union
 
 from hydra.core.hydra_config import HydraConfig
+from langchain_core.runnables import RunnableConfig, ensure_config
 
 from code_editing.agents.context_providers.context_provider import ContextProvider
+from code_editing.agents.context_providers.lazy import LazyContextProvider
 from code_editing.utils import wandb_utils
+from code_editing.utils.tracing import get_stage_summary
+from code_editing.utils.workspace import Workspace
+from code_editing.utils.write_journal import WriteJournal
 
 
 class ToolInfo(TypedDict):
@@ -47,20 +53,37 @@ class AgentRunManager:
             "instance_id": instance_id,
             "raw_data": raw_data,
         }
+        # Files written by the tools, so that the workspace can be reset cheaply
+        self.journal = WriteJournal(repo_path)
+        # Files of the repository in memory, shared by the tools and the context providers of the run
+        self.workspace = Workspace(repo_path)
         self.tools_info = collections.defaultdict(dict)
+        # Tools may be called concurrently (e.g. the searches of an ACR round)
+        self._tools_info_lock = threading.Lock()
+        # Tools of the run by name, the graphs shared by the runs call them through the tool templates
+        self.tools: Dict[str, Any] = {}
         self.start_ms = wandb_utils.get_current_ms()
         self.instance_id = instance_id
 
     def log_tool_use(self, tool_name, status: ToolUseStatus):
         status = status.value
-        self.tools_info.setdefault(tool_name, {}).setdefault(status, 0)
-        self.tools_info[tool_name][status] += 1
+        with self._tools_info_lock:
+            self.tools_info.setdefault(tool_name, {}).setdefault(status, 0)
+            self.tools_info[tool_name][status] += 1
+
+    def before_write(self) -> None:
+        """Build the lazy providers that need the clean workspace before the first write to it."""
+        for provider in self.context_providers.values():
+            if isinstance(provider, LazyContextProvider) and provider.provider_cls.needs_clean_build:
+                provider.get()
 
     def get_run_summary(self):
         end_ms = wandb_utils.get_current_ms()
         return {
             "tools": self.tools_info,
             "duration_sec": (end_ms - self.start_ms) / 1000,
+            # Latency breakdown of the data point by stage (if traced)
+            "stages": get_stage_summary(),
         }
 
     T = TypeVar("T", bound=ContextProvider)
@@ -72,16 +95,39 @@ class AgentRunManager:
                 raise ValueError(f"Context provider {ctx_provider_name} not found")
             return res
         else:
-            # filter values by type
-            res = list(filter(lambda x: isinstance(x, ctx_provider_name), self.context_providers.values()))
+            # filter values by type, lazy providers are not built for that
+            res = [
+                provider
+                for provider in self.context_providers.values()
+                if isinstance(provider, ctx_provider_name)
+                or (isinstance(provider, LazyContextProvider) and issubclass(provider.provider_cls, ctx_provider_name))
+            ]
             if len(res) == 0:
                 raise ValueError(f"Context provider {ctx_provider_name} not found")
             if len(res) > 1:
                 raise ValueError(f"Multiple context providers of type {ctx_provider_name} found")
             return res[0]
 
+    def get_tool(self, name: str):
+        tool = self.tools.get(name, None)
+        if tool is None:
+            raise ValueError(f"Tool {name} not found")
+        return tool
+
     def get_log_path(self) -> str:
         base_path = HydraConfig.get().runtime.output_dir
         log_path = os.path.join(base_path, "logs", f"run_{self.instance_id.replace('/', '_')}.log")
         os.makedirs(os.path.dirname(log_path), exist_ok=True)
         return log_path
+
+
+# Key of the run manager in the configurable fields of the runnable config
+RUN_MANAGER_KEY = "agent_run_manager"
+
+
+def get_current_run_manager(config: Optional[RunnableConfig] = None) -> AgentRunManager:
+    """Run manager of the current run, passed in the runnable config to the graphs and tools shared by the runs."""
+    run_manager = ensure_config(config).get("configurable", {}).get(RUN_MANAGER_KEY, None)
+    if run_manager is None:
+        raise ValueError("The runnable config has no agent run manager")
+    return run_manager
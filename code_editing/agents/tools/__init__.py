@@ -9,11 +9,12 @@ from code_editing.agents.tools.acr_tools import (
 )
 from code_editing.agents.tools.aider_tool import RepoMapTool
 from code_editing.agents.tools.code_search_tool import CodeSearchTool
-from code_editing.agents.tools.edit_tool import EditTool
+from code_editing.agents.tools.edit_tool import EditTool, MultiEditTool
 from code_editing.agents.tools.view_file_tool import ViewFileTool
 
 __all__ = [
     "EditTool",
+    "MultiEditTool",
     "CodeSearchTool",
     "ViewFileTool",
     "ACRSearchClass",
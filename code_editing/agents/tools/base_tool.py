@@ -1,3 +1,6 @@
+import asyncio
+import contextvars
+import functools
 import os
 from abc import ABC, abstractmethod
 from typing import Any, Optional, Type, TypeVar, Union
@@ -5,7 +8,8 @@ from typing import Any, Optional, Type, TypeVar, Union
 from langchain_core.tools import BaseTool, ToolException
 
 from code_editing.agents.context_providers.context_provider import ContextProvider
-from code_editing.agents.run import AgentRunManager, ToolUseStatus
+from code_editing.agents.run import AgentRunManager, ToolUseStatus, get_current_run_manager
+from code_editing.utils.tracing import span
 
 
 class CEBaseTool(BaseTool, ABC):
@@ -43,32 +47,41 @@ class CEBaseTool(BaseTool, ABC):
             raise FileNotFoundError(f"Repo path {self.repo_path} does not exist")
 
     def _run(self, *args: Any, **kwargs: Any) -> Any:
+        if self.run_manager is None:
+            # Template of the tool in a graph shared by the runs, the tool of the current run does the work
+            return get_current_run_manager().get_tool(self.name)._run(*args, **kwargs)
         # Track tool usage
         self.run_manager.log_tool_use(self.name, ToolUseStatus.CALL)
-        try:
-            # Run the tool
-            res = self._run_tool(*args, **kwargs)
-            self.run_manager.log_tool_use(self.name, ToolUseStatus.OK)
-            return res
-        except ToolException:
-            # Track tool failure
-            self.run_manager.log_tool_use(self.name, ToolUseStatus.FAIL)
-            raise
-        except Exception:
-            # Track tool error
-            self.run_manager.log_tool_use(self.name, ToolUseStatus.THROWN)
-            raise
+        with span(f"tool:{self.name}", cat="tool") as tool_span:
+            try:
+                # Run the tool
+                res = self._run_tool(*args, **kwargs)
+                self.run_manager.log_tool_use(self.name, ToolUseStatus.OK)
+                if tool_span is not None:
+                    tool_span.set(output_chars=len(str(res)))
+                return res
+            except ToolException:
+                # Track tool failure
+                self.run_manager.log_tool_use(self.name, ToolUseStatus.FAIL)
+                raise
+            except Exception:
+                # Track tool error
+                self.run_manager.log_tool_use(self.name, ToolUseStatus.THROWN)
+                raise
 
     @abstractmethod
     def _run_tool(self, *args: Any, **kwargs: Any) -> Any:
         raise NotImplementedError
 
-    def _arun(
+    async def _arun(
         self,
         *args: Any,
         **kwargs: Any,
     ) -> Any:
-        raise NotImplementedError("Async run not implemented")
+        # Tools do blocking file system and git work, so it is offloaded to the (bounded) default executor of the loop
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(None, functools.partial(ctx.run, self._run, *args, **kwargs))
 
     @property
     def short_name(self) -> Optional[str]:
@@ -1,10 +1,22 @@
 import os
+from typing import Optional
 
 from langchain_core.documents import Document
 from langchain_core.tools import ToolException, tool
 
+from code_editing.utils.workspace import get_workspace
+from code_editing.utils.write_journal import WriteJournal
+
 
 def read_file(context, file, start_index):
+    workspace = get_workspace(file)
+    if workspace is not None:
+        # The line is found by the line offsets instead of a scan
+        lines = workspace.raw_lines(file)
+        line = workspace.line_at(file, start_index)
+        start = max(0, line - context)
+        end = min(len(lines), line + context + 1)
+        return "".join(lines[start:end]), lines, start, end
     with open(file, "r", encoding="utf8", errors="ignore") as f:
         lines = f.readlines()
         line = 0
@@ -22,7 +34,8 @@ def read_file(context, file, start_index):
 
 
 def read_file_lines(file, line_start, line_end, add_line_numbers=False):
-    lines = read_file_full(file).split("\n")
+    workspace = get_workspace(file)
+    lines = list(workspace.lines(file)) if workspace is not None else read_file_full(file).split("\n")
     line_start = max(1, line_start)
     line_end = min(len(lines), line_end)
     res = ""
@@ -35,13 +48,22 @@ def read_file_lines(file, line_start, line_end, add_line_numbers=False):
 
 
 def read_file_full(file) -> str:
+    workspace = get_workspace(file)
+    if workspace is not None:
+        return workspace.read(file)
     with open(file, "r", encoding="utf8", errors="ignore") as f:
         return f.read()
 
 
-def write_file_full(file, content):
-    with open(file, "w", encoding="utf8", errors="ignore") as f:
-        f.write(content)
+def write_file_full(file, content, journal: Optional[WriteJournal] = None):
+    workspace = get_workspace(file)
+    if workspace is not None:
+        workspace.write(file, content)
+    else:
+        with open(file, "w", encoding="utf8", errors="ignore") as f:
+            f.write(content)
+    if journal is not None:
+        journal.record(file)
 
 
 def my_format_fragment(source: str, start_index: int, page_content: str) -> str:
@@ -81,6 +103,13 @@ def check_file_inside_repo(file, repo_path):
 
 def parse_file(file_name, repo_path):
     """Parse the file and return the full path. Raise ToolException if the file is not valid."""
+    workspace = get_workspace()
+    if workspace is not None and os.path.normpath(workspace.repo_path) == os.path.normpath(repo_path):
+        # The valid paths are cached by the workspace
+        try:
+            return workspace.resolve(file_name)
+        except ValueError as e:
+            raise ToolException(str(e))
     file = os.path.join(repo_path, file_name)
     if not os.path.exists(file):
         raise ToolException(f"File {file_name} does not exist")
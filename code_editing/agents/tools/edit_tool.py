@@ -1,11 +1,20 @@
 import logging
-from typing import Optional
+from typing import Dict, List, Optional, Tuple, Union
 
+from langchain_core.tools import ToolException
 from pydantic import BaseModel, Field
 
 from code_editing.agents.context_providers.retrieval.retrieval_helper import RetrievalHelper
 from code_editing.agents.tools.base_tool import CEBaseTool
-from code_editing.agents.tools.common import parse_file, read_file_full, read_file_lines
+from code_editing.agents.tools.common import parse_file, read_file_full, read_file_lines, write_file_full
+from code_editing.utils.piece_table import PieceTable
+
+# Number of lines shown around a change
+CONTEXT_LINES = 5
+
+
+def _context_window(start_line: int, new_code: str) -> Tuple[int, int]:
+    return start_line - CONTEXT_LINES, start_line + new_code.count("\n") + 1 + CONTEXT_LINES
 
 
 class EditTool(CEBaseTool):
@@ -36,20 +45,20 @@ class EditTool(CEBaseTool):
         contents = read_file_full(file)
         # Find the fragment to replace
         start = contents.find(to_replace)
-        start_line = contents.count("\n", 0, start)
         if start == -1:
             return "The code to replace was not found in the file."
-        end = start + len(to_replace)
         # Replace the fragment
-        new_contents = contents[:start] + new_code + contents[end:]
+        buffer = PieceTable(contents)
+        buffer.replace(start, start + len(to_replace), new_code)
+        new_contents = buffer.text()
         # Save
-        with open(file, "w") as f:
-            f.write(new_contents)
-        # Reindex
+        self.run_manager.before_write()
+        write_file_full(file, new_contents, self.run_manager.journal)
+        # Reindex (in the background, before the next search at the latest)
         if self.retrieval_helper:
             self.retrieval_helper.add_changed_file(file)
         # Return the new fragment
-        new_state = read_file_lines(file, start_line - 5, start_line + new_code.count("\n") + 1 + 5)[0]
+        new_state = read_file_lines(file, *_context_window(buffer.new_line(start), new_code))[0]
 
         return "Code has been updated. Here is the context around the change:\n" + new_state
 
@@ -58,3 +67,96 @@ class EditTool(CEBaseTool):
         return f"edit"
 
     retrieval_helper: Optional[RetrievalHelper] = None
+
+
+class FragmentEdit(BaseModel):
+    file_name: str = Field(description="File name to edit", examples=["main.py", "test/benchmark/metrics.py"])
+    to_replace: str = Field(description="The code to replace", examples=["def old_function():\n    pass\n"])
+    new_code: str = Field(description="The new code", examples=["def new_function():\n    pass\n"])
+
+
+class MultiEditTool(CEBaseTool):
+    class MultiEditToolInput(BaseModel):
+        edits: List[FragmentEdit] = Field(description="Edits to apply, in one or more files")
+
+    name = "edit-fragments"
+    description = """Edit several fragments of code at once, in one or more files. Every edit is the old code to replace \
+and the new code to replace it with. The edits are applied only if all of them are valid."""
+    args_schema = MultiEditToolInput
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.args_schema = self.MultiEditToolInput
+
+        if self.dry_run:
+            return
+
+        try:
+            self.retrieval_helper = self.get_ctx_provider(RetrievalHelper)
+        except ValueError:
+            logging.warning("RetrievalHelper is not available. The tool will not be able to reindex the files.")
+
+    def _run_tool(self, edits: List[Union[FragmentEdit, Dict]]) -> str:
+        edits = [edit if isinstance(edit, FragmentEdit) else FragmentEdit(**edit) for edit in edits]
+        if not edits:
+            raise ToolException("No edits were given.")
+
+        # Validate all the edits against the current contents before writing anything
+        errors = []
+        by_file: Dict[str, List[Tuple[int, FragmentEdit]]] = {}
+        for n, edit in enumerate(edits, 1):
+            try:
+                by_file.setdefault(parse_file(edit.file_name, self.repo_path), []).append((n, edit))
+            except ToolException as e:
+                errors.append(f"Edit {n}: {e}")
+        # File -> edited contents, (start, end, edit number, edit) sorted by the position
+        plans: Dict[str, Tuple[PieceTable, List[Tuple[int, int, int, FragmentEdit]]]] = {}
+        for file, file_edits in by_file.items():
+            buffer = PieceTable(read_file_full(file))
+            fragments = []
+            for n, edit in file_edits:
+                start = buffer.original.find(edit.to_replace)
+                if start == -1:
+                    errors.append(f"Edit {n}: the code to replace was not found in {edit.file_name}.")
+                    continue
+                end = start + len(edit.to_replace)
+                try:
+                    buffer.replace(start, end, edit.new_code)
+                except ValueError:
+                    overlap = next((f"edit {m}" for s, e, m, _ in fragments if s <= end and start <= e), "another edit")
+                    errors.append(f"Edit {n}: the code to replace overlaps with {overlap}.")
+                    continue
+                fragments.append((start, end, n, edit))
+            plans[file] = (buffer, sorted(fragments, key=lambda f: f[0]))
+        if errors:
+            raise ToolException("No changes were made:\n" + "\n".join(errors))
+
+        # Apply the edits with one write and one reindex per file
+        self.run_manager.before_write()
+        views = []
+        for file, (buffer, fragments) in plans.items():
+            write_file_full(file, buffer.text(), self.run_manager.journal)
+            # Reindex (in the background, before the next search at the latest)
+            if self.retrieval_helper:
+                self.retrieval_helper.add_changed_file(file)
+            windows = [_context_window(buffer.new_line(start), edit.new_code) for start, _, _, edit in fragments]
+            views.append(f"{fragments[0][3].file_name}:\n" + "...\n".join(self._read_windows(file, windows)))
+
+        return "Code has been updated. Here is the context around the changes:\n" + "\n".join(views)
+
+    @staticmethod
+    def _read_windows(file: str, windows: List[Tuple[int, int]]) -> List[str]:
+        """Lines of the windows, the overlapping ones are merged."""
+        merged: List[List[int]] = []
+        for start, end in windows:
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return [read_file_lines(file, start, end)[0] for start, end in merged]
+
+    @property
+    def short_name(self) -> str:
+        return f"multi_edit"
+
+    retrieval_helper: Optional[RetrievalHelper] = None
@@ -1,8 +1,11 @@
 import tempfile
+import threading
 from typing import Dict
 
 from code_editing.data_sources.extract_code_base import CodeBaseExtractor
 from code_editing.utils.git_utils import checkout_repo, clone_repo
+from code_editing.utils.tracing import span
+from code_editing.utils.worktree_pool import WorktreePool, get_worktree_pool
 
 
 class CheckoutExtractor(CodeBaseExtractor):
@@ -10,12 +13,31 @@ class CheckoutExtractor(CodeBaseExtractor):
 
     REPO_KEY = "__REPOPATH__"
 
-    def __init__(self, use_temp_dirs=False):
+    def __init__(self, use_temp_dirs=False, use_worktrees=False):
+        """
+        @param use_temp_dirs: Clone the repository into a new temporary directory for each data point
+        @param use_worktrees: Check out each data point into an exclusive git worktree from the per-repo pool.
+            Data points of the same repository can then be processed in parallel.
+        """
         self.tmp_dirs = []
         self.use_temp_dirs = use_temp_dirs
+        self.use_worktrees = use_worktrees
+        self.isolated_workspaces = use_temp_dirs or use_worktrees
+        # Worktree path -> pool it was acquired from
+        self._worktrees: Dict[str, WorktreePool] = {}
+        self._worktrees_lock = threading.Lock()
 
     def __call__(self, data, data_path) -> Dict[str, str]:
-        if self.use_temp_dirs:
+        with span("checkout", repo=data.repo, base_hash=data.base_hash):
+            return self._checkout(data, data_path)
+
+    def _checkout(self, data, data_path) -> Dict[str, str]:
+        if self.use_worktrees:
+            pool = get_worktree_pool(data.repo, data_path)
+            repo_path = pool.acquire(data.base_hash)
+            with self._worktrees_lock:
+                self._worktrees[repo_path] = pool
+        elif self.use_temp_dirs:
             tmp_data_path = tempfile.mkdtemp()
             self.tmp_dirs.append(tmp_data_path)
             clone_repo(data.repo, tmp_data_path)
@@ -24,6 +46,13 @@ class CheckoutExtractor(CodeBaseExtractor):
             repo_path = checkout_repo(data.repo, data.base_hash, data_path)
         return {self.REPO_KEY: repo_path}
 
+    def release(self, code_base: Dict[str, str]) -> None:
+        repo_path = code_base.get(self.REPO_KEY, None)
+        with self._worktrees_lock:
+            pool = self._worktrees.pop(repo_path, None)
+        if pool is not None:
+            pool.release(repo_path)
+
     # def __del__(self):
     #     time.sleep(5)  # Wait for git to release the files
     #     for tmp_dir in self.tmp_dirs:
@@ -9,13 +9,19 @@ class ToolFactory:
         self.tool_config_list = tool_config_dict.values()
         self.preview = self._preview()
         self.global_tools_config = {}
+        # The configs are resolved once, the tools of every run are built from the partials
+        self._partials = [instantiate(tool_config, _partial_=True) for tool_config in self.tool_config_list]
 
     def build(self, *args, **kwargs) -> List[BaseTool]:
-        res = []
-        for tool_config in self.tool_config_list:
-            tool = instantiate(tool_config, *args, **self.global_tools_config, **kwargs)
-            res.append(tool)
-        return res
+        return [partial(*args, **self.global_tools_config, **kwargs) for partial in self._partials]
+
+    @property
+    def templates(self) -> List[BaseTool]:
+        """
+        Tools that are not bound to a run, for the graphs shared by the runs. They have the names and the schemas of
+        the tools and call the tools of the current run, see CEBaseTool._run.
+        """
+        return self.preview
 
     def _preview(self) -> List[BaseTool]:
         res = []
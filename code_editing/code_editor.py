@@ -1,5 +1,8 @@
+import asyncio
+import functools
+import threading
 from abc import ABC, abstractmethod
-from typing import Dict, List, TypedDict
+from typing import Callable, Dict, List, Optional, TypedDict
 
 from typing_extensions import NotRequired  # we use python 3.10
 
@@ -48,11 +51,52 @@ class CEBackbone(ABC):
         pass
 
 
+class PreparedRun:
+    """A prepared request of a code editor. Call it to run the request or `cancel` it if it will not run."""
+
+    def __init__(self, run: Callable[[], CEOutput], release: Optional[Callable[[], None]] = None):
+        """
+        @param run: Runs the request and releases its resources
+        @param release: Releases the resources of the request if it is cancelled before the run
+        """
+        self._run = run
+        self._release = release
+        self._lock = threading.Lock()
+        self._state = "prepared"
+
+    def __call__(self) -> CEOutput:
+        with self._lock:
+            if self._state != "prepared":
+                raise RuntimeError(f"The run is already {self._state}")
+            self._state = "started"
+        return self._run()
+
+    def cancel(self) -> None:
+        """Release the resources of the request unless it has been run. Safe to call more than once."""
+        with self._lock:
+            if self._state != "prepared":
+                return
+            self._state = "cancelled"
+        if self._release is not None:
+            self._release()
+
+
 class CodeEditor(ABC):
     @abstractmethod
     def generate_diff(self, req: CEInput) -> CEOutput:
         pass
 
+    async def agenerate_diff(self, req: CEInput) -> CEOutput:
+        """Async version of generate_diff. By default, runs generate_diff in the default executor of the loop."""
+        return await asyncio.to_thread(self.generate_diff, req)
+
+    def prepare_run(self, req: CEInput) -> PreparedRun:
+        """
+        Split generate_diff into the preparation (e.g. building the indexes) and the run, returned as a callable, so
+        that the preparation of the next request can overlap with the current run. By default, nothing is prepared.
+        """
+        return PreparedRun(functools.partial(self.generate_diff, req))
+
     @property
     def metadata(self) -> dict:
         return {"type": "base"}
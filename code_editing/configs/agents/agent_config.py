@@ -11,9 +11,23 @@ from code_editing.configs.data_source_configs import DataSourceConfig, setup_dat
 from code_editing.configs.inference_config import InferenceConfig
 
 
+@dataclass
+class ContextPoolConfig:
+    enabled: bool = False  # Reuse the context providers between the runs at the same repository and commit
+    max_size: int = 16
+    max_memory_mb: int = 4096
+
+
 @dataclass
 class RunAgentConfig:
     context: Dict[Any, ContextConfig] = field(default_factory=dict)
+    context_pool: ContextPoolConfig = field(default_factory=ContextPoolConfig)
+    # Build the context providers on their first use (e.g. by a tool) instead of before every run
+    lazy_context: bool = False
+    # Start building the lazy context providers in the background while the first LLM call is in flight
+    speculative_context: bool = False
+    # Compile the graph once and share it between the runs (only the graphs without per-run state are shared)
+    reuse_graph: bool = False
     data_source: DataSourceConfig = MISSING
     graph: GraphConfig = MISSING
     inference: InferenceConfig = field(default_factory=InferenceConfig)
@@ -43,11 +43,13 @@ class LLMFixedCtxRetrievalConfig(LLMRetrievalConfig):
 class ACRRetrievalConfig(ContextCollectorsConfig):
     _target_: str = f"{CE_CLASSES_ROOT_PKG}.agents.collect_edit.context_collectors.ACRRetrieval"
     use_show_definition: bool = False
+    max_search_workers: int = 4
 
 
 @dataclass
 class MyACRRetrievalConfig(ContextCollectorsConfig):
     _target_: str = f"{CE_CLASSES_ROOT_PKG}.agents.collect_edit.context_collectors.MyACRRetrieval"
+    max_search_workers: int = 4
 
 
 @dataclass
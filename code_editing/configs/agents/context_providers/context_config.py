@@ -23,6 +23,7 @@ class ACRSearchManagerConfig(ContextConfig):
 class RetrievalConfig(ContextConfig):
     splitter: Any = MISSING
     loader: LoaderConfig = field(default_factory=LoaderConfig)
+    reindex_delay: float = 1.0  # Seconds after the last edit to reindex the changed files in the background
 
 
 @dataclass
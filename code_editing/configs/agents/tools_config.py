@@ -16,6 +16,11 @@ class EditToolConfig(ToolConfig):
     _target_: str = f"{CE_CLASSES_ROOT_PKG}.agents.tools.EditTool"
 
 
+@dataclass
+class MultiEditToolConfig(ToolConfig):
+    _target_: str = f"{CE_CLASSES_ROOT_PKG}.agents.tools.MultiEditTool"
+
+
 @dataclass
 class ViewFileToolConfig(ToolConfig):
     _target_: str = f"{CE_CLASSES_ROOT_PKG}.agents.tools.ViewFileTool"
@@ -73,6 +78,7 @@ class AiderRepoMapConfig(ToolConfig):
 def setup_tools_config(cs):
     # All tool options
     cs.store(name="edit", group="tools", node=EditToolConfig)
+    cs.store(name="multi_edit", group="tools", node=MultiEditToolConfig)
     cs.store(name="view_file", group="tools", node=ViewFileToolConfig)
     cs.store(name="code_search", group="tools", node=CodeSearchToolConfig)
 
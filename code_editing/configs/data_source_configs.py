@@ -15,6 +15,13 @@ class DataSourceConfig:
     )  # Directory with dataset repositories. Load using `load_data/load_data_from_hf.py`
     cache_dir: Optional[str] = None
     shuffle_seed: Optional[int] = None
+    clone_workers: int = 4  # Number of repositories cloned in parallel
+    blobless_clone: bool = False  # Partial clones, file contents are fetched on demand
+    mirror_path: Optional[str] = None  # Directory with local mirrors to clone with --reference (or $CE_MIRROR_PATH)
+    lazy_clone: bool = True  # Clone only the repositories of the data points that are actually run
+    revision: Optional[str] = None  # Revision of the HuggingFace dataset
+    materialize: bool = True  # Precompute the data points (base hashes, true diffs, changed files) before inference
+    materialize_workers: int = 8
 
 
 @dataclass
@@ -6,7 +6,7 @@ from code_editing.configs.wandb_config import WandbConfig, setup_wandb_config
 
 @dataclass
 class InferenceConfig:
-    checkpoint_iters: Optional[int] = None
+    checkpoint_iters: Optional[int] = None  # Sync the streamed results to disk every N data points (10 by default)
     start_from: int = 0
     end_at: Optional[int] = None
     num_workers: int = 5
@@ -17,6 +17,22 @@ class InferenceConfig:
     run_name: Optional[str] = None
     run_suffix: str = ""
     run_prefix: str = ""
+    use_worktrees: bool = False  # Run each data point in its own git worktree (agents only)
+    use_async: bool = False  # Run the code editors on an event loop, num_workers threads serve the blocking work
+    max_concurrency: int = 64  # Max number of data points in flight in the async mode
+    resume: bool = False  # Skip the data points that are already done in the existing output_path
+    adaptive_concurrency: bool = False  # Adapt the number of data points in flight to the LLM latency and rate limits
+    min_workers: int = 1  # Lower bound of the adaptive concurrency, num_workers (max_concurrency if async) is the upper
+    latency_tolerance: Optional[float] = None  # Also cut the adaptive concurrency when the latency grows x times
+    retry_backoff: float = 1.0  # Base delay in seconds of the jittered exponential backoff between the tries
+    retry_backoff_max: float = 60.0
+    metrics_flush_interval: float = 10.0  # Seconds between the flushes of the run statistics to W&B and metrics.json
+    trace: bool = False  # Save a Chrome trace of the data points to trace.json in the hydra output dir (kept in memory)
+    num_shards: int = 1  # Split the data points between independent processes, merge them with merge_shards.py
+    shard_index: int = 0
+    pipeline: bool = False  # Prepare the next data points (checkout, indexes) while the agents run the current ones
+    prefetch: int = 2  # Max number of data points waiting between the pipeline stages
+    prepare_workers: int = 2  # Workers of each of the preparation stages of the pipeline
 
 
 def setup_inference_config(cs):
@@ -20,6 +20,10 @@ class CEDataSource(ABC, Sequence[SimpleGitCEData]):
         code_base = self._extractor(data, self.data_path)
         return {"instruction": data.message, "code_base": code_base}
 
+    def release_input(self, inp: CEInput) -> None:
+        """Release the resources acquired by `data_to_input` once the input is not needed anymore."""
+        self._extractor.release(inp["code_base"])
+
     @abstractmethod
     def get_lock(self, item):
         """Lock context for working with the data point. Should be acquired before using __getitem__"""
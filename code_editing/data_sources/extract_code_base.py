@@ -7,11 +7,21 @@ from code_editing.utils.git_utils import get_changed_files_patch, get_diff, get_
 
 
 class CodeBaseExtractor(ABC):
+    # Whether every data point gets its own workspace, i.e. the shared repository checkout is not used
+    isolated_workspaces: bool = False
+
     @abstractmethod
     def __call__(self, data: SimpleGitCEData, data_path: str) -> Dict[str, str]:
         pass
 
+    def release(self, code_base: Dict[str, str]) -> None:
+        """Release the resources acquired for the extracted code base (e.g. a workspace)."""
+        pass
+
     def data_to_files(self, data: SimpleGitCEData, data_path: str) -> List[str]:
+        if data.changed_files is not None:
+            # Materialized by the data source
+            return data.changed_files
         return get_changed_files_patch(data.repo, data.diff_true, data_path, data.base_hash)
 
 
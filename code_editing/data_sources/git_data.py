@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import List, Optional
 
 
 @dataclass
@@ -11,9 +12,11 @@ class SimpleGitCEData:
         repo (str): Repository name. For example, 'keras-team/keras'.
         base_hash (str): Commit hash of the base commit. This is the code before the changes, usually the parent commit.
         diff_true (str): The true diff of the modification.
+        changed_files (Optional[List[str]]): Files of the base commit changed by the true diff, if already known.
     """
 
     message: str
     repo: str
     base_hash: str
     diff_true: str
+    changed_files: Optional[List[str]] = None
@@ -1,7 +1,11 @@
 import logging
 import os
+import time
 from abc import abstractmethod
-from typing import Dict, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from dataclasses import replace
+from typing import Dict, Iterable, Optional, Sequence, Tuple
 
 from datasets import load_dataset
 from tqdm import tqdm
@@ -9,7 +13,9 @@ from tqdm import tqdm
 from code_editing.data_sources.base_source import CEDataSource
 from code_editing.data_sources.extract_code_base import CodeBaseExtractor
 from code_editing.data_sources.git_data import SimpleGitCEData
-from code_editing.utils.git_utils import clone_repo, get_diff, get_repo_path, lock_repo
+from code_editing.data_sources.materialized import MATERIALIZED_VERSION, MaterializedCache
+from code_editing.utils.clone_manager import CloneManager
+from code_editing.utils.git_utils import get_changed_files_patch, get_diff, get_repo_path, lock_repo
 
 logger = logging.getLogger("data_sources")
 
@@ -29,10 +35,17 @@ class HuggingFaceSimpleGitCEDataSource(CEDataSource):
         split: Optional[str] = None,
         cache_dir: Optional[str] = None,
         shuffle_seed: Optional[int] = None,
+        clone_workers: int = 4,
+        blobless_clone: bool = False,
+        mirror_path: Optional[str] = None,
+        lazy_clone: bool = True,
+        revision: Optional[str] = None,
+        materialize: bool = True,
+        materialize_workers: int = 8,
         **kwargs,
     ):
         super().__init__(extractor, base_data_path)
-        self._dataset = load_dataset(hub_name, config, split=split, cache_dir=cache_dir)
+        self._dataset = load_dataset(hub_name, config, split=split, cache_dir=cache_dir, revision=revision)
 
         if shuffle_seed is not None:
             self._dataset = self._dataset.shuffle(shuffle_seed)
@@ -41,17 +54,79 @@ class HuggingFaceSimpleGitCEDataSource(CEDataSource):
         self.split = split
         self._hub_name = hub_name
 
+        # Materialized rows: computing them requires git operations
+        self._materialize = materialize
+        self._materialize_workers = materialize_workers
+        # The fingerprint identifies the loaded (and shuffled) data, so an updated dataset gets a new cache
+        fingerprint = getattr(self._dataset, "_fingerprint", None)
+        key = [type(self).__name__, hub_name, config, split, fingerprint, f"v{MATERIALIZED_VERSION}"]
+        file_name = "__".join(str(part).replace("/", "__") for part in key)
+        self._materialized_cache = MaterializedCache(
+            os.path.join(self.data_path, "materialized", f"{file_name}.parquet")
+        )
+        self._materialized: Dict[int, SimpleGitCEData] = self._materialized_cache.load() if materialize else {}
+
         # Initialize the git repositories
         os.makedirs(self.data_path, exist_ok=True)
-        pbar = tqdm(self._dataset, desc=f"Cloning repositories for {self.name}")
-        all_count = len(self._dataset)
-        for row in pbar:
-            repo = self._row_to_repo(row)
-            pbar.set_postfix_str(f"{repo}")
-            clone_repo(repo, self.data_path)
-        logger.info(f"Successfully cloned {all_count} repositories for {self.name}")
+        self._clone_manager = CloneManager(
+            self.data_path, workers=clone_workers, blobless=blobless_clone, mirror_dir=mirror_path
+        )
+        if not lazy_clone:
+            self.prepare_repositories()
+
+    def _select(self, start_from: int, end_at: Optional[int], items: Optional[Iterable[int]]) -> Sequence[int]:
+        if items is not None:
+            return list(items)
+        end_at = len(self._dataset) if end_at is None else min(end_at, len(self._dataset))
+        return range(start_from, end_at)
+
+    def prepare_repositories(
+        self, start_from: int = 0, end_at: Optional[int] = None, items: Optional[Iterable[int]] = None
+    ) -> None:
+        """Clone the repositories of the data points in [start_from, end_at) (or [items]) that are not cloned yet."""
+        rows = self._dataset.select(self._select(start_from, end_at, items))
+        repos = set(self._row_to_repo(row) for row in rows)
+        self._clone_manager.clone_all(repos, desc=f"Cloning repositories for {self.name}")
+        logger.info(f"{len(repos)} repositories are ready for {self.name}")
+
+    def materialize(
+        self, start_from: int = 0, end_at: Optional[int] = None, items: Optional[Iterable[int]] = None
+    ) -> None:
+        """
+        Compute the data (including the changed files) of the rows in [start_from, end_at) (or [items]) in parallel
+        and store them in the local cache, so that `__getitem__` does not need git operations for them.
+        """
+        if not self._materialize:
+            return
+        missing = [i for i in self._select(start_from, end_at, items) if i not in self._materialized]
+        if not missing:
+            return
+
+        start = time.perf_counter()
+        rows = {}
+        with ThreadPoolExecutor(max_workers=self._materialize_workers) as executor:
+            tasks = {executor.submit(self._materialize_row, i): i for i in missing}
+            for task in tqdm(as_completed(tasks), total=len(tasks), desc=f"Materializing {self.name}"):
+                i = tasks[task]
+                try:
+                    rows[i] = task.result()
+                except Exception as e:
+                    # The row is computed on demand instead
+                    logger.warning(f"Failed to materialize #{i} of {self.name}", exc_info=e)
+        self._materialized = self._materialized_cache.update(rows)
+        logger.info(f"Materialized {len(rows)} rows of {self.name} in {time.perf_counter() - start:.1f}s")
+
+    def _materialize_row(self, item: int) -> SimpleGitCEData:
+        data = self.row_to_data(self._dataset[item])
+        data.changed_files = get_changed_files_patch(data.repo, data.diff_true, self.data_path, data.base_hash)
+        return data
 
     def __getitem__(self, item) -> SimpleGitCEData:
+        data = self._materialized.get(item, None)
+        if data is not None:
+            # Copy, so that the cached data can not be modified
+            changed_files = None if data.changed_files is None else list(data.changed_files)
+            return replace(data, changed_files=changed_files)
         return self.row_to_data(self._dataset[item])
 
     def __len__(self):
@@ -67,7 +142,25 @@ class HuggingFaceSimpleGitCEDataSource(CEDataSource):
         """Faster method to get the repo name from a row. It must not use git operations."""
         raise NotImplementedError
 
+    def get_instance_id(self, item: int) -> str:
+        """Unique id of the data point. It is carried through the inference output."""
+        return f"{self.name}_{item}"
+
+    def get_affinity_key(self, item: int) -> Tuple[str, str]:
+        """(repo, base commit) of the data point, for scheduling. The base commit is empty if it is not known yet."""
+        data = self._materialized.get(item, None)
+        if data is not None:
+            return data.repo, data.base_hash
+        return self._row_to_repo(self._dataset[item]), ""
+
+    def needs_repo_lock(self) -> bool:
+        """Whether the data points of the same repository have to be processed one at a time."""
+        return not self._extractor.isolated_workspaces
+
     def get_lock(self, item):
+        if not self.needs_repo_lock():
+            # The data point is processed in its own workspace, the shared checkout stays untouched
+            return nullcontext()
         repo = self._row_to_repo(self._dataset[item])
         return lock_repo(get_repo_path(self.data_path, repo), self.data_path)
 
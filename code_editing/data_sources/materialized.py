@@ -0,0 +1,53 @@
+import os
+from dataclasses import asdict
+from typing import Dict
+
+import pandas as pd
+from filelock import FileLock
+
+from code_editing.data_sources.git_data import SimpleGitCEData
+
+# Bump when the stored fields or the way they are computed change
+MATERIALIZED_VERSION = 1
+
+
+class MaterializedCache:
+    """
+    Local Parquet cache of the SimpleGitCEData fields (including changed files) of the dataset rows.
+
+    Rows are stored by their index in the dataset. The file is shared between processes and runs: new rows are merged
+    into it under a file lock and written atomically.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock_path = f"{path}.lock"
+
+    def load(self) -> Dict[int, SimpleGitCEData]:
+        if not os.path.exists(self.path):
+            return {}
+        df = pd.read_parquet(self.path)
+        res = {}
+        for row in df.to_dict(orient="records"):
+            changed_files = row["changed_files"]
+            res[int(row["index"])] = SimpleGitCEData(
+                message=row["message"],
+                repo=row["repo"],
+                base_hash=row["base_hash"],
+                diff_true=row["diff_true"],
+                changed_files=None if changed_files is None else list(changed_files),
+            )
+        return res
+
+    def update(self, rows: Dict[int, SimpleGitCEData]) -> Dict[int, SimpleGitCEData]:
+        """Add the rows to the cache. Returns all the cached rows."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with FileLock(self._lock_path):
+            # Other processes could have materialized other rows meanwhile
+            res = self.load()
+            res.update(rows)
+            df = pd.DataFrame([{"index": i, **asdict(data)} for i, data in sorted(res.items())])
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, self.path)
+        return res
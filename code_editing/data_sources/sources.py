@@ -1,3 +1,4 @@
+from functools import cached_property
 from typing import Dict, List, Tuple
 
 import pandas as pd
@@ -22,7 +23,7 @@ class LCACodeEditingDataSource(HuggingFaceSimpleGitCEDataSource):
             message=row["message"],
             repo=row["repo"],
             diff_true=self._get_diff_helper(row["repo"], row["hash"], base_hash),
-            base_hash=get_parent_commit_sha(row["repo"], row["hash"], self.data_path),  # Get parent commit
+            base_hash=base_hash,  # Parent commit
         )
 
     def _row_to_repo(self, row: Dict) -> str:
@@ -102,19 +103,45 @@ class SWEBenchDataSource(HuggingFaceSimpleGitCEDataSource):
     def _row_to_repo(self, row: Dict) -> str:
         return row["repo"]
 
+    @cached_property
+    def _instance_ids(self) -> List[str]:
+        return self._dataset["instance_id"]
+
+    @cached_property
+    def _instance_index(self) -> Dict[str, int]:
+        return {instance_id: i for i, instance_id in enumerate(self._instance_ids)}
+
+    @cached_property
+    def _base_commit_index(self) -> Dict[str, str]:
+        res = {}
+        for base_commit, instance_id in zip(self._dataset["base_commit"], self._instance_ids):
+            # Several instances can share the base commit, the first one is used
+            res.setdefault(base_commit, instance_id)
+        return res
+
+    def get_instance_id(self, item: int) -> str:
+        return self._instance_ids[item]
+
+    def has_instance_id(self, instance_id: str) -> bool:
+        return instance_id in self._instance_index
+
+    def get_row_by_instance_id(self, instance_id: str) -> Dict:
+        return self._dataset[self._instance_index[instance_id]]
+
     def to_swebench_results(self, inference: pd.DataFrame, model_name: str) -> Tuple[List[dict], List[str]]:
         df = inference.copy()
-        ds_df = self._dataset.to_pandas()
         df["diff_pred"] = df["diff_pred"].apply(lambda x: x if not pd.isna(x) else "")
         df["diff_pred"] = df["diff_pred"].apply(lambda x: x if x else "")
         out = df["diff_pred"].to_list()
 
-        def instance_id(i):
-            return ds_df[ds_df["base_commit"] == df["base_hash"].iloc[i]]["instance_id"].iloc[0]
+        if "instance_id" in df.columns:
+            instance_ids = df["instance_id"].to_list()
+        else:
+            # Outputs of older runs do not have instance ids
+            instance_ids = [self._base_commit_index[base_hash] for base_hash in df["base_hash"]]
 
         out = [
-            {"instance_id": instance_id(i), "model_patch": out[i], "model_name_or_path": model_name}
+            {"instance_id": instance_ids[i], "model_patch": out[i], "model_name_or_path": model_name}
             for i in range(len(out))
         ]
-        instance_ids = [e["instance_id"] for e in out]
         return out, instance_ids
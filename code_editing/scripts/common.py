@@ -1,9 +1,14 @@
-import collections
+import asyncio
+import hashlib
+import heapq
 import json
 import logging
 import os
+import time
 import uuid
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from typing import List, Optional
 
 import coolname
 import omegaconf
@@ -18,14 +23,28 @@ from code_editing.configs.inference_config import InferenceConfig
 from code_editing.data_sources.base_source import CEDataSource
 from code_editing.data_sources.hf_source import HuggingFaceSimpleGitCEDataSource
 from code_editing.utils import wandb_utils
+from code_editing.utils.concurrency import AIMDController, backoff_delay, track_llm_calls
+from code_editing.utils.jsonl_stream import JsonlStreamWriter, read_jsonl_rows
+from code_editing.utils.metrics import MetricsAggregator
+from code_editing.utils.pipeline import Stage, StagedPipeline
+from code_editing.utils.scheduler import AffinityScheduler, shard_items
+from code_editing.utils.tracing import Tracer, set_tracer, span
 
 logger = logging.getLogger("inference")
 
+OUTPUT_COLUMNS = ["diff_pred", "diff_true", "repo", "base_hash", "message", "viewed_lines", "model_name", "instance_id"]
+
 
 def get_cool_name():
     return coolname.generate_slug(3)
 
 
+def get_shard_path(output_path: str, shard_index: int, num_shards: int) -> str:
+    """Path of the streamed results of a shard, next to the output path."""
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.shard-{shard_index:0{len(str(num_shards))}d}-of-{num_shards}{ext}"
+
+
 def inference_loop(
     code_editor: CodeEditor,
     data_source: CEDataSource,
@@ -34,6 +53,12 @@ def inference_loop(
     run_name: str,
 ):
     unique_hex = uuid.uuid4().hex[:8]
+    num_shards = inference_config.num_shards
+    if num_shards > 1:
+        # All the shards of a run have the same model name, every shard streams its results to its own file
+        unique_hex = hashlib.sha256(f"{run_name}/{num_shards}".encode()).hexdigest()[:8]
+        merged_output_path = output_path
+        output_path = get_shard_path(output_path, inference_config.shard_index, num_shards)
     model_name = run_name.replace(" ", "_").replace("/", "_").lower() + "_" + unique_hex
     hydra_output_dir = HydraConfig.get().runtime.output_dir
     """
@@ -42,127 +67,470 @@ def inference_loop(
     if not isinstance(data_source, HuggingFaceSimpleGitCEDataSource):
         raise ValueError("This script only supports HuggingFaceSimpleGitCEDataSource")
 
-    # Initialize lists to store the true diffs, predicted diffs
-    df = pd.DataFrame(columns=["diff_pred", "diff_true", "repo", "base_hash", "message", "viewed_lines", "model_name"])
+    # Results are streamed to the output file as soon as they are ready
+    done = {}
+    if inference_config.resume:
+        for row in read_jsonl_rows(output_path):
+            # Failed predictions are retried
+            if row.get("instance_id") is not None and row.get("diff_pred") is not None:
+                done[row["instance_id"]] = row
+        if done:
+            # Keep the name of the resumed run
+            model_name = next(iter(done.values()))["model_name"]
+            unique_hex = model_name[-8:]
+            logger.info(f"Resuming {model_name} from {output_path}: {len(done)} data points are already done")
+    writer = JsonlStreamWriter(
+        output_path, append=inference_config.resume, sync_every=inference_config.checkpoint_iters or 10
+    )
 
     start = inference_config.start_from
     end = inference_config.end_at or len(data_source)
+    items = list(range(start, end))
+    if num_shards > 1:
+        items = shard_items(
+            {i: data_source.get_affinity_key(i)[0] for i in items}, num_shards, inference_config.shard_index
+        )
+        logger.info(f"Shard {inference_config.shard_index}/{num_shards}: {len(items)} data points -> {output_path}")
+    todo = [i for i in items if data_source.get_instance_id(i) not in done]
+    data_source.prepare_repositories(items=items)
+    data_source.materialize(items=items)
     datapoints = {}
-    tries = {i: 0 for i in range(start, end)}
+    tries = {i: 0 for i in todo}
 
-    progress_bar = tqdm(total=end - start, desc="Inference Loop")
+    progress_bar = tqdm(total=len(todo), desc="Inference Loop")
     num_added = 0
 
-    run_summary = {}
-    openai_stats = collections.defaultdict(float)
+    # Run statistics are reduced and logged in the background, off the workers' path
+    def derive_metrics(metrics):
+        datapoints = metrics.get("openai.datapoints", 0)
+        if not datapoints:
+            return {}
+        return {
+            "openai.projected_cost": metrics["openai.total_cost"] * len(items) / datapoints,
+            "openai.average_cost": metrics["openai.total_cost"] / datapoints,
+        }
 
-    def process_datapoint(i):
-        repo_lock = data_source.get_lock(i)
-        with repo_lock, get_openai_callback() as cb:
+    metrics = MetricsAggregator(
+        flush_interval=inference_config.metrics_flush_interval,
+        json_path=os.path.join(hydra_output_dir, "metrics.json"),
+        derive=derive_metrics,
+    )
+
+    # Number of data points in flight, adapted to the LLM latency and rate limits if enabled
+    max_in_flight = inference_config.max_concurrency if inference_config.use_async else inference_config.num_workers
+    if inference_config.pipeline and not inference_config.use_async:
+        # Data points prepared ahead of the agents and waiting between the stages
+        max_in_flight += 3 * inference_config.prefetch
+    controller = None
+    if inference_config.adaptive_concurrency:
+        controller = AIMDController(
+            min_limit=inference_config.min_workers,
+            max_limit=max_in_flight,
+            latency_tolerance=inference_config.latency_tolerance,
+        )
+
+    # Time spent waiting for repository locks, should stay close to 0 with the affinity scheduling
+    def record_lock_wait(wait_start: float):
+        lock_wait = time.perf_counter() - wait_start
+        metrics.add("scheduler.lock_wait_sec", lock_wait)
+        metrics.max("scheduler.max_lock_wait_sec", lock_wait)
+
+    def make_input(i):
+        with span("make_input"):
             datapoints[i] = data_source[i]
             inp = data_source.data_to_input(datapoints[i])
-            instance_id = f"{data_source.name}_{i}"
-            inp["instance_id"] = instance_id
-            inp["raw_data"] = data_source._dataset[i]
             try:
-                return code_editor.generate_diff(inp)
-            finally:
-                if cb.total_cost == 0:
-                    logger.warning(f"OpenAI cost is 0 for {instance_id}")
-                openai_stats["total_tokens"] += cb.total_tokens
-                openai_stats["total_cost"] += cb.total_cost
-                openai_stats["successful_requests"] += cb.successful_requests
-                openai_stats["completion_tokens"] += cb.completion_tokens
-                openai_stats["projected_cost"] = openai_stats["total_cost"] * (end - start) / (num_added + 1)
-                openai_stats["average_cost"] = openai_stats["total_cost"] / (num_added + 1)
-                if wandb.run is not None:
-                    wandb.log({"openai": openai_stats})
-
-    with ThreadPoolExecutor(max_workers=inference_config.num_workers) as executor:
-        queue = [(executor.submit(process_datapoint, i), i) for i in range(start, end)]
-        while queue:
-            task_index = {task: i for (task, i) in queue}
-            queue = []
-            logger.info(
-                f"Waiting for {end - start - num_added} tasks to complete using {inference_config.num_workers} workers..."
-            )
-            for task in as_completed(task_index):
-                i = task_index[task]
-                # Get the result
-                y_pred = None
-                res = {}
-                data = datapoints.get(i, None)
+                inp["instance_id"] = data_source.get_instance_id(i)
+                inp["raw_data"] = data_source._dataset[i]
+            except BaseException:
+                # The caller releases only the inputs it gets, e.g. the worktree slot would stay locked
+                release_input(inp)
+                raise
+            return inp
+
+    def release_input(inp):
+        with span("release_input"):
+            data_source.release_input(inp)
+
+    def record_openai_stats(cb, instance_id, run_start: float):
+        if cb.total_cost == 0:
+            logger.warning(f"OpenAI cost is 0 for {instance_id}")
+        metrics.add("openai.datapoints")
+        metrics.add("openai.total_tokens", cb.total_tokens)
+        metrics.add("openai.total_cost", cb.total_cost)
+        metrics.add("openai.successful_requests", cb.successful_requests)
+        metrics.add("openai.completion_tokens", cb.completion_tokens)
+        metrics.observe("latency.datapoint_sec", time.perf_counter() - run_start)
+
+    def process_datapoint(i):
+        repo_lock = data_source.get_lock(i)
+        with span("datapoint", index=i, instance_id=data_source.get_instance_id(i)), ExitStack() as stack:
+            wait_start = time.perf_counter()
+            with span("repo_lock"):
+                stack.enter_context(repo_lock)
+            record_lock_wait(wait_start)
+            with get_openai_callback() as cb, track_llm_calls(controller):
+                run_start = time.perf_counter()
+                inp = make_input(i)
                 try:
-                    if data is None:
-                        raise ValueError(f"Data for #{i} is None")
-                    row_info = f"{data.repo}@{data.base_hash[:8]}"
-                    res = task.result()
-                    y_pred = res["prediction"] + "\n"
-                    if y_pred.strip() == "" and inference_config.skip_empty_diffs:
-                        raise ValueError("Empty prediction")
-                except Exception as e:
-                    if "Empty prediction" in str(e):
-                        logger.warning(f"Empty prediction for #{i} {row_info}")
-                    else:
-                        logger.warning(f"Error in inference for #{i} {row_info}", exc_info=e)
-                    tries[i] += 1
-                    if tries[i] < inference_config.num_tries:
-                        queue.append((executor.submit(process_datapoint, i), i))
+                    return code_editor.generate_diff(inp)
+                finally:
+                    release_input(inp)
+                    record_openai_stats(cb, inp["instance_id"], run_start)
+
+    async def aprocess_datapoint(i):
+        # Blocking git and file system work goes to the executor, the agent itself runs on the event loop
+        repo_lock = data_source.get_lock(i)
+        with span("datapoint", index=i, instance_id=data_source.get_instance_id(i)):
+            wait_start = time.perf_counter()
+            with span("repo_lock"):
+                await asyncio.to_thread(repo_lock.__enter__)
+            try:
+                record_lock_wait(wait_start)
+                with get_openai_callback() as cb, track_llm_calls(controller):
+                    run_start = time.perf_counter()
+                    inp = await asyncio.to_thread(make_input, i)
+                    try:
+                        return await code_editor.agenerate_diff(inp)
+                    finally:
+                        await asyncio.to_thread(release_input, inp)
+                        record_openai_stats(cb, inp["instance_id"], run_start)
+            finally:
+                await asyncio.to_thread(repo_lock.__exit__, None, None, None)
+
+    def handle_result(i, get_result) -> bool:
+        """Save the result of a data point. Returns whether it has to be retried."""
+        nonlocal num_added
+        # Get the result
+        y_pred = None
+        res = {}
+        data = datapoints.get(i, None)
+        row_info = ""
+        try:
+            if data is None:
+                raise ValueError(f"Data for #{i} is None")
+            row_info = f"{data.repo}@{data.base_hash[:8]}"
+            res = get_result()
+            y_pred = res["prediction"] + "\n"
+            if y_pred.strip() == "" and inference_config.skip_empty_diffs:
+                raise ValueError("Empty prediction")
+        except Exception as e:
+            if "Empty prediction" in str(e):
+                logger.warning(f"Empty prediction for #{i} {row_info}")
+            else:
+                logger.warning(f"Error in inference for #{i} {row_info}", exc_info=e)
+            tries[i] += 1
+            if tries[i] < inference_config.num_tries:
+                return True
+            else:
+                logger.error(f"Failed to predict for #{i} {row_info} after {inference_config.num_tries} tries")
+
+        # Get the lines for editing
+        viewed_lines = res.get("viewed_lines", {})
+        viewed_lines = json.dumps({k: list(v) for k, v in viewed_lines.items() if v})
+        # Get run summary
+        new_run_summary = dict(res.get("run", {}))
+        for tool, tool_info in new_run_summary.pop("tools", {}).items():
+            for k, v in tool_info.items():
+                metrics.add(f"tools.{tool}.{k}", v)
+        if "duration_sec" in new_run_summary:
+            metrics.observe("latency.agent_run_sec", new_run_summary["duration_sec"])
+        for stage, stage_info in new_run_summary.pop("stages", {}).items():
+            for k, v in stage_info.items():
+                metrics.add(f"stages.{stage.replace('.', '_')}.{k}", v)
+        for k, v in new_run_summary.items():
+            metrics.set(k, v)
+        # Append the result to the output stream
+        writer.write(
+            {
+                "diff_pred": y_pred,
+                "diff_true": data.diff_true,
+                "repo": data.repo,
+                "base_hash": data.base_hash,
+                "message": data.message,
+                "viewed_lines": viewed_lines,
+                "model_name": model_name,
+                "instance_id": data_source.get_instance_id(i),
+            }
+        )
+        # Update the progress bar
+        num_added += 1
+        progress_bar.update(1)
+        progress_bar.set_postfix_str(f"latest: {i} {row_info}")
+        return False
+
+    # Data points of the same repository and base commit run back to back, different repositories run in parallel
+    scheduler = AffinityScheduler(
+        {i: data_source.get_affinity_key(i) for i in todo}, exclusive_repos=data_source.needs_repo_lock()
+    )
+
+    # Failed data points wait for a jittered exponential backoff before they are rescheduled
+    retries = []  # Heap of (time to retry at, data point)
+
+    def schedule_retry(i):
+        delay = backoff_delay(tries[i], inference_config.retry_backoff, inference_config.retry_backoff_max)
+        heapq.heappush(retries, (time.monotonic() + delay, i))
+
+    def release_retries():
+        """Reschedule the retries that are due. Returns the time until the next one or None if there are none."""
+        now = time.monotonic()
+        while retries and retries[0][0] <= now:
+            scheduler.push(heapq.heappop(retries)[1])
+        return retries[0][0] - now if retries else None
+
+    def concurrency_limit():
+        return controller.limit if controller is not None else max_in_flight
+
+    def log_concurrency(in_flight):
+        concurrency_stats = {
+            "limit": concurrency_limit(),
+            "in_flight": in_flight,
+            "queue_depth": len(scheduler) + len(retries),
+        }
+        if controller is not None:
+            concurrency_stats.update(controller.stats)
+            concurrency_stats["llm_latency_sec"] = controller.latency or 0.0
+        for k, v in concurrency_stats.items():
+            metrics.set(f"concurrency.{k}", v)
+
+    def run_threads():
+        with ThreadPoolExecutor(max_workers=inference_config.num_workers) as executor:
+            running = {}
+
+            def submit_ready():
+                while len(running) < concurrency_limit():
+                    i = scheduler.pop()
+                    if i is None:
+                        break
+                    running[executor.submit(process_datapoint, i)] = i
+
+            logger.info(f"Waiting for {len(todo)} tasks to complete using {inference_config.num_workers} workers...")
+            while True:
+                timeout = release_retries()
+                submit_ready()
+                if not running:
+                    if timeout is None:
+                        break
+                    time.sleep(timeout)
+                    continue
+                finished, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for task in finished:
+                    i = running.pop(task)
+                    scheduler.done(i)
+                    if handle_result(i, task.result):
+                        schedule_retry(i)
+                log_concurrency(len(running))
+
+    def run_pipeline():
+        # Per data point resources released by the last stage: the span, the lock, the workspace and the callbacks
+        stacks = {}
+
+        def load_data(i, _):
+            stack = stacks[i] = ExitStack()
+            stack.enter_context(span("datapoint", index=i, instance_id=data_source.get_instance_id(i)))
+            with span("load_data"):
+                datapoints[i] = data_source[i]
+
+        def prepare_workspace(i, _):
+            wait_start = time.perf_counter()
+            with span("repo_lock"):
+                stacks[i].enter_context(data_source.get_lock(i))
+            record_lock_wait(wait_start)
+            with span("prepare_workspace"):
+                inp = data_source.data_to_input(datapoints[i])
+            stacks[i].callback(release_input, inp)
+            inp["instance_id"] = data_source.get_instance_id(i)
+            inp["raw_data"] = data_source._dataset[i]
+            return inp
+
+        def build_context(i, inp):
+            stack = stacks[i]
+            cb = stack.enter_context(get_openai_callback())
+            stack.enter_context(track_llm_calls(controller))
+            stack.callback(record_openai_stats, cb, inp["instance_id"], time.perf_counter())
+            run = code_editor.prepare_run(inp)
+            try:
+                # The context providers are released by the run, or here if the item does not get to the run
+                stack.callback(run.cancel)
+            except BaseException:
+                run.cancel()
+                raise
+            return run
+
+        def run_agent(i, run):
+            with span("generate_diff"):
+                return run()
+
+        def release(i, _):
+            stack = stacks.pop(i, None)
+            if stack is not None:
+                stack.close()
+
+        stages = [
+            Stage("load_data", load_data, inference_config.prepare_workers),
+            Stage("prepare_workspace", prepare_workspace, inference_config.prepare_workers),
+            Stage("build_context", build_context, inference_config.prepare_workers),
+            Stage("run_agent", run_agent, inference_config.num_workers),
+            Stage("release", release, inference_config.prepare_workers, cleanup=True),
+        ]
+        in_flight = set()
+
+        def log_stages():
+            for stage, stage_stats in pipeline.stats().items():
+                for k, v in stage_stats.items():
+                    metrics.set(f"pipeline.{stage}.{k}", v)
+
+        logger.info(
+            f"Waiting for {len(todo)} tasks to complete using {inference_config.num_workers} agent workers and "
+            f"{inference_config.prepare_workers} workers per preparation stage..."
+        )
+        try:
+            with StagedPipeline(stages, queue_size=inference_config.prefetch) as pipeline:
+                while True:
+                    timeout = release_retries()
+                    while len(in_flight) < concurrency_limit():
+                        i = scheduler.pop()
+                        if i is None:
+                            break
+                        in_flight.add(i)
+                        pipeline.put(i)
+                    if not in_flight:
+                        if timeout is None:
+                            break
+                        time.sleep(timeout)
                         continue
-                    else:
-                        logger.error(f"Failed to predict for #{i} {row_info} after {inference_config.num_tries} tries")
-
-                # Get the lines for editing
-                viewed_lines = res.get("viewed_lines", {})
-                viewed_lines = json.dumps({k: list(v) for k, v in viewed_lines.items() if v})
-                # Get run summary
-                new_run_summary = res.get("run", {})
-                if wandb.run is not None:
-                    # upd tools
-                    if "tools" in new_run_summary:
-                        for tool in new_run_summary["tools"]:
-                            for k, v in new_run_summary["tools"][tool].items():
-                                run_summary.setdefault("tools", {}).setdefault(tool, {}).setdefault(k, 0)
-                                run_summary["tools"][tool][k] += v
-                        new_run_summary.pop("tools")
-                    # upd rest
-                    run_summary.update(new_run_summary)
-                    # log
-                    wandb.log(run_summary)
-                # Add the result to the dataframe
-                df.loc[i - start] = [
-                    y_pred,
-                    data.diff_true,
-                    data.repo,
-                    data.base_hash,
-                    data.message,
-                    viewed_lines,
-                    model_name,
-                ]
-                # Update the progress bar
-                num_added += 1
-                progress_bar.update(1)
-                progress_bar.set_postfix_str(f"latest: {i} {row_info}")
-
-                # Save the checkpoint
-                if (
-                    inference_config.checkpoint_iters is not None
-                    and num_added
-                    and num_added % inference_config.checkpoint_iters == 0
-                ):
-                    hydra_output_path = os.path.join(
-                        hydra_output_dir,
-                        os.path.basename(output_path) + f".checkpoint_{num_added}.jsonl",
-                    )
-                    logger.info(f"Saving the checkpoint to {hydra_output_path}")
-                    my_save_jsonl(df, hydra_output_path)
+                    finished = pipeline.get(timeout=timeout)
+                    if finished is not None:
+                        i, res, error = finished
+                        in_flight.discard(i)
+                        scheduler.done(i)
+
+                        def get_result():
+                            if error is not None:
+                                raise error
+                            return res
+
+                        if handle_result(i, get_result):
+                            schedule_retry(i)
+                    log_concurrency(len(in_flight))
+                    log_stages()
+        finally:
+            # Items that were not released by the pipeline (e.g. when it is aborted)
+            for stack in list(stacks.values()):
+                stack.close()
+        stats = pipeline.stats()
+        log_stages()
+        logger.info(
+            "Pipeline utilisation: "
+            + ", ".join(f"{stage} {stage_stats['utilisation']:.0%}" for stage, stage_stats in stats.items())
+        )
+
+    async def run_async():
+        # A handful of threads serve the blocking work of all the in-flight agent runs
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=inference_config.num_workers))
+        running = {}
+
+        def submit_ready():
+            while len(running) < concurrency_limit():
+                i = scheduler.pop()
+                if i is None:
+                    break
+                running[asyncio.create_task(aprocess_datapoint(i))] = i
+
+        logger.info(
+            f"Waiting for {len(todo)} tasks to complete with up to {inference_config.max_concurrency} tasks in flight "
+            f"using {inference_config.num_workers} threads..."
+        )
+        while True:
+            timeout = release_retries()
+            submit_ready()
+            if not running:
+                if timeout is None:
+                    break
+                await asyncio.sleep(timeout)
+                continue
+            finished, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                i = running.pop(task)
+                scheduler.done(i)
+                if handle_result(i, task.result):
+                    schedule_retry(i)
+            log_concurrency(len(running))
+
+    # Nested spans of every data point (lock waits, checkouts, context providers, tools, LLM calls)
+    tracer = Tracer() if inference_config.trace else None
+    set_tracer(tracer)
+    try:
+        with writer, metrics:
+            if inference_config.use_async:
+                asyncio.run(run_async())
+            elif inference_config.pipeline:
+                run_pipeline()
+            else:
+                run_threads()
+    finally:
+        set_tracer(None)
+        if tracer is not None:
+            trace_path = os.path.join(hydra_output_dir, "trace.json")
+            tracer.save(trace_path)
+            logger.info(f"Saved the trace to {trace_path}, open it in https://ui.perfetto.dev")
+
+    run_metrics = metrics.snapshot()
+    lock_stats = run_metrics.get("scheduler", {})
+    logger.info(
+        f"Waited for repository locks for {lock_stats.get('lock_wait_sec', 0.0):.1f}s in total "
+        f"(max {lock_stats.get('max_lock_wait_sec', 0.0):.1f}s)"
+    )
+    if controller is not None:
+        logger.info(f"Adaptive concurrency: {run_metrics.get('concurrency', {})}")
+
+    # Build the final results from the stream
+    df = collect_results([output_path], data_source)
 
     # Save the results to wandb
     if wandb.run is not None:
         wandb.log({"prediction": wandb.Table(dataframe=df)})
         wandb.run.tags = wandb.run.tags + (f"unique:{unique_hex}",)
 
-    # Return the prepared dataframe
+    # The predictions of a shard are saved as is, the SWEBench predictions are saved by merge_shards.py
+    hydra_output_path = save_results(
+        df, model_name, output_path, hydra_output_dir, data_source if num_shards == 1 else None
+    )
+    if num_shards > 1:
+        logger.info(
+            f"Merge the {num_shards} shards with `python code_editing/scripts/merge_shards.py` using the same config "
+            f"and inference.output_path={merged_output_path}"
+        )
+
+    if wandb.run is not None:
+        wandb.log_artifact(hydra_output_dir, name=f"inference_results.{model_name}", type="inference_results")
+    logger.info(f"Saved the results to {hydra_output_path}")
+    return df
+
+
+def collect_results(paths: List[str], data_source: CEDataSource) -> pd.DataFrame:
+    """
+    Final results from the streamed results: the latest result of a data point wins, and the data points are ordered
+    as in the data source, so that the results do not depend on the order of completion or on the sharding.
+    """
+    rows = {}
+    for path in paths:
+        for n, row in enumerate(read_jsonl_rows(path)):
+            rows[row.get("instance_id") or (path, n)] = row
+    order = {data_source.get_instance_id(i): i for i in range(len(data_source))}
+    rows = sorted(rows.values(), key=lambda row: order.get(row.get("instance_id"), len(order)))
+    return pd.DataFrame(rows, columns=OUTPUT_COLUMNS)
+
+
+def save_results(
+    df: pd.DataFrame,
+    model_name: str,
+    output_path: str,
+    hydra_output_dir: str,
+    data_source: Optional[CEDataSource] = None,
+) -> str:
+    """Save the results to the output path and the hydra output dir, and the SWEBench predictions if supported."""
     my_save_jsonl(df, output_path)
     # Save to hydra output path
     hydra_output_path = os.path.join(hydra_output_dir, os.path.basename(output_path))
@@ -181,11 +549,7 @@ def inference_loop(
             f.write("\n".join(instance_ids))
         # log the paths
         logger.info(f"Saved the predictions in SWEBench format to {swebench_output_path}")
-
-    if wandb.run is not None:
-        wandb.log_artifact(hydra_output_dir, name=f"inference_results.{model_name}", type="inference_results")
-    logger.info(f"Saved the results to {hydra_output_path}")
-    return df
+    return hydra_output_path
 
 
 def init_wandb(cfg, run_name, tags=None):
@@ -218,5 +582,5 @@ def init_output_path(baseline_name, cfg, data_source):
 def my_save_jsonl(df: pd.DataFrame, path: str):
     # Hack for https://github.com/ultrajson/ultrajson/issues/252#issuecomment-281978941
     with open(path, "w") as f:
-        for _, row in df.iterrows():
-            f.write(json.dumps(row.to_dict()) + "\n")
+        for row in df.to_dict(orient="records"):
+            f.write(json.dumps(row) + "\n")
@@ -17,6 +17,7 @@ dotenv.load_dotenv()
 from code_editing.configs.evaluation_config import RunEvaluationConfig, setup_evaluation_config
 from code_editing.data_sources import SWEBenchDataSource
 from code_editing.data_sources.extract_code_base import CodeBaseExtractor
+from code_editing.data_sources.hf_source import HuggingFaceSimpleGitCEDataSource
 from code_editing.metrics.base_metric import BaseMetric
 
 
@@ -26,6 +27,8 @@ def main(cfg: RunEvaluationConfig):
     # Instantiate the extractor and data source
     extractor: CodeBaseExtractor = instantiate(cfg.extractor)
     data_source = instantiate(cfg.data_source, extractor=extractor)
+    if isinstance(data_source, HuggingFaceSimpleGitCEDataSource):
+        data_source.prepare_repositories()
 
     # Read the input file specified by the user
     if cfg.input_path.endswith(".csv"):
@@ -34,17 +37,19 @@ def main(cfg: RunEvaluationConfig):
         df = pd.read_json(cfg.input_path, lines=True)
         # if SWE format, convert to the expected format
         if "model_name_or_path" in df.columns and isinstance(data_source, SWEBenchDataSource):
-            # rename model_name_or_path to model_name
-            dataset_df = data_source._dataset.to_pandas()
-            # add diff_true, message, repo, base_hash from the dataset merged on instance_id
-            df = df.merge(dataset_df, left_on="instance_id", right_on="instance_id")
+            # add diff_true, message, repo, base_hash from the dataset by instance_id
+            df = df[df["instance_id"].apply(data_source.has_instance_id)].reset_index(drop=True)
+            rows = [data_source.get_row_by_instance_id(instance_id) for instance_id in df["instance_id"]]
             df["model_name"] = df["model_name_or_path"]
             df["diff_pred"] = df["model_patch"]
-            df["diff_true"] = df["patch"]
-            df["message"] = df["problem_statement"]
-            df["base_hash"] = df["base_commit"]
+            df["diff_true"] = [row["patch"] for row in rows]
+            df["repo"] = [row["repo"] for row in rows]
+            df["message"] = [row["problem_statement"] for row in rows]
+            df["base_hash"] = [row["base_commit"] for row in rows]
             df["viewed_lines"] = df["diff_true"].apply(lambda x: "{}")
-            df = df[["diff_pred", "diff_true", "repo", "base_hash", "message", "viewed_lines", "model_name"]]
+            df = df[
+                ["diff_pred", "diff_true", "repo", "base_hash", "message", "viewed_lines", "model_name", "instance_id"]
+            ]
 
     # Get the 'diff_pred' column from the dataframe, replace any NaN values with an empty string
     diff_pred = df["diff_pred"].fillna("")
@@ -76,11 +81,6 @@ def main(cfg: RunEvaluationConfig):
             except:
                 logging.warning(f"Failed to use the artifact inference_results.{model_name}:latest", exc_info=True)
 
-    # Lock all repositories in the data source
-    locks = data_source.all_locks()
-    for lock in locks:
-        lock.acquire()
-
     # Iterate through metrics
     for name, metric_conf in pbar:
         pbar.set_postfix_str(name)
@@ -93,10 +93,6 @@ def main(cfg: RunEvaluationConfig):
             logging.error(f"Failed to run metric {name}", exc_info=e)
             res[name] = None
 
-    # Release all locks in the data source
-    for lock in locks:
-        lock.release()
-
     res_json = json.dumps(res, indent=2)
     print(res_json)
     # Save the results to the output path
@@ -0,0 +1,61 @@
+import logging
+import os
+from typing import Union
+
+import dotenv
+import hydra
+import pandas as pd
+from hydra.core.config_store import ConfigStore
+from hydra.core.hydra_config import HydraConfig
+from hydra.utils import instantiate
+
+dotenv.load_dotenv()
+
+from code_editing.configs.agents.agent_config import RunAgentConfig, setup_agent_config
+from code_editing.configs.baseline_config import RunBaselineConfig, setup_baseline_config
+from code_editing.scripts.common import collect_results, get_shard_path, save_results
+
+logger = logging.getLogger("inference")
+
+
+def merge_shards(cfg: Union[RunAgentConfig, RunBaselineConfig], output_dir: str) -> pd.DataFrame:
+    """Merge the shards of the run with the config into its output path, and save the results to the output dir."""
+    num_shards = cfg.inference.num_shards
+    output_path = cfg.inference.output_path
+    if output_path is None:
+        raise ValueError("Pass the inference.output_path of the sharded run")
+
+    # The dataset is only needed to order the results and to save the SWEBench predictions
+    data_source = instantiate(cfg.data_source, extractor=None, lazy_clone=True, materialize=False)
+
+    paths = [get_shard_path(output_path, shard_index, num_shards) for shard_index in range(num_shards)]
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        raise ValueError(f"Missing shards: {missing}")
+    df = collect_results(paths, data_source)
+
+    model_names = df["model_name"].dropna().unique()
+    if len(model_names) != 1:
+        raise ValueError(f"The shards belong to different runs: {list(model_names)}")
+    failed = df["diff_pred"].isna().sum()
+    if failed:
+        logger.warning(f"{failed} data points have failed")
+
+    hydra_output_path = save_results(df, model_names[0], output_path, output_dir, data_source)
+    logger.info(f"Merged {len(df)} results of {num_shards} shards into {output_path} and {hydra_output_path}")
+    return df
+
+
+@hydra.main(version_base=None, config_path="conf", config_name="agent")
+def main(cfg: Union[RunAgentConfig, RunBaselineConfig]):
+    """
+    Merge the results of a sharded inference run (inference.num_shards > 1) into the results of a single run.
+    Use the config of the run (e.g. -cn backbone_only for run_backbone.py) and its inference.output_path.
+    """
+    merge_shards(cfg, HydraConfig.get().runtime.output_dir)
+
+
+if __name__ == "__main__":
+    setup_agent_config(ConfigStore.instance())
+    setup_baseline_config(ConfigStore.instance())
+    main()
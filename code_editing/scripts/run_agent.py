@@ -10,6 +10,7 @@ from langchain_core.runnables import RunnableConfig
 from tqdm.contrib.logging import logging_redirect_tqdm
 
 from code_editing.agents.agent_graph import AgentGraphPartial
+from code_editing.agents.context_providers.pool import ContextProviderPool
 
 dotenv.load_dotenv()
 
@@ -25,7 +26,7 @@ from code_editing.scripts.common import finish_wandb, get_cool_name, inference_l
 @hydra.main(version_base=None, config_path="conf", config_name="agent")
 def main(cfg: RunAgentConfig):
     # Initialize extractor and data source
-    extractor = CheckoutExtractor()
+    extractor = CheckoutExtractor(use_worktrees=cfg.inference.use_worktrees)
     data_source: CEDataSource = instantiate(cfg.data_source, extractor=extractor)
     if not isinstance(data_source, HuggingFaceSimpleGitCEDataSource):
         raise ValueError("This script only supports HuggingFaceSimpleGitCEDataSource")
@@ -42,6 +43,8 @@ def main(cfg: RunAgentConfig):
     agent_graph_partial: AgentGraphPartial = instantiate(cfg.graph, llm=llm, _partial_=True)
 
     # Set up the tracing tags and metadata
+    if cfg.inference.num_shards > 1 and cfg.inference.run_name is None:
+        raise ValueError("All the shards of a run need the same inference.run_name")
     run_name = cfg.inference.run_name or f"agent_{get_cool_name()}"
     run_name = f"{cfg.inference.run_prefix}{run_name}{cfg.inference.run_suffix}"
     tags = [
@@ -59,6 +62,14 @@ def main(cfg: RunAgentConfig):
         data_path=data_path,
         context_providers_cfg=cfg.context,
         runnable_config=RunnableConfig(run_name=run_name, tags=tags, metadata=metadata, recursion_limit=1024),
+        context_pool=(
+            ContextProviderPool(cfg.context_pool.max_size, cfg.context_pool.max_memory_mb)
+            if cfg.context_pool.enabled
+            else None
+        ),
+        lazy_context=cfg.lazy_context,
+        speculative_context=cfg.speculative_context,
+        reuse_graph=cfg.reuse_graph,
     )
 
     # Name for this run
@@ -0,0 +1,75 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Optional
+
+from tqdm import tqdm
+
+from code_editing.utils.git_utils import clone_repo, get_repo_path
+
+logger = logging.getLogger("clone_manager")
+
+# Directory with local mirrors of the repositories (e.g. bare repos named 'owner__name.git')
+MIRROR_PATH_ENV = "CE_MIRROR_PATH"
+
+
+class CloneManager:
+    """
+    Clones the repositories of a dataset into data_dir with bounded parallelism.
+
+    Repositories that are already cloned are skipped, so it is cheap to call it again for every range of data points.
+    """
+
+    def __init__(
+        self,
+        data_dir: str,
+        workers: int = 4,
+        blobless: bool = False,
+        mirror_dir: Optional[str] = None,
+        url_template: str = "https://github.com/{repo}.git",
+    ):
+        self.data_dir = data_dir
+        self.url_template = url_template
+        self.workers = max(1, workers)
+        self.blobless = blobless
+        self.mirror_dir = mirror_dir or os.getenv(MIRROR_PATH_ENV)
+
+    def _clone(self, repo: str) -> float:
+        start = time.perf_counter()
+        repo_url = self.url_template.format(repo=repo)
+        clone_repo(repo, self.data_dir, repo_url=repo_url, blobless=self.blobless, mirror_dir=self.mirror_dir)
+        return time.perf_counter() - start
+
+    def clone_all(self, repos: Iterable[str], desc: str = "Cloning repositories") -> Dict[str, float]:
+        """Clone the repositories that are missing. Returns the clone time in seconds for each cloned repository."""
+        repos = sorted(set(repos))
+        missing = [repo for repo in repos if not os.path.exists(get_repo_path(self.data_dir, repo))]
+        if not missing:
+            return {}
+
+        os.makedirs(self.data_dir, exist_ok=True)
+        timings = {}
+        errors = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            tasks = {executor.submit(self._clone, repo): repo for repo in missing}
+            pbar = tqdm(as_completed(tasks), total=len(tasks), desc=desc)
+            for task in pbar:
+                repo = tasks[task]
+                try:
+                    timings[repo] = task.result()
+                    logger.info(f"Cloned {repo} in {timings[repo]:.1f}s")
+                except Exception as e:
+                    logger.error(f"Failed to clone {repo}", exc_info=e)
+                    errors[repo] = e
+                pbar.set_postfix_str(repo)
+        if errors:
+            raise RuntimeError(f"Failed to clone {len(errors)} repositories: {', '.join(sorted(errors))}")
+
+        total = sum(timings.values())
+        slowest = max(timings, key=timings.get)
+        logger.info(
+            f"Cloned {len(timings)} repositories ({total:.1f}s in total, the slowest is {slowest} with "
+            f"{timings[slowest]:.1f}s) using {self.workers} workers"
+        )
+        return timings
@@ -0,0 +1,238 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, TypeVar
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+logger = logging.getLogger("concurrency")
+
+# HTTP statuses that mean that the provider is overloaded
+OVERLOAD_STATUSES = {408, 429, 500, 502, 503, 504, 529}
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """Whether the error is a rate limit, a timeout or a 5xx of the LLM provider."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in OVERLOAD_STATUSES
+    name = type(error).__name__
+    return "RateLimit" in name or "Timeout" in name or "Overloaded" in name
+
+
+def backoff_delay(tries: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Exponential backoff with jitter: a random delay between the half and the full of min(cap, base * 2^(tries-1))."""
+    if base <= 0 or tries <= 0:
+        return 0.0
+    delay = min(cap, base * 2 ** (tries - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def map_concurrently(fn: Callable[[T], R], items: Iterable[T], max_workers: int) -> List[R]:
+    """
+    Apply the function to the items on at most [max_workers] threads, the results are in the order of the items.
+
+    Every call runs in a copy of the current context (e.g. with the current span and run). The first error in the order
+    of the items is raised.
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items)), thread_name_prefix="map") as executor:
+        futures = [executor.submit(contextvars.copy_context().run, fn, item) for item in items]
+        return [future.result() for future in futures]
+
+
+class ReadWriteLock:
+    """Any number of readers or one writer. Waiting writers go first, so a stream of reads does not starve them."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class AIMDController:
+    """
+    Additive increase / multiplicative decrease of the number of data points in flight.
+
+    The limit grows by one after [limit] successful LLM calls in a row and is cut by [decrease] on a rate limit or
+    5xx error. Only the calls started after the last cut can cut it again, so a burst of failures of the same overload
+    cuts the limit once. Thread-safe.
+
+    With [latency_tolerance], the limit is also cut when the LLM latency grows beyond [latency_tolerance] times its
+    baseline. The latency is per output token when the responses report it, as the prompts of an agent grow during a
+    trajectory and the calls get slower even if the provider is healthy.
+    """
+
+    def __init__(
+        self,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        initial: Optional[int] = None,
+        decrease: float = 0.5,
+        latency_tolerance: Optional[float] = None,
+        latency_smoothing: float = 0.2,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.latency_smoothing = latency_smoothing
+        if initial is None:
+            initial = (self.min_limit + self.max_limit) // 2
+        self._limit = min(self.max_limit, max(self.min_limit, initial))
+        self._successes = 0
+        self._lock = threading.Lock()
+        self._last_decrease = float("-inf")
+        self._latency: Optional[float] = None
+        self._baseline: Optional[float] = None
+        self.stats = {"increases": 0, "decreases": 0, "overload_errors": 0}
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def latency(self) -> Optional[float]:
+        """Smoothed latency of the LLM calls in seconds (per output token if reported)."""
+        return self._latency
+
+    def on_success(self, latency: float, started_at: Optional[float] = None) -> None:
+        with self._lock:
+            if self._latency is None:
+                self._latency = self._baseline = latency
+            else:
+                self._latency += self.latency_smoothing * (latency - self._latency)
+                # The baseline follows the latency down at once and up slowly
+                self._baseline = min(self._latency, self._baseline + 0.01 * (self._latency - self._baseline))
+            if self.latency_tolerance is not None and self._latency > self.latency_tolerance * self._baseline:
+                self._decrease(started_at, "latency")
+                return
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_limit:
+                self._successes = 0
+                self._limit += 1
+                self.stats["increases"] += 1
+
+    def on_error(self, error: BaseException, started_at: Optional[float] = None) -> None:
+        if not is_overload_error(error):
+            return
+        with self._lock:
+            self.stats["overload_errors"] += 1
+            self._decrease(started_at, type(error).__name__)
+
+    def _decrease(self, started_at: Optional[float], reason: str):
+        if started_at is not None and started_at < self._last_decrease:
+            return
+        old_limit = self.limit
+        self._limit = max(self.min_limit, int(self._limit * self.decrease))
+        self._successes = 0
+        self._last_decrease = time.monotonic()
+        if self.limit < old_limit:
+            self.stats["decreases"] += 1
+            logger.info(f"Concurrency limit {old_limit} -> {self.limit} ({reason})")
+
+
+def _output_tokens(response: Any) -> Optional[int]:
+    """Number of the generated tokens reported in the LLM result, if any."""
+    token_usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+    if token_usage.get("completion_tokens"):
+        return token_usage["completion_tokens"]
+    tokens = 0
+    for generations in getattr(response, "generations", None) or []:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            tokens += usage.get("output_tokens", 0)
+    return tokens or None
+
+
+class ConcurrencyCallbackHandler(BaseCallbackHandler):
+    """Reports the latency and the errors of the LLM calls to an AIMDController."""
+
+    def __init__(self, controller: AIMDController):
+        self.controller = controller
+        self._started: Dict[UUID, float] = {}
+
+    def _start(self, run_id: UUID):
+        self._started[run_id] = time.monotonic()
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id)
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        started_at = self._started.pop(run_id, None)
+        if started_at is not None:
+            latency = time.monotonic() - started_at
+            output_tokens = _output_tokens(response)
+            if output_tokens:
+                latency /= output_tokens
+            self.controller.on_success(latency, started_at)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.controller.on_error(error, self._started.pop(run_id, None))
+
+
+concurrency_callback_var: ContextVar[Optional[ConcurrencyCallbackHandler]] = ContextVar(
+    "concurrency_callback", default=None
+)
+register_configure_hook(concurrency_callback_var, True)
+
+
+@contextmanager
+def track_llm_calls(controller: Optional[AIMDController]):
+    """Report the LLM calls made in this context to the controller (if any)."""
+    if controller is None:
+        yield
+        return
+    token = concurrency_callback_var.set(ConcurrencyCallbackHandler(controller))
+    try:
+        yield
+    finally:
+        concurrency_callback_var.reset(token)
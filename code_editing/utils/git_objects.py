@@ -0,0 +1,108 @@
+import atexit
+import logging
+import os
+import subprocess
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("git_objects")
+
+
+class GitBlobReader:
+    """
+    Reads file contents at any commit straight from the object database of a repository.
+
+    It is backed by a long-lived `git cat-file --batch` process, so reading does not touch the working tree and
+    does not require the repository lock. The reader is thread-safe.
+    """
+
+    def __init__(self, repo_path: str):
+        self.repo_path = repo_path
+        self._proc: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+
+    def _start(self) -> subprocess.Popen:
+        if self._proc is None or self._proc.poll() is not None:
+            self._proc = subprocess.Popen(
+                ["git", "cat-file", "--batch"],
+                cwd=self.repo_path,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+        return self._proc
+
+    def _request(self, obj: str) -> Optional[bytes]:
+        proc = self._start()
+        proc.stdin.write(obj.encode("utf-8") + b"\n")
+        proc.stdin.flush()
+        # Header: "<sha> <type> <size>" or "<object> missing" (or "ambiguous")
+        header = proc.stdout.readline()
+        if not header:
+            raise BrokenPipeError(f"git cat-file exited unexpectedly in {self.repo_path}")
+        # The object name is echoed back as is, so it may contain spaces
+        if header.endswith(b" missing\n") or header.endswith(b" ambiguous\n"):
+            return None
+        _, obj_type, size = header.rstrip(b"\n").rsplit(b" ", 2)
+        data = proc.stdout.read(int(size))
+        proc.stdout.read(1)  # Trailing newline
+        if obj_type != b"blob":
+            return None
+        return data
+
+    def read_bytes(self, commit_sha: str, file: str) -> Optional[bytes]:
+        """Contents of the file at given commit or None if there is no such file."""
+        obj = f"{commit_sha}:{file}"
+        with self._lock:
+            try:
+                return self._request(obj)
+            except (BrokenPipeError, OSError):
+                # Restart the process once
+                self._close()
+                return self._request(obj)
+
+    def read(self, commit_sha: str, file: str) -> Optional[str]:
+        """Decoded contents of the file at given commit or None if there is no such file."""
+        data = self.read_bytes(commit_sha, file)
+        if data is None:
+            return None
+        # Same as reading a checked out file in text mode
+        return data.decode("utf8", errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
+
+    def read_files(self, commit_sha: str, files: List[str]) -> Dict[str, str]:
+        """Contents of the files at given commit. Missing files (e.g. created in a diff) are replaced with ''."""
+        return {file: self.read(commit_sha, file) or "" for file in files}
+
+    def _close(self):
+        if self._proc is not None:
+            try:
+                self._proc.stdin.close()
+                self._proc.wait(timeout=5)
+            except Exception:
+                self._proc.kill()
+            self._proc = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+_readers: Dict[str, GitBlobReader] = {}
+_readers_lock = threading.Lock()
+
+
+def get_blob_reader(repo_path: str) -> GitBlobReader:
+    """Get the process-wide blob reader of the repository at repo_path."""
+    key = os.path.abspath(repo_path)
+    with _readers_lock:
+        if key not in _readers:
+            _readers[key] = GitBlobReader(key)
+        return _readers[key]
+
+
+@atexit.register
+def _close_readers():
+    with _readers_lock:
+        for reader in _readers.values():
+            reader.close()
+        _readers.clear()
@@ -1,11 +1,38 @@
+import hashlib
+import logging
 import os
+import re
+import shutil
 import tempfile
-from typing import Dict, List, Optional
+import threading
+from typing import Dict, List, Optional, Set
 
+import diskcache
 import git
 from filelock import FileLock
 from git import GitCommandError
 
+from code_editing.utils.git_objects import get_blob_reader
+from code_editing.utils.patch_apply import PatchApplyError, apply_patch
+from code_editing.utils.write_journal import WriteJournal
+
+logger = logging.getLogger("git_utils")
+
+# Set this environment variable to never touch the network (e.g. when working against a pre-populated mirror)
+GIT_OFFLINE_ENV = "CE_GIT_OFFLINE"
+
+# Fetch bookkeeping: repositories (by their common git dir) and commits that were already fetched by this process
+_fetch_guard = threading.Lock()
+_fetch_locks: Dict[str, threading.Lock] = {}
+_fetched_repos: Set[str] = set()
+_fetched_commits: Set[str] = set()
+
+# On-disk cache of the results that only depend on immutable inputs (commits and patches), shared between processes
+CACHE_VERSION = 1
+_caches: Dict[str, diskcache.Cache] = {}
+_caches_lock = threading.Lock()
+_FULL_SHA = re.compile(r"[0-9a-f]{40}")
+
 
 def get_repo_path(data_dir, repo) -> str:
     repo = repo.replace("/", "__")
@@ -23,136 +50,267 @@ def lock_repo(repo_path: str, data_dir: str) -> FileLock:
     lock_name = os.path.abspath(repo_path).replace("/", "_").replace("\\", "_")
     lock_name = "".join([c for c in lock_name if c.isalnum() or c in "_-"])
     lock_file = os.path.join(data_dir, "repos", f"{lock_name}.lock")
-    return FileLock(lock_file)
+    # Every call creates a new lock, so it is safe to release it from another thread (as in the async inference)
+    return FileLock(lock_file, thread_local=False)
 
 
 def _prep_repo(repo: git.Repo):
-    repo.git.fetch("--all")
+    """Discard local modifications of the working tree. Does not touch the network."""
     repo.git.checkout("HEAD", ".")
     repo.git.clean("-fd")
+    _set_autocrlf(repo)
+
+
+def _restore_journaled(repo: git.Repo, paths: List[str]) -> None:
+    """Discard the journaled writes. Modified tracked files are restored by the forced checkout that follows."""
+    if not paths:
+        return
+    tracked = set(repo.git.ls_files("--", *paths).splitlines())
+    parents = set()
+    for path in paths:
+        full_path = os.path.join(repo.working_dir, path)
+        if path not in tracked and os.path.isfile(full_path):
+            os.remove(full_path)
+            parents.add(os.path.dirname(path))
+    # The directories created for the new files, bottom-up, only if they are empty (git does not track empty ones)
+    for directory in sorted(parents, key=lambda d: d.count(os.sep), reverse=True):
+        while directory:
+            try:
+                os.rmdir(os.path.join(repo.working_dir, directory))
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+
+def _set_autocrlf(repo: git.Repo):
+    if str(repo.config_reader("repository").get_value("core", "autocrlf", "")).lower() == "true":
+        return
     with repo.config_writer("repository") as cw:
         cw.set_value("core", "autocrlf", "true")
 
 
-def _read_files(repo: git.Repo, files: List[str]) -> Dict[str, str]:
-    file_contents = {}
-    for file in files:
-        file_path = os.path.join(repo.working_dir, file)
-        if not os.path.exists(file_path):
-            # File does not exist (e.g. created in the diff)
-            file_contents[file] = ""
-            continue
-        try:
-            with open(file_path, "r", encoding="utf8", errors="ignore") as f:
-                file_contents[file] = f.read()
-        except Exception as e:
-            file_contents[file] = ""
-            print(f"Can not read file with ext {file}. Replace with empty string...", e)
-    return file_contents
+def _get_cache(data_dir: str) -> diskcache.Cache:
+    cache_dir = os.path.abspath(os.path.join(data_dir, "cache", "git"))
+    with _caches_lock:
+        if cache_dir not in _caches:
+            _caches[cache_dir] = diskcache.Cache(cache_dir)
+        return _caches[cache_dir]
+
 
+def _cache_key(name: str, repo: str, *shas: str, patch: Optional[str] = None) -> Optional[tuple]:
+    """Cache key for the inputs or None if they are not immutable (e.g. a branch name or an abbreviated sha)."""
+    if not all(_FULL_SHA.fullmatch(sha) for sha in shas):
+        return None
+    key = (name, CACHE_VERSION, repo, *shas)
+    if patch is not None:
+        key += (hashlib.sha256(patch.encode("utf-8", errors="surrogatepass")).hexdigest(),)
+    return key
 
-def _fetch_commit(repo: git.Repo, commit_sha: str) -> None:
-    repo.remotes.origin.fetch(commit_sha)
 
+def _repo_key(repo: git.Repo) -> str:
+    # Worktrees of the same repository share the object database, so they share the key as well
+    return os.path.abspath(repo.common_dir)
 
-def _checkout_commit(repo: git.Repo, commit_sha: str) -> None:
-    # Fetch origin
+
+def _has_commit(repo: git.Repo, commit_sha: str) -> bool:
+    """Check whether the commit is present in the local object database."""
     try:
-        repo.git.checkout(commit_sha, force=True)
+        repo.git.cat_file("-e", f"{commit_sha}^{{commit}}")
+        return True
     except GitCommandError:
-        # Try to fetch the commit
-        _fetch_commit(repo, commit_sha)
-        repo.git.checkout(commit_sha, force=True)
+        return False
+
+
+def _ensure_commit(repo: git.Repo, commit_sha: str) -> None:
+    """
+    Make sure that the commit is present in the local object database.
+
+    The network is only used when the commit is missing: all remotes are fetched at most once per process for each
+    repository, and a commit that is still missing after that is fetched by its sha (once per process).
+    """
+    if _has_commit(repo, commit_sha):
+        return
+    if os.getenv(GIT_OFFLINE_ENV):
+        raise ValueError(f"Commit {commit_sha} is missing in {repo.working_dir} and fetching is disabled")
+
+    key = _repo_key(repo)
+    with _fetch_guard:
+        fetch_lock = _fetch_locks.setdefault(key, threading.Lock())
+    with fetch_lock:
+        # Another thread could have fetched the commit while we were waiting
+        if _has_commit(repo, commit_sha):
+            return
+        if key not in _fetched_repos:
+            _fetched_repos.add(key)
+            logger.info(f"Commit {commit_sha} is missing in {repo.working_dir}. Fetching all remotes...")
+            try:
+                repo.git.fetch("--all")
+            except GitCommandError as e:
+                logger.warning(f"Failed to fetch {repo.working_dir}", exc_info=e)
+            if _has_commit(repo, commit_sha):
+                return
+        commit_key = f"{key}@{commit_sha}"
+        if commit_key not in _fetched_commits:
+            _fetched_commits.add(commit_key)
+            # The commit may be unreachable from the remote branches
+            repo.remotes.origin.fetch(commit_sha)
+    if not _has_commit(repo, commit_sha):
+        raise ValueError(f"Commit {commit_sha} could not be fetched for {repo.working_dir}")
+
+
+def _checkout_commit(repo: git.Repo, commit_sha: str) -> None:
+    _ensure_commit(repo, commit_sha)
+    repo.git.checkout(commit_sha, force=True)
 
 
 def get_parent_commit_sha(repo: str, commit_sha: str, data_dir: str) -> str:
     """Get the parent commit sha of a commit."""
     repo_path = get_repo_path(data_dir, repo)
     repo = _get_repo(repo_path)
-    _prep_repo(repo)
-    _fetch_commit(repo, commit_sha)
+    _ensure_commit(repo, commit_sha)
     parent_commit_sha = repo.commit(commit_sha).parents[0].hexsha
     return parent_commit_sha
 
 
 def get_repo_spec_content_on_commit(repo: str, base_commit_sha: str, files: List[str], data_dir: str) -> Dict[str, str]:
+    """Get contents of [files] at the commit. Reads the object database, the working tree is not touched."""
     repo_path = get_repo_path(data_dir, repo)
     repo = _get_repo(repo_path)
 
-    _prep_repo(repo)
-    _checkout_commit(repo, base_commit_sha)
-    file_contents = _read_files(repo, files)
-    repo.git.checkout("HEAD", ".")
+    _ensure_commit(repo, base_commit_sha)
+    return get_blob_reader(repo_path).read_files(base_commit_sha, files)
+
 
-    return file_contents
+def _apply_patch_on_commit(repo_path: str, base_commit_sha: str, patch: str) -> Dict[str, Optional[str]]:
+    """Apply the patch in memory to the files at the commit. Returns new contents of the changed files."""
+    repo = _get_repo(repo_path)
+    _ensure_commit(repo, base_commit_sha)
+    reader = get_blob_reader(repo_path)
+    return apply_patch(patch, lambda file: reader.read(base_commit_sha, file))
 
 
 def apply_patch_like_commit(
     repo: str, base_commit_sha: str, patch: str, files: List[str], data_dir: str
 ) -> Optional[Dict[str, str]]:
-    """Apply a patch to the parent of a git commit. Returns contents of [files] after applying the patch."""
-    repo_path = get_repo_path(data_dir, repo)
-    repo = _get_repo(repo_path)
+    """
+    Apply a patch to the parent of a git commit. Returns contents of [files] after applying the patch.
 
-    _prep_repo(repo)
-    _checkout_commit(repo, base_commit_sha)
+    The patch is applied in memory (same as `git apply --unidiff-zero --recount --ignore-whitespace`), the working
+    tree is not touched, so it is safe to call concurrently.
+    """
+    repo_path = get_repo_path(data_dir, repo)
     try:
-        apply_patch_unsafe(repo, patch)
-    except GitCommandError:
+        changed = _apply_patch_on_commit(repo_path, base_commit_sha, patch)
+    except PatchApplyError:
         # Failed to apply patch
-        repo.git.checkout("HEAD", ".")
         return None
-    file_contents = _read_files(repo, files)
-    repo.git.checkout("HEAD", ".")
-
-    return file_contents
-
-
-def clone_repo(repo: str, data_dir: str, repo_url: str = None) -> None:
-    """Clone a git repo to data_dir."""
+    unchanged = get_blob_reader(repo_path).read_files(base_commit_sha, [f for f in files if f not in changed])
+    # Removed files are read as empty, same as missing ones
+    return {file: unchanged[file] if file in unchanged else changed[file] or "" for file in files}
+
+
+def get_mirror_path(mirror_dir: str, repo: str) -> Optional[str]:
+    """Local mirror of the repository in mirror_dir (a clone or a bare repo named 'owner__name[.git]'), if any."""
+    name = repo.replace("/", "__")
+    for candidate in [name, f"{name}.git"]:
+        path = os.path.join(mirror_dir, candidate)
+        if os.path.isdir(path):
+            return os.path.abspath(path)
+    return None
+
+
+def clone_repo(
+    repo: str, data_dir: str, repo_url: str = None, blobless: bool = False, mirror_dir: Optional[str] = None
+) -> None:
+    """
+    Clone a git repo to data_dir.
+
+    @param blobless: Make a partial clone without file contents (`--filter=blob:none`), blobs are fetched on demand.
+    @param mirror_dir: Directory with local mirrors of the repositories. The objects of a mirror are borrowed
+        via `--reference`, so only the missing ones are downloaded. The mirror must not be removed afterward.
+    """
     if repo_url is None:
         repo_url = f"https://github.com/{repo}.git"
     repo_path = get_repo_path(data_dir, repo)
     if os.path.exists(repo_path):
         return
-    os.makedirs(repo_path, exist_ok=True)
-    repo = git.Repo.clone_from(repo_url, repo_path)
-    _prep_repo(repo)
+    args = []
+    if blobless:
+        args.append("--filter=blob:none")
+    mirror = get_mirror_path(mirror_dir, repo) if mirror_dir else None
+    if mirror is not None:
+        args += ["--reference", mirror]
+
+    # Clone next to the target and move it in place, so that an interrupted clone does not look like a complete one
+    os.makedirs(os.path.dirname(repo_path), exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=f"{os.path.basename(repo_path)}.", dir=os.path.dirname(repo_path))
+    try:
+        git.Repo.clone_from(repo_url, tmp_path, multi_options=args)
+        os.rename(tmp_path, repo_path)
+    except OSError:
+        if not os.path.exists(repo_path):
+            raise
+        # Cloned concurrently by another process
+        return
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    repo = _get_repo(repo_path)
+    _set_autocrlf(repo)
+    # The clone is as fresh as a fetch
+    with _fetch_guard:
+        _fetched_repos.add(_repo_key(repo))
 
 
 def get_diff(repo: str, commit_sha: str, data_dir: str, base_commit_sha: Optional[str] = None) -> str:
-    """Get the diff of a commit."""
+    """Get the diff of a commit. Results are cached in data_dir."""
     if base_commit_sha is None:
         base_commit_sha = get_parent_commit_sha(repo, commit_sha, data_dir)
+    cache = _get_cache(data_dir)
+    key = _cache_key("diff", repo, commit_sha, base_commit_sha)
+    cached = cache.get(key) if key is not None else None
+    if cached is not None:
+        return cached
+
     repo_path = get_repo_path(data_dir, repo)
-    repo = _get_repo(repo_path)
+    git_repo = _get_repo(repo_path)
 
-    _prep_repo(repo)
-    _checkout_commit(repo, commit_sha)
-    _fetch_commit(repo, base_commit_sha)
-    diff = repo.git.diff(base_commit_sha)
-    repo.git.checkout("HEAD", ".")
+    # Compare the trees directly, no need to check out the commit
+    _ensure_commit(git_repo, commit_sha)
+    _ensure_commit(git_repo, base_commit_sha)
+    diff = str(git_repo.git.diff(base_commit_sha, commit_sha))
 
-    return str(diff)
+    if key is not None:
+        cache[key] = diff
+    return diff
 
 
 def get_changed_files_patch(repo: str, patch: str, data_dir: str, base_commit_sha: str) -> List[str]:
-    """Get the changed files of a commit."""
-    repo_path = get_repo_path(data_dir, repo)
-    repo = _get_repo(repo_path)
+    """
+    Get the files of the base commit that are changed by the patch (newly created files are not included).
+    Results are cached in data_dir.
+    """
+    cache = _get_cache(data_dir)
+    key = _cache_key("changed_files", repo, base_commit_sha, patch=patch)
+    cached = cache.get(key) if key is not None else None
+    if cached is not None:
+        return list(cached)
 
-    _prep_repo(repo)
-    _checkout_commit(repo, base_commit_sha)
+    repo_path = get_repo_path(data_dir, repo)
     try:
-        apply_patch_unsafe(repo, patch)
-    except GitCommandError:
+        changed = _apply_patch_on_commit(repo_path, base_commit_sha, patch)
+    except PatchApplyError:
         # Failed to apply patch
-        repo.git.checkout("HEAD", ".")
-        return []
-    diff = repo.git.diff(base_commit_sha, name_only=True)
-    repo.git.checkout("HEAD", ".")
+        changed = {}
+    reader = get_blob_reader(repo_path)
+    res = []
+    for file, contents in sorted(changed.items()):
+        base_contents = reader.read(base_commit_sha, file)
+        if base_contents is not None and base_contents != contents:
+            res.append(file)
 
-    return diff.split("\n")
+    if key is not None:
+        cache[key] = res
+    return res
 
 
 def get_commit_name(repo: str, commit_sha: str, data_dir: str) -> str:
@@ -160,8 +318,7 @@ def get_commit_name(repo: str, commit_sha: str, data_dir: str) -> str:
     repo_path = get_repo_path(data_dir, repo)
     repo = _get_repo(repo_path)
 
-    _prep_repo(repo)
-    _fetch_commit(repo, commit_sha)
+    _ensure_commit(repo, commit_sha)
     commit_name = repo.commit(commit_sha).message
 
     return commit_name
@@ -183,12 +340,42 @@ def get_head_sha_unsafe(repo_path: str, _: str) -> str:
 def checkout_repo(repo: str, commit_sha: str, data_dir: str) -> str:
     """Checkout the repository at given commit and return full path to the directory"""
     repo_path = get_repo_path(data_dir, repo)
-    repo = _get_repo(repo_path)
+    checkout_path(repo_path, commit_sha)
+
+    return repo_path
 
-    _prep_repo(repo)
+
+def checkout_path(repo_path: str, commit_sha: str) -> None:
+    """
+    Discard local changes of the working tree at repo_path (a clone or a worktree) and checkout the commit.
+
+    Only the files recorded in the write journal are restored. The full-tree reset is used when the journal is
+    unavailable (e.g. the workspace was modified by something else).
+    """
+    repo = _get_repo(repo_path)
+    journal = WriteJournal(repo_path)
+
+    paths = journal.read()
+    # The state is unknown until the checkout is complete
+    journal.invalidate()
+    if paths is None:
+        _prep_repo(repo)
+    else:
+        _restore_journaled(repo, paths)
+        _set_autocrlf(repo)
     _checkout_commit(repo, commit_sha)
+    journal.start()
 
-    return repo_path
+
+def add_worktree(repo_path: str, worktree_path: str, commit_sha: str, data_dir: str) -> None:
+    """Create a detached worktree of the repository at given commit. The worktree shares the object store."""
+    repo = _get_repo(repo_path)
+    _ensure_commit(repo, commit_sha)
+    # Registering a worktree modifies the main repository
+    with lock_repo(repo_path, data_dir):
+        repo.git.worktree("prune")
+        repo.git.worktree("add", "--detach", "--force", worktree_path, commit_sha)
+    WriteJournal(worktree_path).start()
 
 
 def reset_to_head(repo_path: str, _: str) -> None:
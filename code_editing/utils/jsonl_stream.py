@@ -0,0 +1,76 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List
+
+logger = logging.getLogger("jsonl_stream")
+
+
+def read_jsonl_rows(path: str) -> List[Dict]:
+    """Read the rows of a JSONL file. A truncated last line (e.g. after a crash) is skipped."""
+    if not os.path.exists(path):
+        return []
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping a corrupted line #{line_no} of {path}")
+    return rows
+
+
+class JsonlStreamWriter:
+    """
+    Append-only JSONL writer. Every row is flushed as soon as it is written, and the file is synced to disk after
+    [sync_every] rows or [sync_interval] seconds, whichever comes first. The writer is thread-safe.
+    """
+
+    def __init__(self, path: str, append: bool = True, sync_every: int = 10, sync_interval: float = 30.0):
+        self.path = path
+        self.sync_every = max(1, sync_every)
+        self.sync_interval = sync_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a" if append else "w", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+        # Make sure that a row appended after a truncated line starts on a new line
+        if append and self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+
+    def write(self, row: Dict) -> None:
+        line = json.dumps(row) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            self._sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import wandb
+
+logger = logging.getLogger("metrics")
+
+_CLOSE = object()
+
+
+class MetricsAggregator:
+    """
+    Collects the run statistics off the hot path.
+
+    Workers only put events into a queue, a background thread reduces them into counters, maxima, gauges and
+    histograms and flushes them to W&B (if there is an active run) and to a JSON file every [flush_interval] seconds.
+    Metric names are dotted paths, e.g. `openai.total_cost`, and are logged as nested dicts.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = 10.0,
+        json_path: Optional[str] = None,
+        derive: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+    ):
+        """
+        @param flush_interval: Seconds between the flushes
+        @param json_path: File to write the latest metrics to
+        @param derive: Computes additional metrics from the reduced ones (by name) on flush
+        """
+        self.flush_interval = flush_interval
+        self.json_path = json_path
+        self.derive = derive
+        self._queue = queue.SimpleQueue()
+        self._counters: Dict[str, float] = {}
+        self._maxima: Dict[str, float] = {}
+        self._gauges: Dict[str, Any] = {}
+        self._histograms: Dict[str, List[float]] = {}
+        self._dirty = False
+        self._thread = threading.Thread(target=self._reduce_loop, name="metrics", daemon=True)
+        self._thread.start()
+
+    def add(self, name: str, value: float = 1) -> None:
+        self._queue.put(("add", name, value))
+
+    def max(self, name: str, value: float) -> None:
+        self._queue.put(("max", name, value))
+
+    def set(self, name: str, value: Any) -> None:
+        self._queue.put(("set", name, value))
+
+    def observe(self, name: str, value: float) -> None:
+        """Add a value to a histogram."""
+        self._queue.put(("observe", name, value))
+
+    def _reduce_loop(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                event = self._queue.get(timeout=max(0.0, next_flush - time.monotonic()))
+            except queue.Empty:
+                event = None
+            if event is _CLOSE:
+                break
+            if event is not None:
+                self._reduce(*event)
+            if time.monotonic() >= next_flush:
+                self._flush()
+                next_flush = time.monotonic() + self.flush_interval
+        # Reduce the rest of the events
+        while not self._queue.empty():
+            event = self._queue.get()
+            if event is not _CLOSE:
+                self._reduce(*event)
+        self._flush()
+
+    def _reduce(self, op: str, name: str, value: Any):
+        self._dirty = True
+        if op == "add":
+            self._counters[name] = self._counters.get(name, 0) + value
+        elif op == "max":
+            self._maxima[name] = max(self._maxima.get(name, value), value)
+        elif op == "set":
+            self._gauges[name] = value
+        elif op == "observe":
+            self._histograms.setdefault(name, []).append(value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Reduced metrics as a nested dict. Call from the reducer thread or after `close`."""
+        flat = {**self._counters, **self._maxima, **self._gauges}
+        for name, values in self._histograms.items():
+            values = sorted(values)
+            flat[name] = {
+                "count": len(values),
+                "mean": sum(values) / len(values),
+                "p50": values[len(values) // 2],
+                "p90": values[min(len(values) - 1, len(values) * 9 // 10)],
+                "max": values[-1],
+            }
+        if self.derive is not None:
+            flat.update(self.derive(flat))
+        res = {}
+        for name, value in sorted(flat.items()):
+            *path, key = name.split(".")
+            node = res
+            for part in path:
+                node = node.setdefault(part, {})
+            node[key] = value
+        return res
+
+    def _flush(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        try:
+            metrics = self.snapshot()
+            if wandb.run is not None:
+                wandb.log(metrics)
+            if self.json_path is not None:
+                tmp_path = f"{self.json_path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(metrics, f, indent=2)
+                os.replace(tmp_path, self.json_path)
+        except Exception as e:
+            logger.warning("Failed to flush the metrics", exc_info=e)
+
+    def close(self) -> None:
+        """Reduce the remaining events and flush them."""
+        if self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,270 @@
+"""
+In-memory application of unified diffs.
+
+Mirrors the behaviour of `git apply --unidiff-zero --recount --ignore-whitespace` on file contents, so that patches
+can be applied to blobs from the object database without touching the working tree. All functions are pure and
+thread-safe.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+GIT_HEADER = re.compile(r"^diff --git a/(.*) b/(.*)$")
+
+
+class PatchApplyError(ValueError):
+    """The patch is corrupt or does not apply."""
+
+    pass
+
+
+@dataclass
+class Hunk:
+    old_start: int
+    new_start: int
+    # (tag, line) pairs, tag is one of " ", "-", "+". Lines keep their newline unless they are incomplete
+    lines: List[Tuple[str, str]] = field(default_factory=list)
+
+
+@dataclass
+class FilePatch:
+    # None stands for /dev/null
+    old_path: Optional[str]
+    new_path: Optional[str]
+    hunks: List[Hunk] = field(default_factory=list)
+    is_binary: bool = False
+
+
+def _strip_path(path: str) -> Optional[str]:
+    # Timestamps of non-git diffs are separated by a tab
+    path = path.split("\t")[0].strip()
+    if len(path) > 1 and path[0] == path[-1] == '"':
+        path = path[1:-1]
+    if path == "/dev/null":
+        return None
+    # Same as -p1
+    return path.split("/", 1)[1] if "/" in path else path
+
+
+def _recount(lines: List[str], start: int) -> Optional[Tuple[int, int]]:
+    """Count hunk lines starting at [start]. Returns None if the hunk is followed by an unexpected line."""
+    old_lines, new_lines = 0, 0
+    for line in lines[start:]:
+        if line.startswith(" ") or line == "":
+            old_lines += 1
+            new_lines += 1
+        elif line.startswith("-"):
+            old_lines += 1
+        elif line.startswith("+"):
+            new_lines += 1
+        elif line.startswith("\\"):
+            continue
+        elif line.startswith("@@ ") or line.startswith("diff "):
+            break
+        else:
+            return None
+    return old_lines, new_lines
+
+
+def _parse_hunk(lines: List[str], i: int, header: re.Match) -> Tuple[Hunk, int]:
+    old_start, old_len, new_start, new_len = header.groups()
+    hunk = Hunk(int(old_start), int(new_start))
+    # Like git, fall back to the counts from the header if recounting fails
+    counts = _recount(lines, i + 1) or (int(old_len or 1), int(new_len or 1))
+    old_left, new_left = counts
+    i += 1
+    while i < len(lines) and (old_left or new_left):
+        line = lines[i]
+        if line.startswith(" ") or line == "":
+            hunk.lines.append((" ", line[1:] + "\n"))
+            old_left, new_left = old_left - 1, new_left - 1
+        elif line.startswith("-"):
+            hunk.lines.append(("-", line[1:] + "\n"))
+            old_left -= 1
+        elif line.startswith("+"):
+            hunk.lines.append(("+", line[1:] + "\n"))
+            new_left -= 1
+        elif not line.startswith("\\ "):
+            raise PatchApplyError(f"Corrupt patch at line {i + 1}")
+        if i + 1 < len(lines) and lines[i + 1].startswith("\\ ") and hunk.lines:
+            # "\ No newline at end of file"
+            tag, text = hunk.lines[-1]
+            hunk.lines[-1] = (tag, text[:-1])
+            i += 1
+        i += 1
+    if old_left or new_left:
+        raise PatchApplyError("Corrupt patch: unexpected end of hunk")
+    return hunk, i
+
+
+def parse_patch(patch: str) -> List[FilePatch]:
+    """Parse a (git) unified diff into per-file patches."""
+    if patch and not patch.endswith("\n"):
+        # git requires every patch line to be complete
+        raise PatchApplyError("Corrupt patch: no newline at the end of the patch")
+    lines = patch.split("\n")[:-1]
+
+    res: List[FilePatch] = []
+    cur: Optional[FilePatch] = None
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        git_header = GIT_HEADER.match(line)
+        if git_header:
+            cur = FilePatch(git_header.group(1), git_header.group(2))
+            res.append(cur)
+            i += 1
+            continue
+        if line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ "):
+            old_path, new_path = _strip_path(line[4:]), _strip_path(lines[i + 1][4:])
+            if cur is None or cur.hunks:
+                cur = FilePatch(old_path, new_path)
+                res.append(cur)
+            else:
+                cur.old_path, cur.new_path = old_path, new_path
+            i += 2
+            continue
+        if cur is not None:
+            header = HUNK_HEADER.match(line)
+            if header:
+                hunk, i = _parse_hunk(lines, i, header)
+                cur.hunks.append(hunk)
+                continue
+            if line.startswith("new file mode"):
+                cur.old_path = None
+            elif line.startswith("deleted file mode"):
+                cur.new_path = None
+            elif line.startswith("rename from "):
+                cur.old_path = line[len("rename from ") :]
+            elif line.startswith("rename to "):
+                cur.new_path = line[len("rename to ") :]
+            elif line.startswith("GIT binary patch") or line.startswith("Binary files "):
+                cur.is_binary = True
+        i += 1
+    return res
+
+
+def _fuzzy_line(line: str) -> str:
+    # Runs of whitespace are equal to each other, line endings are ignored
+    return re.sub(r"\s+", " ", line.rstrip("\r\n"))
+
+
+def _find_pos(
+    image: List[str], patched: List[bool], preimage: List[str], line: int, match_beginning: bool
+) -> Tuple[int, List[str]]:
+    """Find where the preimage applies, starting at [line] and moving back and forth. Returns the position and the
+    matched lines of the image (-1 if not found)."""
+    if len(preimage) > len(image):
+        return -1, []
+    if match_beginning:
+        line = 0
+    line = min(max(line, 0), len(image))
+    fuzzy_preimage = None
+
+    def matches(pos: int) -> bool:
+        nonlocal fuzzy_preimage
+        if match_beginning and pos != 0:
+            return False
+        if pos + len(preimage) > len(image):
+            return False
+        # Lines produced by the previous hunks can not be matched again
+        if any(patched[pos : pos + len(preimage)]):
+            return False
+        if image[pos : pos + len(preimage)] == preimage:
+            return True
+        # --ignore-whitespace
+        if fuzzy_preimage is None:
+            fuzzy_preimage = [_fuzzy_line(p) for p in preimage]
+        return all(_fuzzy_line(image[pos + k]) == p for k, p in enumerate(fuzzy_preimage))
+
+    backwards, forwards = line, line
+    pos = line
+    i = 0
+    while True:
+        if matches(pos):
+            return pos, image[pos : pos + len(preimage)]
+        if backwards == 0 and forwards == len(image):
+            return -1, []
+        if i % 2 == 1 and backwards > 0 or forwards == len(image):
+            backwards -= 1
+            pos = backwards
+        else:
+            forwards += 1
+            pos = forwards
+        i += 1
+
+
+def _apply_hunk(image: List[str], patched: List[bool], hunk: Hunk) -> Tuple[List[str], List[bool]]:
+    preimage = [text for tag, text in hunk.lines if tag != "+"]
+    # --unidiff-zero: only a hunk at line 0 must match at the beginning, nothing must match at the end
+    match_beginning = hunk.old_start == 0
+    start = hunk.new_start - 1 if hunk.new_start else 0
+    pos, matched = _find_pos(image, patched, preimage, start, match_beginning)
+    if pos < 0:
+        raise PatchApplyError(f"Patch does not apply at line {hunk.old_start}")
+    # Context lines keep their original whitespace
+    postimage = []
+    pre_idx = 0
+    for tag, text in hunk.lines:
+        if tag == " ":
+            postimage.append(matched[pre_idx])
+        elif tag == "+":
+            postimage.append(text)
+        if tag != "+":
+            pre_idx += 1
+    end = pos + len(preimage)
+    return image[:pos] + postimage + image[end:], patched[:pos] + [True] * len(postimage) + patched[end:]
+
+
+def apply_patch(patch: str, read_file: Callable[[str], Optional[str]]) -> Dict[str, Optional[str]]:
+    """
+    Apply the patch in memory.
+
+    @param patch: Unified diff, as accepted by `git apply --unidiff-zero --recount --ignore-whitespace`.
+    @param read_file: Returns the original contents of a file or None if there is no such file.
+    @return: New contents of the files touched by the patch (None for removed files).
+    @raise PatchApplyError: If the patch is corrupt or does not apply.
+    """
+    if patch.strip() == "":
+        return {}
+    file_patches = parse_patch(patch)
+    if not file_patches:
+        raise PatchApplyError("No valid patches in input")
+
+    res: Dict[str, Optional[str]] = {}
+
+    def current(path: str) -> Optional[str]:
+        return res[path] if path in res else read_file(path)
+
+    for file_patch in file_patches:
+        if file_patch.is_binary:
+            raise PatchApplyError(f"Binary patches are not supported ({file_patch.new_path or file_patch.old_path})")
+        if file_patch.old_path is None:
+            if file_patch.new_path is None:
+                raise PatchApplyError("Patch with no file names")
+            if current(file_patch.new_path) is not None:
+                raise PatchApplyError(f"{file_patch.new_path} already exists")
+            contents = ""
+        else:
+            contents = current(file_patch.old_path)
+            if contents is None:
+                raise PatchApplyError(f"{file_patch.old_path} does not exist")
+
+        image = contents.splitlines(keepends=True)
+        patched = [False] * len(image)
+        for hunk in file_patch.hunks:
+            image, patched = _apply_hunk(image, patched, hunk)
+        new_contents = "".join(image)
+
+        if file_patch.new_path is None:
+            if new_contents:
+                raise PatchApplyError(f"Removal patch leaves {file_patch.old_path} contents")
+            res[file_patch.old_path] = None
+            continue
+        if file_patch.old_path is not None and file_patch.old_path != file_patch.new_path:
+            # Rename
+            res[file_patch.old_path] = None
+        res[file_patch.new_path] = new_contents
+    return res
@@ -0,0 +1,98 @@
+import bisect
+from typing import List, Optional, Tuple
+
+# (is added text, text, start, end)
+_Piece = Tuple[bool, str, int, int]
+
+
+class PieceTable:
+    """
+    Text with edits, kept as a list of pieces of the original text and of the new fragments.
+
+    The edits address the original text (by the character offsets or by the lines), so the positions do not shift
+    after the previous edits, and the edited text is built in one pass at the end. The edits must not overlap.
+    """
+
+    def __init__(self, text: str):
+        self.original = text
+        self._pieces: List[_Piece] = [(False, text, 0, len(text))]
+        # Offset in the original text where every piece starts (or the offset of the replaced fragment of an added one)
+        self._keys: List[int] = [0]
+        self._line_starts: Optional[List[int]] = None
+        # Number of line breaks before every piece, rebuilt after the edits
+        self._lines_before: Optional[List[int]] = None
+
+    @property
+    def line_starts(self) -> List[int]:
+        """Offset of every line of the original text."""
+        if self._line_starts is None:
+            starts = [0]
+            pos = self.original.find("\n")
+            while pos != -1:
+                starts.append(pos + 1)
+                pos = self.original.find("\n", pos + 1)
+            self._line_starts = starts
+        return self._line_starts
+
+    def line_span(self, start_line: int, end_line: int) -> Tuple[int, int]:
+        """Offsets of the original lines [start_line, end_line) (0-based) without the last line break."""
+        starts = self.line_starts
+        start_line = max(0, min(start_line, len(starts)))
+        end_line = max(start_line, min(end_line, len(starts)))
+        start = starts[start_line] if start_line < len(starts) else len(self.original)
+        if end_line == start_line:
+            return start, start
+        end = starts[end_line] - 1 if end_line < len(starts) else len(self.original)
+        return start, end
+
+    def original_lines(self, start_line: int, end_line: int) -> str:
+        """The original lines [start_line, end_line) (0-based)."""
+        start, end = self.line_span(start_line, end_line)
+        return self.original[start:end]
+
+    def replace(self, start: int, end: int, text: str) -> None:
+        """Replace the fragment [start, end) of the original text. Raises ValueError if it overlaps a previous edit."""
+        if not 0 <= start <= end <= len(self.original):
+            raise ValueError(f"Fragment [{start}, {end}) is out of the text")
+        i = bisect.bisect_right(self._keys, start) - 1
+        added, _, piece_start, piece_end = self._pieces[i]
+        if added or not (piece_start <= start and end <= piece_end):
+            raise ValueError(f"Fragment [{start}, {end}) overlaps a previous edit")
+        pieces = [
+            (False, self.original, piece_start, start),
+            (True, text, 0, len(text)),
+            (False, self.original, end, piece_end),
+        ]
+        keys = [piece_start, start, end]
+        # Empty pieces of the original text are dropped, the added one keeps the position of the edit
+        keep = [n for n, (added, _, s, e) in enumerate(pieces) if added or s < e]
+        self._pieces[i : i + 1] = [pieces[n] for n in keep]
+        self._keys[i : i + 1] = [keys[n] for n in keep]
+        self._lines_before = None
+
+    def replace_lines(self, start_line: int, end_line: int, text: str) -> None:
+        """Replace the original lines [start_line, end_line) (0-based, text without the last line break)."""
+        self.replace(*self.line_span(start_line, end_line), text)
+
+    def new_line(self, offset: int) -> int:
+        """
+        0-based line of the edited text where the character at the offset of the original text is now. The start of an
+        edited fragment maps to the start of its new text.
+        """
+        if self._lines_before is None:
+            lines_before, count = [], 0
+            for _, text, start, end in self._pieces:
+                lines_before.append(count)
+                count += text.count("\n", start, end)
+            self._lines_before = lines_before
+        i = bisect.bisect_left(self._keys, offset)
+        if i == len(self._keys) or self._keys[i] != offset:
+            i -= 1
+        added, text, start, end = self._pieces[i]
+        if added:
+            return self._lines_before[i]
+        return self._lines_before[i] + text.count("\n", start, min(max(offset, start), end))
+
+    def text(self) -> str:
+        """The edited text."""
+        return "".join(text[start:end] for _, text, start, end in self._pieces)
@@ -0,0 +1,131 @@
+import contextvars
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger("pipeline")
+
+_CLOSE = object()
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: Callable[[Hashable, Any], Any]  # (key, output of the previous stage) -> input of the next stage
+    workers: int = 1
+    cleanup: bool = False  # Runs for the failed items too (e.g. to release their resources), its output is ignored
+
+
+class _Item:
+    def __init__(self, key: Hashable, value: Any):
+        self.key = key
+        self.value = value
+        self.error: Optional[BaseException] = None
+        # The context managers entered by a stage (e.g. spans) stay active in the next ones
+        self.context = contextvars.copy_context()
+
+
+class StagedPipeline:
+    """
+    Runs the items through a sequence of stages, each with its own worker threads, so that the stages of different
+    items overlap (e.g. a data point is prepared while the agent works on the previous one).
+
+    The stages are connected with queues of at most [queue_size] items, so a slow stage holds back the ones before it
+    instead of piling up prepared items. An item that fails in a stage skips the rest of the stages except the cleanup
+    ones. Finished items are collected with `get`.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 1):
+        """
+        @param stages: Stages in the order of processing
+        @param queue_size: Max number of items waiting for every stage but the first one
+        """
+        self.stages = stages
+        # The input of the first stage is bounded by the caller (e.g. by the number of data points in flight)
+        self._queues = [queue.Queue()] + [queue.Queue(maxsize=max(1, queue_size)) for _ in stages[1:]]
+        self._output = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        # Stage name -> busy time, time blocked by the next stage, number of processed and failed items
+        self._stats: Dict[str, Dict[str, float]] = {
+            stage.name: {"busy_sec": 0.0, "blocked_sec": 0.0, "items": 0, "errors": 0} for stage in stages
+        }
+        self._threads: List[List[threading.Thread]] = []
+        for n, stage in enumerate(stages):
+            threads = [
+                threading.Thread(target=self._work, args=(n,), name=f"{stage.name}-{w}", daemon=True)
+                for w in range(stage.workers)
+            ]
+            for thread in threads:
+                thread.start()
+            self._threads.append(threads)
+
+    def put(self, key: Hashable, value: Any = None) -> None:
+        """Add an item to the first stage."""
+        self._queues[0].put(_Item(key, value))
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Tuple[Hashable, Any, Optional[BaseException]]]:
+        """(key, output of the last stage, error) of the next finished item or None on timeout."""
+        try:
+            item = self._output.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        return item.key, item.value, item.error
+
+    def _work(self, n: int):
+        stage = self.stages[n]
+        in_queue = self._queues[n]
+        out_queue = self._queues[n + 1] if n + 1 < len(self.stages) else self._output
+        stats = self._stats[stage.name]
+        while True:
+            item = in_queue.get()
+            if item is _CLOSE:
+                break
+            if item.error is None or stage.cleanup:
+                start = time.monotonic()
+                try:
+                    value = item.context.run(stage.fn, item.key, item.value)
+                    if not stage.cleanup:
+                        item.value = value
+                except Exception as e:
+                    if item.error is None:
+                        item.error = e
+                    else:
+                        logger.warning(f"Failed to clean up {item.key} in {stage.name}", exc_info=e)
+                    with self._lock:
+                        stats["errors"] += 1
+                with self._lock:
+                    stats["busy_sec"] += time.monotonic() - start
+                    stats["items"] += 1
+            start = time.monotonic()
+            out_queue.put(item)
+            with self._lock:
+                stats["blocked_sec"] += time.monotonic() - start
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per stage statistics, the utilisation is the busy share of the stage's worker time since the start."""
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        with self._lock:
+            res = {name: dict(stats) for name, stats in self._stats.items()}
+        for n, stage in enumerate(self.stages):
+            res[stage.name]["utilisation"] = res[stage.name]["busy_sec"] / (stage.workers * elapsed)
+            res[stage.name]["queue_depth"] = self._queues[n].qsize()
+        return res
+
+    def close(self) -> None:
+        """Stop the workers after the queued items are processed."""
+        for n, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                self._queues[n].put(_CLOSE)
+            # The next stage is closed after all the items of this one are passed to it
+            for thread in self._threads[n]:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,75 @@
+import collections
+import threading
+from typing import Deque, Dict, List, Optional, Tuple
+
+
+class AffinityScheduler:
+    """
+    Orders data points by repository and base commit affinity.
+
+    Data points of the same (repo, base commit) run back to back, so that the warm per-commit state (checkout, indices)
+    is reused, and the free workers are spread over different repositories, largest first. With exclusive repositories
+    (a shared checkout per repository), at most one data point of a repository is in flight, so workers never wait for
+    each other's repository locks. The scheduler is thread-safe.
+    """
+
+    def __init__(self, keys: Dict[int, Tuple[str, str]], exclusive_repos: bool = True):
+        """
+        @param keys: Data point index -> (repo, base commit). The base commit can be empty if it is not known yet.
+        @param exclusive_repos: Whether the data points of the same repository can not run concurrently
+        """
+        self.exclusive_repos = exclusive_repos
+        self._keys = dict(keys)
+        self._lock = threading.Lock()
+        # Repo -> pending data points, grouped by base commit (in the order of their first appearance)
+        self._queues: Dict[str, Deque[int]] = {}
+        self._in_flight: Dict[str, int] = collections.Counter()
+
+        by_commit: Dict[Tuple[str, str], list] = {}
+        for i, key in self._keys.items():
+            by_commit.setdefault(key, []).append(i)
+        for (repo, _), group in by_commit.items():
+            self._queues.setdefault(repo, collections.deque()).extend(group)
+
+    def push(self, i: int) -> None:
+        """Reschedule a data point (e.g. a retry). It goes first within its repository to reuse the warm state."""
+        with self._lock:
+            repo = self._keys[i][0]
+            self._queues.setdefault(repo, collections.deque()).appendleft(i)
+
+    def pop(self) -> Optional[int]:
+        """Next data point to run or None if there are none that can run now."""
+        with self._lock:
+            candidates = [repo for repo, queue in self._queues.items() if queue]
+            if self.exclusive_repos:
+                candidates = [repo for repo in candidates if not self._in_flight[repo]]
+            if not candidates:
+                return None
+            # Idle repositories first, then the ones with most pending data points
+            repo = min(candidates, key=lambda r: (self._in_flight[r], -len(self._queues[r])))
+            self._in_flight[repo] += 1
+            return self._queues[repo].popleft()
+
+    def done(self, i: int) -> None:
+        """Mark a popped data point as finished."""
+        with self._lock:
+            self._in_flight[self._keys[i][0]] -= 1
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+
+def shard_items(repos: Dict[int, str], num_shards: int, shard_index: int) -> List[int]:
+    """
+    Data points of a shard. The data points are ordered by repository and split into contiguous shards of (almost)
+    equal sizes, so most repositories are processed by a single shard. Deterministic for the same inputs.
+
+    @param repos: Data point index -> repository
+    """
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"Shard index {shard_index} is out of range for {num_shards} shards")
+    items = sorted(repos, key=lambda i: (repos[i], i))
+    start = len(items) * shard_index // num_shards
+    end = len(items) * (shard_index + 1) // num_shards
+    return sorted(items[start:end])
@@ -0,0 +1,173 @@
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+
+class Tracer:
+    """Collects the finished spans as Chrome trace events, see https://ui.perfetto.dev or chrome://tracing."""
+
+    def __init__(self):
+        self._events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._origin = time.perf_counter()
+
+    def add_span(self, span: "Span") -> None:
+        event = {
+            "name": span.name,
+            "cat": span.cat,
+            "ph": "X",
+            "ts": round((span.start - self._origin) * 1e6),
+            "dur": round((span.end - span.start) * 1e6),
+            "pid": self._pid,
+            "tid": span.root.lane,
+            "args": span.args,
+        }
+        with self._lock:
+            self._events.append(event)
+            if span.root is span:
+                # Every root span (e.g. a data point) gets its own track
+                label = " ".join([span.name, *(str(v) for v in span.args.values())])
+                self._events.append(
+                    {"name": "thread_name", "ph": "M", "pid": self._pid, "tid": span.lane, "args": {"name": label}}
+                )
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            events = list(self._events)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+_tracer: Optional[Tracer] = None
+_lanes = itertools.count()
+
+
+def set_tracer(tracer: Optional[Tracer]) -> None:
+    """Set the tracer that receives the spans of all threads (None to stop tracing)."""
+    global _tracer
+    _tracer = tracer
+
+
+class Span:
+    def __init__(self, name: str, cat: str, parent: Optional["Span"], args: Dict[str, Any]):
+        self.name = name
+        self.cat = cat
+        self.parent = parent
+        self.root = parent.root if parent is not None else self
+        self.args = args
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self._children_sec = 0.0
+        if self.root is self:
+            self.lane = next(_lanes)
+            self._lock = threading.Lock()
+            # Stage name -> total time, time without the nested stages and number of spans
+            self.stages: Dict[str, Dict[str, float]] = {}
+
+    def set(self, **args) -> None:
+        """Add arguments (e.g. sizes) to the span."""
+        self.args.update(args)
+
+    def finish(self) -> None:
+        self.end = time.perf_counter()
+        duration = self.end - self.start
+        root = self.root
+        with root._lock:
+            if self.parent is not None:
+                self.parent._children_sec += duration
+            stage = root.stages.setdefault(self.name, {"sec": 0.0, "self_sec": 0.0, "count": 0})
+            stage["sec"] += duration
+            # Children can run concurrently, so they can take longer than the parent
+            stage["self_sec"] += max(0.0, duration - self._children_sec)
+            stage["count"] += 1
+        if _tracer is not None:
+            _tracer.add_span(self)
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def start_span(name: str, cat: str = "stage", **args) -> Optional[Span]:
+    """Start a span under the current one without making it current. None if tracing is disabled."""
+    parent = _current_span.get()
+    if parent is None and _tracer is None:
+        return None
+    return Span(name, cat, parent, args)
+
+
+@contextmanager
+def span(name: str, cat: str = "stage", **args):
+    """Trace the block as a span nested in the current one. Yields the span or None if tracing is disabled."""
+    current = start_span(name, cat, **args)
+    if current is None:
+        yield None
+        return
+    token = _current_span.set(current)
+    callback_token = None
+    if current.root is current:
+        # LLM calls made in the block are traced too
+        callback_token = tracing_callback_var.set(TracingCallbackHandler())
+    try:
+        yield current
+    finally:
+        if callback_token is not None:
+            tracing_callback_var.reset(callback_token)
+        _current_span.reset(token)
+        current.finish()
+
+
+def get_stage_summary() -> Dict[str, Dict[str, float]]:
+    """Latency breakdown by stage of the current root span (finished spans only)."""
+    current = _current_span.get()
+    if current is None:
+        return {}
+    root = current.root
+    with root._lock:
+        return {name: dict(stage) for name, stage in root.stages.items()}
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Traces the LLM calls as spans."""
+
+    def __init__(self):
+        self._spans: Dict[UUID, Span] = {}
+
+    def _start(self, run_id: UUID, serialized: Optional[Dict[str, Any]], **args):
+        model = ((serialized or {}).get("kwargs") or {}).get("model_name") or (serialized or {}).get("name")
+        llm_span = start_span("llm", cat="llm", model=model, **args)
+        if llm_span is not None:
+            self._spans[run_id] = llm_span
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, serialized, prompt_chars=sum(len(prompt) for prompt in prompts))
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, serialized, messages=sum(len(batch) for batch in messages))
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        llm_span = self._spans.pop(run_id, None)
+        if llm_span is None:
+            return
+        token_usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+        llm_span.set(**{k: v for k, v in token_usage.items() if isinstance(v, int)})
+        llm_span.finish()
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        llm_span = self._spans.pop(run_id, None)
+        if llm_span is not None:
+            llm_span.set(error=type(error).__name__)
+            llm_span.finish()
+
+
+tracing_callback_var: ContextVar[Optional[TracingCallbackHandler]] = ContextVar("tracing_callback", default=None)
+register_configure_hook(tracing_callback_var, True)
@@ -0,0 +1,138 @@
+import bisect
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+
+class _CachedFile:
+    def __init__(self, content: str):
+        self.content = content
+        self._lines: Optional[List[str]] = None
+        self._raw_lines: Optional[List[str]] = None
+        self._offsets: Optional[List[int]] = None
+
+    @property
+    def lines(self) -> List[str]:
+        if self._lines is None:
+            self._lines = self.content.split("\n")
+        return self._lines
+
+    @property
+    def raw_lines(self) -> List[str]:
+        """Lines with the line breaks, as readlines returns them."""
+        if self._raw_lines is None:
+            self._raw_lines = [line + "\n" for line in self.lines[:-1]]
+            if self.lines[-1]:
+                self._raw_lines.append(self.lines[-1])
+        return self._raw_lines
+
+    @property
+    def offsets(self) -> List[int]:
+        """Offset of the first character of every line."""
+        if self._offsets is None:
+            offsets = [0]
+            for line in self.lines[:-1]:
+                offsets.append(offsets[-1] + len(line) + 1)
+            self._offsets = offsets
+        return self._offsets
+
+
+class Workspace:
+    """
+    Files of the repository of a run, kept in memory.
+
+    The contents and the line offsets of a file are read once, writes go to the disk and to the memory (write-through),
+    and the paths are validated once. The run owns its repository, so the files do not change behind its back.
+    Thread-safe.
+    """
+
+    def __init__(self, repo_path: str):
+        self.repo_path = repo_path
+        self._root = os.path.join(os.path.normpath(repo_path), "")
+        self._real_root = os.path.realpath(repo_path)
+        self._files: Dict[str, _CachedFile] = {}
+        # Relative path -> full path of the valid files
+        self._paths: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.stats = {"reads": 0, "hits": 0, "writes": 0}
+
+    def owns(self, file: str) -> bool:
+        return os.path.normpath(file).startswith(self._root)
+
+    def resolve(self, file_name: str) -> str:
+        """Full path of a file of the repository. Raises ValueError with the reason if the file is not valid."""
+        file = self._paths.get(file_name, None)
+        if file is not None:
+            return file
+        file = os.path.join(self.repo_path, file_name)
+        if not os.path.exists(file):
+            raise ValueError(f"File {file_name} does not exist")
+        if not os.path.isfile(file):
+            raise ValueError(f"{file_name} is not a file")
+        # In case .. or / is used to escape the repo
+        if not os.path.realpath(file).startswith(self._real_root):
+            raise ValueError(f"File {file_name} is not inside the repo")
+        # Only the valid paths are cached, a missing file can be created later
+        self._paths[file_name] = file
+        return file
+
+    def _get(self, file: str) -> _CachedFile:
+        key = os.path.normpath(file)
+        cached = self._files.get(key, None)
+        if cached is not None:
+            with self._lock:
+                self.stats["hits"] += 1
+            return cached
+        with open(file, "r", encoding="utf8", errors="ignore") as f:
+            cached = _CachedFile(f.read())
+        with self._lock:
+            self.stats["reads"] += 1
+            return self._files.setdefault(key, cached)
+
+    def read(self, file: str) -> str:
+        return self._get(file).content
+
+    def lines(self, file: str) -> List[str]:
+        """Lines of the file without the line breaks. Do not modify the list."""
+        return self._get(file).lines
+
+    def raw_lines(self, file: str) -> List[str]:
+        """Lines of the file with the line breaks. Do not modify the list."""
+        return self._get(file).raw_lines
+
+    def line_at(self, file: str, index: int) -> int:
+        """0-based line of the character at the index (0 if the index is out of the file)."""
+        cached = self._get(file)
+        if not 0 <= index < len(cached.content):
+            return 0
+        return bisect.bisect_right(cached.offsets, index) - 1
+
+    def write(self, file: str, content: str) -> None:
+        with open(file, "w", encoding="utf8", errors="ignore") as f:
+            f.write(content)
+        with self._lock:
+            self._files[os.path.normpath(file)] = _CachedFile(content)
+            self.stats["writes"] += 1
+
+
+_current_workspace: ContextVar[Optional[Workspace]] = ContextVar("current_workspace", default=None)
+
+
+@contextmanager
+def use_workspace(workspace: Optional[Workspace]):
+    """Serve the file access of the tools and the context providers in this context from the workspace."""
+    token = _current_workspace.set(workspace)
+    try:
+        yield workspace
+    finally:
+        _current_workspace.reset(token)
+
+
+def get_workspace(file: Optional[str] = None) -> Optional[Workspace]:
+    """The current workspace (if it owns the file) or None."""
+    workspace = _current_workspace.get()
+    if workspace is not None and file is not None and not workspace.owns(file):
+        return None
+    return workspace
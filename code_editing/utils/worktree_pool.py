@@ -0,0 +1,107 @@
+import logging
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from filelock import FileLock, Timeout
+
+from code_editing.utils.git_utils import add_worktree, checkout_path, get_repo_path
+
+logger = logging.getLogger("worktree_pool")
+
+
+class WorktreePool:
+    """
+    Pool of git worktrees of a single repository.
+
+    All the worktrees share the object store of the main clone. Each worktree is exclusively owned by one run at a time
+    (also across processes, thanks to a file lock per worktree). Released worktrees are recycled on demand, preferring
+    the ones that are already checked out at the requested commit.
+    """
+
+    def __init__(self, repo_path: str, data_dir: str):
+        self.repo_path = repo_path
+        self.data_dir = data_dir
+        self.repo_name = os.path.basename(os.path.normpath(repo_path))
+        self.root = os.path.join(data_dir, "worktrees", self.repo_name)
+
+        self._lock = threading.Lock()
+        # Worktree path -> commit it was checked out at by this process
+        self._heads: Dict[str, str] = {}
+        # Worktree path -> lock held while the worktree is in use
+        self._owned: Dict[str, FileLock] = {}
+
+    def _worktree_path(self, slot: int) -> str:
+        # The worktree directory is named after the repository, so that the repo name can be derived from the path
+        return os.path.join(self.root, str(slot), self.repo_name)
+
+    def _existing_slots(self) -> List[int]:
+        return sorted(int(name) for name in os.listdir(self.root) if name.isdigit())
+
+    def _try_lock(self, slot: int) -> Optional[FileLock]:
+        # Not thread-local: the worktree may be released by another thread (as in the async inference)
+        lock = FileLock(os.path.join(self.root, f"{slot}.lock"), thread_local=False)
+        try:
+            lock.acquire(blocking=False)
+        except Timeout:
+            return None
+        return lock
+
+    def _lock_slot(self, commit_sha: str) -> Tuple[int, FileLock]:
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            slots = self._existing_slots()
+            # Worktrees that are already at the requested commit go first
+            slots.sort(key=lambda s: self._heads.get(self._worktree_path(s)) != commit_sha)
+            for slot in slots:
+                lock = self._try_lock(slot)
+                if lock is not None:
+                    return slot, lock
+            # All the worktrees are busy, create a new one
+            slot = slots[-1] + 1 if slots else 0
+            while True:
+                lock = self._try_lock(slot)
+                if lock is not None:
+                    return slot, lock
+                slot += 1
+
+    def acquire(self, commit_sha: str) -> str:
+        """Get an exclusive worktree checked out at given commit. Returns full path to the worktree."""
+        slot, lock = self._lock_slot(commit_sha)
+        path = self._worktree_path(slot)
+        try:
+            if os.path.exists(os.path.join(path, ".git")):
+                checkout_path(path, commit_sha)
+            else:
+                # Leftovers of a broken worktree
+                shutil.rmtree(path, ignore_errors=True)
+                logger.info(f"Creating worktree #{slot} for {self.repo_name}")
+                add_worktree(self.repo_path, path, commit_sha, self.data_dir)
+        except Exception:
+            lock.release()
+            raise
+        with self._lock:
+            self._heads[path] = commit_sha
+            self._owned[path] = lock
+        return path
+
+    def release(self, path: str) -> None:
+        """Return the worktree to the pool."""
+        with self._lock:
+            lock = self._owned.pop(path)
+        lock.release()
+
+
+_pools: Dict[str, WorktreePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_worktree_pool(repo: str, data_dir: str) -> WorktreePool:
+    """Get the process-wide worktree pool for the repository (e.g. 'owner/name')."""
+    repo_path = get_repo_path(data_dir, repo)
+    key = os.path.abspath(repo_path)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = WorktreePool(repo_path, data_dir)
+        return _pools[key]
@@ -0,0 +1,58 @@
+import os
+import threading
+from typing import List, Optional
+
+
+def get_git_dir(repo_path: str) -> str:
+    """Git directory of a clone or a worktree (where `.git` is a file pointing to it)."""
+    dot_git = os.path.join(repo_path, ".git")
+    if os.path.isfile(dot_git):
+        with open(dot_git, "r") as f:
+            git_dir = f.read().strip().removeprefix("gitdir:").strip()
+        return os.path.normpath(os.path.join(repo_path, git_dir))
+    return dot_git
+
+
+class WriteJournal:
+    """
+    Journal of the files written by the tools in a workspace, kept in its git directory.
+
+    The journal exists only while the workspace is known to be at a clean checkout plus the journaled writes, so the next
+    checkout has to restore only these paths. A missing journal means that the state is unknown.
+    """
+
+    FILE_NAME = "ce-write-journal"
+
+    def __init__(self, repo_path: str):
+        self.repo_path = repo_path
+        self.path = os.path.join(get_git_dir(repo_path), self.FILE_NAME)
+        self._lock = threading.Lock()
+
+    def record(self, file: str) -> None:
+        """Record a write to the file (full path or relative to the workspace)."""
+        rel_path = os.path.relpath(os.path.join(self.repo_path, file), self.repo_path)
+        with self._lock:
+            # Writes to a workspace in an unknown state do not make it known
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, "a", encoding="utf8") as f:
+                f.write(rel_path + "\n")
+
+    def read(self) -> Optional[List[str]]:
+        """Paths written since the last checkout or None if the journal is unavailable."""
+        try:
+            with open(self.path, "r", encoding="utf8") as f:
+                return sorted(set(line for line in f.read().split("\n") if line))
+        except OSError:
+            return None
+
+    def invalidate(self) -> None:
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def start(self) -> None:
+        """Start an empty journal for a clean checkout."""
+        with self._lock:
+            with open(self.path, "w", encoding="utf8"):
+                pass
@@ -1,7 +1,14 @@
 import os.path
 from pathlib import Path
 
+from omegaconf import OmegaConf
+
 from code_editing.agents.context_providers.acr_search import SearchManager
+from code_editing.agents.context_providers.context_provider import ContextProvider
+from code_editing.agents.context_providers.lazy import LazyContextProvider
+from code_editing.agents.context_providers.pool import ContextProviderPool
+from code_editing.utils.concurrency import map_concurrently
+from tests.test_git_utils import commit_file, make_origin, run_git
 
 
 def test_show_definition():
@@ -29,3 +36,85 @@ def test_show_definition():
     # Local function
     res, _, ok = search_manager.show_definition("hello", 13, "b.py")
     assert ok and "13 def hello():" in res
+
+
+def test_capture_viewed_lines():
+    test_dir = os.path.join(Path(__file__).parents[0], "assets/acr_show_definition")
+    search_manager = SearchManager(test_dir)
+
+    def search(query):
+        with search_manager.capture_viewed_lines() as viewed:
+            (
+                search_manager.search_method_in_class(*query)
+                if isinstance(query, tuple)
+                else search_manager.search_class(query)
+            )
+        return [(os.path.basename(file), start, end) for file, start, end in viewed]
+
+    # Every concurrent search captures only its own lines
+    res = map_concurrently(search, [("foo", "A"), "A", ("bar", "A")] * 4, max_workers=4)
+    assert res[:3] == [[("a.py", 18, 19)], [("a.py", 13, 25)], [("a.py", 21, 22)]] and res[3:] == res[:3] * 3
+    assert search_manager.viewed_lines == []
+
+
+def test_context_provider_pool(tmp_path):
+    repo = make_origin(tmp_path)
+    first = commit_file(repo, "a.py", "def foo():\n    pass\n", "first")
+    commit_file(repo, "a.py", "def bar():\n    pass\n", "second")
+    cfg = OmegaConf.create({"_target_": "code_editing.agents.context_providers.acr_search.SearchManager"})
+    pool = ContextProviderPool(max_size=1)
+
+    # Warm providers are reused at the same commit, with a clean per-run state
+    provider, warm = pool.acquire(cfg, repo, str(tmp_path))
+    assert not warm and "bar" in provider.function_index
+    provider.viewed_lines.append(("a.py", 1, 2))
+    pool.release(provider)
+    same, warm = pool.acquire(cfg, repo, str(tmp_path))
+    assert warm and same is provider and same.viewed_lines == []
+    pool.release(same)
+
+    # Other commits get their own providers, the least recently used one is evicted
+    run_git(repo, "checkout", "-q", first)
+    other, warm = pool.acquire(cfg, repo, str(tmp_path))
+    assert not warm and "foo" in other.function_index
+    pool.release(other)
+    assert pool.stats["evicted"] == 1
+
+    # Dirty providers are discarded
+    other, warm = pool.acquire(cfg, repo, str(tmp_path))
+    assert warm
+    other.is_dirty = lambda: True
+    pool.release(other)
+    assert pool.acquire(cfg, repo, str(tmp_path))[1] is False
+    assert pool.stats == {"hits": 2, "misses": 3, "discarded": 1, "evicted": 1}
+
+
+def test_lazy_context_provider(tmp_path):
+    repo = make_origin(tmp_path)
+    commit_file(repo, "a.py", "def foo():\n    pass\n", "first")
+    built, written = [], []
+
+    def build():
+        built.append(True)
+        return SearchManager(repo_path=repo, data_path=str(tmp_path))
+
+    lazy = LazyContextProvider("search_manager", SearchManager, build, is_workspace_clean=lambda: not written)
+    assert not lazy.is_built and lazy.unwrap() is None
+    assert issubclass(lazy.provider_cls, ContextProvider)
+
+    # Built on the first access, and only once
+    assert "foo" in lazy.function_index
+    lazy.viewed_lines.append(("a.py", 1, 2))
+    assert len(built) == 1 and lazy.unwrap().viewed_lines == [("a.py", 1, 2)]
+    assert not lazy.built_on_dirty_workspace
+
+    # The calls of the deferred methods are replayed after the build, on the workspace with the writes
+    SearchManager.deferred_methods = ("reset",)
+    try:
+        lazy = LazyContextProvider("search_manager", SearchManager, build, is_workspace_clean=lambda: not written)
+        assert lazy.reset() is None and not lazy.is_built
+        written.append("a.py")
+        lazy.get().viewed_lines.append(("a.py", 1, 2))
+        assert len(built) == 2 and lazy.built_on_dirty_workspace
+    finally:
+        SearchManager.deferred_methods = ()
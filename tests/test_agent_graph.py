@@ -0,0 +1,72 @@
+import functools
+import itertools
+from operator import itemgetter
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from omegaconf import OmegaConf
+
+from code_editing.agents import run
+from code_editing.agents.agent_codeeditor import AgentCodeEditor
+from code_editing.agents.agent_graph import AgentGraph
+from code_editing.agents.utils.checkout_extractor import CheckoutExtractor
+from code_editing.agents.utils.tool_factory import ToolFactory
+from code_editing.configs.agents.tools_config import ViewFileToolConfig
+from tests.test_git_utils import commit_file, make_origin
+
+
+class ToolCallingFakeModel(GenericFakeChatModel):
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+class ReactGraph(AgentGraph):
+    name = "react"
+    reusable = True
+    compiled = 0
+
+    @property
+    def _runnable(self):
+        type(self).compiled += 1
+        return itemgetter("instruction") | self.react_agent()
+
+
+class StatefulReactGraph(ReactGraph):
+    reusable = False
+    compiled = 0
+
+
+def make_editor(tmp_path, graph_cls, llm) -> AgentCodeEditor:
+    tool_factory = ToolFactory({"view_file": OmegaConf.structured(ViewFileToolConfig)})
+    return AgentCodeEditor(
+        agent_graph_partial=functools.partial(graph_cls, llm=llm),
+        tool_factory=tool_factory,
+        data_path=str(tmp_path),
+        runnable_config={"run_name": "test"},
+        reuse_graph=True,
+    )
+
+
+def test_graph_reuse(tmp_path, monkeypatch):
+    monkeypatch.setattr(run.AgentRunManager, "get_log_path", lambda self: str(tmp_path / f"{self.instance_id}.log"))
+    repo = make_origin(tmp_path)
+    commit_file(repo, "a.py", "a = 1\n", "first")
+    view = {"name": "view-fragment", "args": {"file_name": "a.py", "line_start_number": 1, "line_end_number": 1}}
+    llm = ToolCallingFakeModel(
+        messages=itertools.cycle([AIMessage("", tool_calls=[{**view, "id": "call"}]), AIMessage("done")])
+    )
+
+    # The graph is compiled once, the tools of every run are called through the templates
+    editor = make_editor(tmp_path, ReactGraph, llm)
+    for n in range(3):
+        res = editor.generate_diff({"instruction": "view", "code_base": {CheckoutExtractor.REPO_KEY: repo}})
+        assert res["run"]["tools"] == {"view-fragment": {"calls": 1, "success": 1}}
+        assert "a = 1" in res["raw"]["messages"][2].content
+    assert ReactGraph.compiled == 1
+
+    # Graphs with per-run state are built for every run
+    editor = make_editor(tmp_path, StatefulReactGraph, llm)
+    for n in range(2):
+        res = editor.generate_diff({"instruction": "view", "code_base": {CheckoutExtractor.REPO_KEY: repo}})
+        assert res["run"]["tools"] == {"view-fragment": {"calls": 1, "success": 1}}
+    assert StatefulReactGraph.compiled == 2 and not editor.reuse_graph
@@ -0,0 +1,104 @@
+import os
+from typing import Dict
+
+import datasets
+import pandas as pd
+
+from code_editing.data_sources import FullFileExtractor, SWEBenchDataSource, hf_source
+from code_editing.data_sources.git_data import SimpleGitCEData
+from code_editing.data_sources.hf_source import HuggingFaceSimpleGitCEDataSource
+from code_editing.utils.git_utils import get_diff, get_repo_path
+from tests.test_git_utils import commit_file, make_origin
+
+
+class LocalDataSource(HuggingFaceSimpleGitCEDataSource):
+    def row_to_data(self, row: Dict) -> SimpleGitCEData:
+        self.computed += 1
+        return SimpleGitCEData(
+            message=row["message"],
+            repo=row["repo"],
+            diff_true=get_diff(row["repo"], row["hash"], self.data_path) + "\n",
+            base_hash=row["base_hash"],
+        )
+
+    def _row_to_repo(self, row: Dict) -> str:
+        return row["repo"]
+
+
+def make_data_source(tmp_path, monkeypatch, rows) -> LocalDataSource:
+    monkeypatch.setattr(hf_source, "load_dataset", lambda *args, **kwargs: datasets.Dataset.from_list(rows))
+    monkeypatch.setattr(LocalDataSource, "computed", 0, raising=False)
+    return LocalDataSource(
+        hub_name="local/dataset",
+        base_data_path=str(tmp_path / "data"),
+        extractor=FullFileExtractor(),
+    )
+
+
+def test_materialized_rows(tmp_path, monkeypatch):
+    origin = make_origin(tmp_path)
+    first = commit_file(origin, "a.py", "a = 1\n", "first")
+    second = commit_file(origin, "a.py", "a = 2\n", "second")
+    rows = [{"message": "second", "repo": "origin", "hash": second, "base_hash": first}]
+
+    data_source = make_data_source(tmp_path, monkeypatch, rows)
+    data_source._clone_manager.url_template = f"file://{tmp_path}/{{repo}}"
+    data_source.prepare_repositories()
+    data_source.materialize()
+    assert data_source.computed == 1
+
+    data = data_source[0]
+    assert data.changed_files == ["a.py"]
+    assert data.base_hash == first and "+a = 2" in data.diff_true
+    assert data_source.data_to_input(data)["code_base"] == {"a.py": "a = 1\n"}
+
+    # The cache is reused by the next runs
+    data_source = make_data_source(tmp_path, monkeypatch, rows)
+    data_source.materialize()
+    assert data_source[0] == data
+    assert data_source.computed == 0
+
+    # A changed dataset is materialized again
+    rows[0]["message"] = "updated"
+    data_source = make_data_source(tmp_path, monkeypatch, rows)
+    data_source.materialize()
+    assert data_source[0].message == "updated"
+    assert data_source.computed == 1
+
+
+def test_lazy_clone(tmp_path, monkeypatch):
+    rows = []
+    for repo in ["first", "second"]:
+        origin = make_origin(tmp_path / repo)
+        commit = commit_file(origin, "a.py", "a = 1\n", "first")
+        rows.append({"message": repo, "repo": repo, "hash": commit, "base_hash": commit})
+
+    # Nothing is cloned until the data points to run are known
+    data_source = make_data_source(tmp_path, monkeypatch, rows)
+    data_source._clone_manager.url_template = f"file://{tmp_path}/{{repo}}/origin"
+    assert not os.path.exists(get_repo_path(data_source.data_path, "first"))
+    data_source.prepare_repositories(items=[1])
+    assert not os.path.exists(get_repo_path(data_source.data_path, "first"))
+    assert os.path.exists(get_repo_path(data_source.data_path, "second"))
+
+
+def test_swebench_instance_ids(tmp_path, monkeypatch):
+    rows = [
+        {"instance_id": f"owner__name-{i}", "repo": "owner/name", "base_commit": f"{i // 2:040x}", "patch": ""}
+        for i in range(4)
+    ]
+    monkeypatch.setattr(hf_source, "load_dataset", lambda *args, **kwargs: datasets.Dataset.from_list(rows))
+    data_source = SWEBenchDataSource(base_data_path=str(tmp_path), extractor=FullFileExtractor(), lazy_clone=True)
+    assert data_source.get_instance_id(3) == "owner__name-3"
+    assert data_source.get_row_by_instance_id("owner__name-2")["base_commit"] == rows[2]["base_commit"]
+    assert not data_source.has_instance_id("unknown")
+
+    inference = pd.DataFrame({"diff_pred": ["a", None], "base_hash": [rows[1]["base_commit"], rows[3]["base_commit"]]})
+    # Instance ids are carried by the inference output
+    results, instance_ids = data_source.to_swebench_results(
+        inference.assign(instance_id=["owner__name-1", "owner__name-3"]), "model"
+    )
+    assert instance_ids == ["owner__name-1", "owner__name-3"]
+    assert results[1] == {"instance_id": "owner__name-3", "model_patch": "", "model_name_or_path": "model"}
+    # Older outputs are matched by the base commit
+    assert data_source.to_swebench_results(inference, "model")[1] == ["owner__name-0", "owner__name-2"]
@@ -0,0 +1,253 @@
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from code_editing.agents.tools.common import write_file_full
+from code_editing.utils import git_utils
+from code_editing.utils.clone_manager import CloneManager
+from code_editing.utils.git_utils import (
+    apply_patch_like_commit,
+    checkout_repo,
+    clone_repo,
+    get_changed_files_patch,
+    get_diff,
+    get_parent_commit_sha,
+    get_repo_path,
+    get_repo_spec_content_on_commit,
+)
+from code_editing.utils.worktree_pool import get_worktree_pool
+from code_editing.utils.write_journal import WriteJournal
+
+
+def run_git(cwd, *args) -> str:
+    cmd = ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args]
+    return subprocess.run(cmd, cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def commit_file(repo_dir, file_name, content, message) -> str:
+    with open(os.path.join(repo_dir, file_name), "w") as f:
+        f.write(content)
+    run_git(repo_dir, "add", file_name)
+    run_git(repo_dir, "commit", "-m", message)
+    return run_git(repo_dir, "rev-parse", "HEAD")
+
+
+def make_origin(tmp_path) -> str:
+    origin = str(tmp_path / "origin")
+    os.makedirs(origin)
+    run_git(origin, "init", "-q")
+    return origin
+
+
+def test_commit_lookup_does_not_fetch(tmp_path, monkeypatch):
+    origin = make_origin(tmp_path)
+    first = commit_file(origin, "a.py", "a = 1\n", "first")
+    second = commit_file(origin, "a.py", "a = 2\n", "second")
+
+    data_dir = str(tmp_path / "data")
+    clone_repo("owner/name", data_dir, repo_url=origin)
+
+    # All the commits are already present, the origin is not needed anymore
+    shutil.rmtree(origin)
+    monkeypatch.setenv(git_utils.GIT_OFFLINE_ENV, "1")
+    assert get_parent_commit_sha("owner/name", second, data_dir) == first
+    assert "+a = 2" in get_diff("owner/name", second, data_dir, first)
+
+
+def test_missing_commit_is_fetched_once(tmp_path):
+    origin = make_origin(tmp_path)
+    first = commit_file(origin, "a.py", "a = 1\n", "first")
+
+    data_dir = str(tmp_path / "data")
+    clone_repo("owner/name", data_dir, repo_url=origin)
+    second = commit_file(origin, "a.py", "a = 2\n", "second")
+
+    assert get_parent_commit_sha("owner/name", second, data_dir) == first
+    repo_key = os.path.abspath(os.path.join(get_repo_path(data_dir, "owner/name"), ".git"))
+    assert repo_key in git_utils._fetched_repos
+
+
+def test_worktree_pool(tmp_path):
+    origin = make_origin(tmp_path)
+    first = commit_file(origin, "a.py", "a = 1\n", "first")
+    second = commit_file(origin, "a.py", "a = 2\n", "second")
+
+    data_dir = str(tmp_path / "data")
+    clone_repo("owner/name", data_dir, repo_url=origin)
+    pool = get_worktree_pool("owner/name", data_dir)
+
+    # Two exclusive worktrees at different commits
+    path1 = pool.acquire(first)
+    path2 = pool.acquire(second)
+    assert path1 != path2
+    assert os.path.basename(path1) == "owner__name"
+    with open(os.path.join(path1, "a.py")) as f1, open(os.path.join(path2, "a.py")) as f2:
+        assert f1.read().strip() == "a = 1"
+        assert f2.read().strip() == "a = 2"
+
+    # Released worktrees are recycled, the one at the requested commit is preferred
+    write_file_full(os.path.join(path2, "b.py"), "garbage", WriteJournal(path2))
+    pool.release(path1)
+    pool.release(path2)
+    assert pool.acquire(second) == path2
+    assert not os.path.exists(os.path.join(path2, "b.py"))
+
+
+def test_worktree_released_from_another_thread(tmp_path):
+    origin = make_origin(tmp_path)
+    first = commit_file(origin, "a.py", "a = 1\n", "first")
+
+    data_dir = str(tmp_path / "data")
+    clone_repo("owner/name", data_dir, repo_url=origin)
+    pool = get_worktree_pool("owner/name", data_dir)
+
+    # As in the async inference, the worktree is acquired and released by different long-lived worker threads
+    threads = [ThreadPoolExecutor(max_workers=1) for _ in range(3)]
+    try:
+        path = threads[0].submit(pool.acquire, first).result()
+        # The lock must be released by release() itself, not when the lock object happens to be collected
+        lock = pool._owned[path]  # noqa: F841
+        threads[1].submit(pool.release, path).result()
+        assert threads[2].submit(pool.acquire, first).result() == path
+    finally:
+        for executor in threads:
+            executor.shutdown()
+
+
+def test_content_on_commit_does_not_touch_working_tree(tmp_path):
+    origin = make_origin(tmp_path)
+    first = commit_file(origin, "a.py", "a = 1\r\nb = 2\n", "first")
+    commit_file(origin, "a.py", "a = 2\n", "second")
+
+    data_dir = str(tmp_path / "data")
+    clone_repo("owner/name", data_dir, repo_url=origin)
+    repo_path = get_repo_path(data_dir, "owner/name")
+    head = run_git(repo_path, "rev-parse", "HEAD")
+
+    contents = get_repo_spec_content_on_commit("owner/name", first, ["a.py", "missing.py"], data_dir)
+    assert contents == {"a.py": "a = 1\nb = 2\n", "missing.py": ""}
+    # Missing paths with spaces
+    contents = get_repo_spec_content_on_commit("owner/name", first, ["a b.py", "a b c.py", "a.py"], data_dir)
+    assert contents == {"a b.py": "", "a b c.py": "", "a.py": "a = 1\nb = 2\n"}
+    assert run_git(repo_path, "rev-parse", "HEAD") == head
+
+
+def test_apply_patch_in_memory(tmp_path):
+    origin = make_origin(tmp_path)
+    base = commit_file(origin, "a.py", "def f():\n    return 1\n\n\nx = f()\n", "first")
+
+    data_dir = str(tmp_path / "data")
+    clone_repo("owner/name", data_dir, repo_url=origin)
+    repo_path = get_repo_path(data_dir, "owner/name")
+
+    # Wrong line numbers, context with different whitespace and a new file
+    patch = (
+        "diff --git a/a.py b/a.py\n"
+        "--- a/a.py\n"
+        "+++ b/a.py\n"
+        "@@ -10,2 +10,2 @@\n"
+        " def  f():\n"
+        "-    return 1\n"
+        "+    return 2\n"
+        "diff --git a/b.py b/b.py\n"
+        "new file mode 100644\n"
+        "--- /dev/null\n"
+        "+++ b/b.py\n"
+        "@@ -0,0 +1 @@\n"
+        "+y = 1\n"
+    )
+    contents = apply_patch_like_commit("owner/name", base, patch, ["a.py", "b.py", "c.py"], data_dir)
+    assert contents == {"a.py": "def f():\n    return 2\n\n\nx = f()\n", "b.py": "y = 1\n", "c.py": ""}
+    assert get_changed_files_patch("owner/name", patch, data_dir, base) == ["a.py"]
+    assert run_git(repo_path, "status", "--porcelain") == ""
+
+    # Same results as git apply
+    with open(tmp_path / "patch.diff", "w") as f:
+        f.write(patch)
+    run_git(repo_path, "apply", "--unidiff-zero", "--recount", "--ignore-whitespace", str(tmp_path / "patch.diff"))
+    for file in ["a.py", "b.py"]:
+        with open(os.path.join(repo_path, file)) as f:
+            assert f.read() == contents[file]
+
+    # Patches that do not apply
+    assert apply_patch_like_commit("owner/name", base, patch.replace("return 1", "return 3"), [], data_dir) is None
+    assert apply_patch_like_commit("owner/name", base, patch.rstrip("\n"), [], data_dir) is None
+    assert apply_patch_like_commit("owner/name", base, "not a patch\n", [], data_dir) is None
+    assert apply_patch_like_commit("owner/name", base, "", ["a.py"], data_dir) == {
+        "a.py": "def f():\n    return 1\n\n\nx = f()\n"
+    }
+
+
+def test_clone_manager_with_mirror(tmp_path):
+    origin = make_origin(tmp_path)
+    first = commit_file(origin, "a.py", "a = 1\n", "first")
+    mirror_dir = str(tmp_path / "mirrors")
+    run_git(tmp_path, "clone", "-q", "--bare", origin, os.path.join(mirror_dir, "origin.git"))
+
+    data_dir = str(tmp_path / "data")
+    url_template = f"file://{tmp_path}/{{repo}}"
+    manager = CloneManager(data_dir, workers=2, blobless=True, mirror_dir=mirror_dir, url_template=url_template)
+    timings = manager.clone_all(["origin"])
+    assert list(timings) == ["origin"]
+    # Already cloned repositories are skipped
+    assert manager.clone_all(["origin"]) == {}
+
+    repo_path = get_repo_path(data_dir, "origin")
+    with open(os.path.join(repo_path, ".git", "objects", "info", "alternates")) as f:
+        assert "origin.git" in f.read()
+    assert get_repo_spec_content_on_commit("origin", first, ["a.py"], data_dir) == {"a.py": "a = 1\n"}
+
+
+def test_checkout_restores_journaled_files(tmp_path):
+    origin = make_origin(tmp_path)
+    first = commit_file(origin, "a.py", "a = 1\n", "first")
+    second = commit_file(origin, "a.py", "a = 2\n", "second")
+
+    data_dir = str(tmp_path / "data")
+    clone_repo("owner/name", data_dir, repo_url=origin)
+    repo_path = checkout_repo("owner/name", first, data_dir)
+
+    # Files written by the tools are journaled, other files (e.g. build artifacts) are not
+    journal = WriteJournal(repo_path)
+    write_file_full(os.path.join(repo_path, "a.py"), "a = 3\n", journal)
+    write_file_full(os.path.join(repo_path, "new.py"), "b = 1\n", journal)
+    write_file_full(os.path.join(repo_path, "build.o"), "")
+    os.makedirs(os.path.join(repo_path, "pkg", "sub"))
+    os.makedirs(os.path.join(repo_path, "out"))
+    write_file_full(os.path.join(repo_path, "pkg", "sub", "c.py"), "c = 1\n", journal)
+    write_file_full(os.path.join(repo_path, "pkg", "d.py"), "d = 1\n", journal)
+    write_file_full(os.path.join(repo_path, "out", "e.py"), "e = 1\n", journal)
+    write_file_full(os.path.join(repo_path, "out", "build.o"), "")
+    assert journal.read() == ["a.py", "new.py", "out/e.py", "pkg/d.py", "pkg/sub/c.py"]
+
+    # The directories of the new files are removed too, unless something else is left in them
+    checkout_repo("owner/name", second, data_dir)
+    assert not os.path.exists(os.path.join(repo_path, "pkg"))
+    assert sorted(run_git(repo_path, "status", "--porcelain").splitlines()) == ["?? build.o", "?? out/"]
+    os.remove(os.path.join(repo_path, "out", "build.o"))
+    os.rmdir(os.path.join(repo_path, "out"))
+    assert run_git(repo_path, "status", "--porcelain") == "?? build.o"
+    assert journal.read() == []
+
+    # Without the journal, the whole working tree is cleaned
+    journal.invalidate()
+    checkout_repo("owner/name", first, data_dir)
+    assert run_git(repo_path, "status", "--porcelain") == ""
+    assert run_git(repo_path, "rev-parse", "HEAD") == first
+
+
+def test_diff_cache(tmp_path):
+    origin = make_origin(tmp_path)
+    first = commit_file(origin, "a.py", "a = 1\n", "first")
+    second = commit_file(origin, "a.py", "a = 2\n", "second")
+
+    data_dir = str(tmp_path / "data")
+    clone_repo("owner/name", data_dir, repo_url=origin)
+    diff = get_diff("owner/name", second, data_dir, first)
+    assert get_changed_files_patch("owner/name", diff + "\n", data_dir, first) == ["a.py"]
+
+    # Cached results do not need the repository
+    shutil.rmtree(get_repo_path(data_dir, "owner/name"))
+    assert get_diff("owner/name", second, data_dir, first) == diff
+    assert get_changed_files_patch("owner/name", diff + "\n", data_dir, first) == ["a.py"]
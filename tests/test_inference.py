@@ -0,0 +1,125 @@
+import os
+import types
+
+import datasets
+from filelock import FileLock
+from hydra import compose, initialize_config_dir
+from hydra.core.config_store import ConfigStore
+from hydra.utils import instantiate
+
+from code_editing.agents.utils.checkout_extractor import CheckoutExtractor
+from code_editing.code_editor import CodeEditor
+from code_editing.configs.baseline_config import setup_baseline_config
+from code_editing.configs.inference_config import InferenceConfig
+from code_editing.data_sources import FullFileExtractor, hf_source
+from code_editing.scripts import common
+from code_editing.scripts.merge_shards import merge_shards
+from code_editing.utils.worktree_pool import WorktreePool
+from tests.test_data_sources import LocalDataSource
+from tests.test_git_utils import commit_file, make_origin, run_git
+
+CONF_DIR = os.path.join(os.path.dirname(common.__file__), "conf")
+
+
+def patch_hydra_output_dir(tmp_path, monkeypatch) -> str:
+    hydra_dir = tmp_path / "hydra"
+    hydra_dir.mkdir()
+    runtime = types.SimpleNamespace(runtime=types.SimpleNamespace(output_dir=str(hydra_dir)))
+    monkeypatch.setattr(common, "HydraConfig", types.SimpleNamespace(get=lambda: runtime))
+    return str(hydra_dir)
+
+
+class MessageEditor(CodeEditor):
+    def generate_diff(self, req):
+        return {"prediction": req["instruction"]}
+
+
+class WorkspaceEditor(CodeEditor):
+    def __init__(self):
+        self.workspaces = []
+
+    def generate_diff(self, req):
+        self.workspaces.append(req["code_base"][CheckoutExtractor.REPO_KEY])
+        return {"prediction": req["instruction"]}
+
+
+def test_pipeline_with_worktrees(tmp_path, monkeypatch):
+    origin = make_origin(tmp_path)
+    first = commit_file(origin, "a.py", "a = 1\n", "first")
+    second = commit_file(origin, "a.py", "a = 2\n", "second")
+    rows = [{"message": f"m{i}", "repo": "origin", "hash": second, "base_hash": first} for i in range(6)]
+
+    monkeypatch.setattr(hf_source, "load_dataset", lambda *args, **kwargs: datasets.Dataset.from_list(rows))
+    monkeypatch.setattr(LocalDataSource, "computed", 0, raising=False)
+    patch_hydra_output_dir(tmp_path, monkeypatch)
+
+    # The slots must be unlocked by release() itself, not when the lock objects happen to be collected
+    released_locks = []
+    pool_release = WorktreePool.release
+
+    def release(pool, path):
+        released_locks.append(pool._owned[path])
+        pool_release(pool, path)
+
+    monkeypatch.setattr(WorktreePool, "release", release)
+
+    data_path = tmp_path / "data"
+    data_source = LocalDataSource(
+        hub_name="local/dataset",
+        base_data_path=str(data_path),
+        extractor=CheckoutExtractor(use_worktrees=True),
+    )
+    data_source._clone_manager.url_template = f"file://{tmp_path}/{{repo}}"
+    editor = WorkspaceEditor()
+    config = InferenceConfig(pipeline=True, num_workers=1, prepare_workers=1, prefetch=1)
+    df = common.inference_loop(editor, data_source, str(tmp_path / "out" / "inference.jsonl"), config, "run")
+
+    assert sorted(df["diff_pred"].str.strip()) == [f"m{i}" for i in range(6)]
+    # The workspaces are prepared and released by different stage threads, the released worktrees are reused
+    worktrees = os.path.join(data_path, "worktrees", "origin")
+    slots = [name for name in os.listdir(worktrees) if name.isdigit()]
+    assert len(slots) < len(rows) == len(released_locks)
+    assert set(editor.workspaces) == {os.path.join(worktrees, slot, "origin") for slot in slots}
+    for slot in slots:
+        lock = FileLock(os.path.join(worktrees, f"{slot}.lock"))
+        lock.acquire(blocking=False)
+        lock.release()
+
+
+def test_merge_backbone_shards(tmp_path, monkeypatch):
+    origin = make_origin(tmp_path / "owner")
+    first = commit_file(origin, "a.py", "a = 1\n", "first")
+    second = commit_file(origin, "a.py", "a = 2\n", "second")
+    patch = run_git(origin, "diff", first, second) + "\n"
+    rows = [
+        {"instance_id": f"owner__origin-{i}", "repo": "owner/origin", "base_commit": first, "patch": patch}
+        for i in range(5)
+    ]
+    rows = [dict(row, problem_statement=row["instance_id"]) for row in rows]
+    monkeypatch.setattr(hf_source, "load_dataset", lambda *args, **kwargs: datasets.Dataset.from_list(rows))
+    output_dir = patch_hydra_output_dir(tmp_path, monkeypatch)
+
+    # The config of run_backbone.py
+    setup_baseline_config(ConfigStore.instance())
+    output_path = str(tmp_path / "out" / "inference.jsonl")
+    with initialize_config_dir(config_dir=CONF_DIR, version_base=None):
+        overrides = [
+            f"data_source.base_data_path={tmp_path / 'data'}",
+            "inference.num_shards=2",
+            f"inference.output_path={output_path}",
+        ]
+        cfg = compose(config_name="backbone_only", overrides=overrides)
+
+    for shard_index in range(2):
+        cfg.inference.shard_index = shard_index
+        data_source = instantiate(cfg.data_source, extractor=FullFileExtractor())
+        data_source._clone_manager.url_template = f"file://{tmp_path}/{{repo}}"
+        common.inference_loop(MessageEditor(), data_source, output_path, cfg.inference, "baseline_backbone")
+    assert sorted(os.listdir(tmp_path / "out")) == ["inference.shard-0-of-2.jsonl", "inference.shard-1-of-2.jsonl"]
+
+    df = merge_shards(cfg, output_dir)
+    assert list(df["instance_id"]) == [row["instance_id"] for row in rows]
+    assert list(df["diff_pred"].str.strip()) == [row["instance_id"] for row in rows]
+    assert df["model_name"].nunique() == 1
+    assert os.path.exists(output_path)
+    assert os.path.exists(os.path.join(output_dir, f"swebench_preds_{df['model_name'][0]}.json"))
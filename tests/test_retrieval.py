@@ -0,0 +1,95 @@
+import os
+import time
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from code_editing.agents.context_providers.pool import ContextProviderPool
+from code_editing.agents.context_providers.retrieval import BM25Retrieval
+from code_editing.utils.concurrency import map_concurrently
+from tests.test_git_utils import commit_file, make_origin
+
+
+class RecordingRetrieval(BM25Retrieval):
+    def reindex_files(self, files):
+        self.reindexed.append(sorted(files))
+
+    reindexed = None
+
+
+def make_retrieval(tmp_path, reindex_delay: float) -> RecordingRetrieval:
+    repo = make_origin(tmp_path)
+    commit_file(repo, "a.py", "def foo():\n    pass\n", "first")
+    retrieval = RecordingRetrieval(
+        repo_path=repo,
+        data_path=str(tmp_path),
+        splitter=RecursiveCharacterTextSplitter(chunk_size=100, chunk_overlap=0, add_start_index=True),
+        loader={"target": "langchain_community.document_loaders.TextLoader"},
+        reindex_delay=reindex_delay,
+    )
+    retrieval.reindexed = []
+    return retrieval
+
+
+def test_reindex_before_search(tmp_path):
+    retrieval = make_retrieval(tmp_path, reindex_delay=60)
+    a, b = os.path.join(retrieval.repo_path, "a.py"), os.path.join(retrieval.repo_path, "b.py")
+    # Changes of the same file are coalesced and reindexed before the search
+    for file in [a, b, a]:
+        retrieval.add_changed_file(file)
+    assert retrieval.reindexed == [] and retrieval.has_pending_reindex()
+    docs = retrieval.search("foo", 1)
+    assert retrieval.reindexed == [[a, b]] and "def foo" in docs[0].page_content
+    retrieval.search("foo", 1)
+    assert retrieval.reindexed == [[a, b]]
+
+    # Changes that are not reindexed at the end of the run are dropped
+    retrieval.add_changed_file(a)
+    retrieval.reset()
+    assert not retrieval.has_pending_reindex()
+    retrieval.search("foo", 1)
+    assert retrieval.reindexed == [[a, b]]
+
+
+def test_concurrent_search(tmp_path, monkeypatch):
+    retrieval = make_retrieval(tmp_path, reindex_delay=60)
+    search = retrieval._search
+    running, max_running = [0], [0]
+
+    def slow_search(*args, **kwargs):
+        running[0] += 1
+        max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.05)
+        running[0] -= 1
+        return search(*args, **kwargs)
+
+    # Searches without queued changes overlap (e.g. while waiting for the embeddings)
+    monkeypatch.setattr(retrieval, "_search", slow_search)
+    assert len(map_concurrently(lambda _: retrieval.search("foo", 1), range(4), max_workers=4)) == 4
+    assert max_running[0] > 1 and retrieval.reindexed == []
+
+
+def test_reindex_in_background(tmp_path):
+    retrieval = make_retrieval(tmp_path, reindex_delay=0.05)
+    a = os.path.join(retrieval.repo_path, "a.py")
+    retrieval.add_changed_file(a)
+    retrieval.add_changed_file(a)
+    deadline = time.monotonic() + 5
+    while not retrieval.reindexed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert retrieval.reindexed == [[a]] and not retrieval.has_pending_reindex()
+
+
+def test_reindex_cancelled_on_drop(tmp_path, monkeypatch):
+    retrieval = make_retrieval(tmp_path, reindex_delay=0.05)
+    a = os.path.join(retrieval.repo_path, "a.py")
+    pool = ContextProviderPool()
+    monkeypatch.setattr(retrieval, "is_dirty", lambda: True)
+
+    # The queued reindex does not fire after the provider is dropped with the run
+    for drop in [pool.discard, pool.release, lambda provider: provider.close()]:
+        pool._in_use[id(retrieval)] = "key", retrieval
+        retrieval.add_changed_file(a)
+        drop(retrieval)
+        assert not retrieval.has_pending_reindex()
+    time.sleep(0.2)
+    assert retrieval.reindexed == []
@@ -0,0 +1,52 @@
+from code_editing.agents.run import AgentRunManager
+from code_editing.agents.tools import MultiEditTool
+from code_editing.utils.workspace import use_workspace
+from tests.test_git_utils import commit_file, make_origin
+
+
+def test_multi_edit(tmp_path):
+    repo = make_origin(tmp_path)
+    commit_file(repo, "a.py", "".join(f"a{i} = {i}\n" for i in range(30)), "a")
+    commit_file(repo, "b.py", "b = 1\n", "b")
+    run_manager = AgentRunManager(repo, str(tmp_path), {})
+    run_manager.journal.start()
+    tool = MultiEditTool(run_manager=run_manager)
+
+    def edit(file_name, to_replace, new_code):
+        return {"file_name": file_name, "to_replace": to_replace, "new_code": new_code}
+
+    with use_workspace(run_manager.workspace):
+        # Nothing is written if any of the edits is not valid
+        res = tool.invoke(
+            {
+                "edits": [
+                    edit("a.py", "a1 = 1\n", "a1 = 10\n"),
+                    edit("a.py", "missing", ""),
+                    edit("a.py", "1 = 1", ""),
+                    edit("c.py", "c", ""),
+                ]
+            }
+        )
+        assert "Edit 2: the code to replace was not found in a.py." in res
+        assert "Edit 3: the code to replace overlaps with edit 1." in res
+        assert "Edit 4: File c.py does not exist" in res
+        assert run_manager.workspace.stats["writes"] == 0 and run_manager.journal.read() == []
+
+        # The edits are applied at once, one write per file
+        res = tool.invoke(
+            {
+                "edits": [
+                    edit("a.py", "a25 = 25\n", "a25 = 250\n"),
+                    edit("b.py", "b = 1\n", "b = 2\n"),
+                    edit("a.py", "a1 = 1\n", "a1 = 10\na1 += 1\n"),
+                    edit("a.py", "a2 = 2\n", ""),
+                ]
+            }
+        )
+    a = (tmp_path / "origin" / "a.py").read_text().split("\n")
+    assert a[1:4] == ["a1 = 10", "a1 += 1", "a3 = 3"] and a[25] == "a25 = 250"
+    assert (tmp_path / "origin" / "b.py").read_text() == "b = 2\n"
+    assert run_manager.workspace.stats["writes"] == 2 and sorted(run_manager.journal.read()) == ["a.py", "b.py"]
+    assert run_manager.tools_info["edit-fragments"] == {"calls": 2, "failures": 1, "success": 1}
+    # The context of the close changes is merged
+    assert res.count("...\n") == 1 and "a25 = 250\n" in res and "b.py:\nb = 2\n" in res
@@ -1,6 +1,30 @@
+import contextvars
+import json
 import tempfile
+import threading
+import time
+
+import pytest
+from langchain_core.outputs import LLMResult
+from langchain_core.tools import ToolException
 
 from code_editing.agents.collect_edit.editors.util import process_edit
+from code_editing.agents.tools.common import parse_file, read_file, read_file_full, read_file_lines, write_file_full
+from code_editing.code_editor import PreparedRun
+from code_editing.utils.concurrency import (
+    AIMDController,
+    ConcurrencyCallbackHandler,
+    ReadWriteLock,
+    backoff_delay,
+    map_concurrently,
+)
+from code_editing.utils.jsonl_stream import JsonlStreamWriter, read_jsonl_rows
+from code_editing.utils.metrics import MetricsAggregator
+from code_editing.utils.piece_table import PieceTable
+from code_editing.utils.pipeline import Stage, StagedPipeline
+from code_editing.utils.scheduler import AffinityScheduler, shard_items
+from code_editing.utils.tracing import Tracer, get_stage_summary, set_tracer, span
+from code_editing.utils.workspace import Workspace, get_workspace, use_workspace
 
 
 def test_process_edit():
@@ -21,3 +45,290 @@ def test_process_edit():
     )
 
     assert edited_code == expected_code
+
+    # The segments address the original lines after the edits that change the number of lines too
+    edited_code = process_edit(file, [2, 3, 5, 9, 10], lambda _, snippet: snippet.replace("\n", "\n\n").upper())
+    assert edited_code == "line 1\nLINE 2\n\nLINE 3\nline 4\nLINE 5\nline 6\nline 7\nline 8\nLINE 9\n\nLINE 10"
+
+
+def test_piece_table():
+    buffer = PieceTable("a\nb\nc\nd")
+    buffer.replace_lines(1, 2, "B1\nB2")
+    buffer.replace(0, 0, "start\n")
+    buffer.replace_lines(3, 10, "")
+    assert buffer.original_lines(1, 3) == "b\nc"
+    with pytest.raises(ValueError):
+        buffer.replace(*buffer.line_span(1, 3), "x")
+    assert buffer.text() == "start\na\nB1\nB2\nc\n"
+    assert [buffer.new_line(offset) for offset in buffer.line_starts] == [0, 2, 4, 5]
+
+
+def test_jsonl_stream_resume(tmp_path):
+    path = str(tmp_path / "inference.jsonl")
+    with JsonlStreamWriter(path, append=False, sync_every=2) as writer:
+        writer.write({"instance_id": "a", "diff_pred": "1"})
+        writer.write({"instance_id": "b", "diff_pred": None})
+    # Crash in the middle of a line
+    with open(path, "a") as f:
+        f.write('{"instance_id": "c", "diff')
+
+    assert read_jsonl_rows(path) == [{"instance_id": "a", "diff_pred": "1"}, {"instance_id": "b", "diff_pred": None}]
+    with JsonlStreamWriter(path) as writer:
+        writer.write({"instance_id": "b", "diff_pred": "2"})
+    assert [row["diff_pred"] for row in read_jsonl_rows(path)] == ["1", None, "2"]
+
+
+def test_affinity_scheduler():
+    keys = {0: ("a", "1"), 1: ("b", "1"), 2: ("a", "2"), 3: ("a", "1"), 4: ("c", "1")}
+    scheduler = AffinityScheduler(keys, exclusive_repos=True)
+
+    # Different repositories run in parallel, the largest one first
+    assert [scheduler.pop(), scheduler.pop(), scheduler.pop()] == [0, 1, 4]
+    assert scheduler.pop() is None
+    # Then the same repository continues with the same base commit
+    scheduler.done(0)
+    assert scheduler.pop() == 3
+    # Retries go first
+    scheduler.done(3)
+    scheduler.push(3)
+    assert scheduler.pop() == 3
+    scheduler.done(3)
+    assert scheduler.pop() == 2
+    assert len(scheduler) == 0
+
+    scheduler = AffinityScheduler(keys, exclusive_repos=False)
+    assert [scheduler.pop() for _ in range(5)] == [0, 1, 4, 3, 2]
+
+
+def test_map_concurrently():
+    var = contextvars.ContextVar("var", default=None)
+    running, max_running, lock = [0], [0], threading.Lock()
+
+    def fn(item):
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.02 * (5 - item))
+        with lock:
+            running[0] -= 1
+        return item, var.get()
+
+    # The results are in the order of the items, the calls see the caller's context
+    var.set("run")
+    assert map_concurrently(fn, range(5), max_workers=3) == [(item, "run") for item in range(5)]
+    assert max_running[0] == 3
+
+    rw_lock = ReadWriteLock()
+    events = []
+
+    def reader(n):
+        with rw_lock.read():
+            events.append(("read", n))
+            time.sleep(0.05)
+            events.append(("read_end", n))
+
+    def writer():
+        time.sleep(0.01)
+        with rw_lock.write():
+            events.append(("write", None))
+
+    # Readers overlap, the writer waits for them
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(2)] + [threading.Thread(target=writer)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [e for e, _ in events[:2]] == ["read", "read"] and events[-1] == ("write", None)
+
+
+def test_aimd_controller():
+    class RateLimitError(Exception):
+        status_code = 429
+
+    controller = AIMDController(min_limit=1, max_limit=8, initial=4)
+    # Additive increase: one more after [limit] successful calls
+    for _ in range(4):
+        controller.on_success(1.0)
+    assert controller.limit == 5
+    # Multiplicative decrease on a rate limit, once for the calls started before the cut
+    controller.on_error(RateLimitError(), started_at=0.0)
+    assert controller.limit == 2
+    controller.on_error(RateLimitError(), started_at=0.0)
+    assert controller.limit == 2
+    # Other errors do not change the limit
+    controller.on_error(ValueError())
+    assert controller.limit == 2
+    # Slower calls do not cut the limit by default, they are successes
+    for _ in range(20):
+        controller.on_success(10.0)
+    assert controller.limit == 7
+
+    # Latency growing beyond the tolerance cuts the limit if enabled, the latency is per output token
+    controller = AIMDController(min_limit=1, max_limit=8, initial=4, latency_tolerance=2.0)
+    handler = ConcurrencyCallbackHandler(controller)
+    for run_id in range(1, 21):
+        # Longer answers take longer
+        handler.on_llm_start({}, [], run_id=run_id)
+        handler._started[run_id] -= 0.1 * run_id
+        handler.on_llm_end(
+            LLMResult(generations=[], llm_output={"token_usage": {"completion_tokens": 10 * run_id}}), run_id=run_id
+        )
+    assert controller.limit == 7
+    for _ in range(20):
+        controller.on_success(10.0)
+    assert controller.limit == 1
+
+    assert backoff_delay(0) == 0
+    assert all(2 <= backoff_delay(2, base=2.0) <= 4 for _ in range(100))
+    assert backoff_delay(20, base=1.0, cap=60.0) <= 60
+
+
+def test_shard_items():
+    repos = {i: repo for i, repo in enumerate("abacbadcaa")}
+    shards = [shard_items(repos, 3, k) for k in range(3)]
+    # Disjoint, balanced and covering all the data points
+    assert sorted(sum(shards, [])) == list(range(10))
+    assert [len(shard) for shard in shards] == [3, 3, 4]
+    # Repositories are not split more than necessary
+    assert [sorted(set(repos[i] for i in shard)) for shard in shards] == [["a"], ["a", "b"], ["b", "c", "d"]]
+
+
+def test_metrics_aggregator(tmp_path):
+    json_path = tmp_path / "metrics.json"
+    with MetricsAggregator(flush_interval=60, json_path=str(json_path)) as metrics:
+
+        def work(k):
+            for _ in range(1000):
+                metrics.add("openai.total_tokens", 2)
+            metrics.max("scheduler.max_lock_wait_sec", k)
+            metrics.observe("latency.datapoint_sec", k)
+
+        threads = [threading.Thread(target=work, args=(k,)) for k in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        metrics.set("concurrency.limit", 4)
+
+    res = json.loads(json_path.read_text())
+    assert res == metrics.snapshot()
+    assert res["openai"]["total_tokens"] == 16000
+    assert res["scheduler"]["max_lock_wait_sec"] == 7
+    assert res["latency"]["datapoint_sec"]["count"] == 8
+    assert res["latency"]["datapoint_sec"]["mean"] == 3.5
+    assert res["concurrency"]["limit"] == 4
+
+
+def test_tracing_spans(tmp_path):
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    # Disabled tracing is a no-op
+    with span("datapoint") as root:
+        assert root is None and get_stage_summary() == {}
+
+    tracer = Tracer()
+    set_tracer(tracer)
+    try:
+        with span("datapoint", index=0):
+            with span("checkout"):
+                pass
+            with span("tool:view_file", cat="tool") as tool_span:
+                tool_span.set(output_chars=10)
+                FakeListChatModel(responses=["a"]).invoke("hi")
+            stages = get_stage_summary()
+    finally:
+        set_tracer(None)
+    assert {name: stage["count"] for name, stage in stages.items()} == {"checkout": 1, "llm": 1, "tool:view_file": 1}
+    assert stages["tool:view_file"]["self_sec"] <= stages["tool:view_file"]["sec"] - stages["llm"]["sec"] + 1e-6
+
+    tracer.save(str(tmp_path / "trace.json"))
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    spans = {event["name"]: event for event in events if event["ph"] == "X"}
+    assert spans.keys() == {"datapoint", "checkout", "tool:view_file", "llm"}
+    assert spans["tool:view_file"]["args"] == {"output_chars": 10}
+    # Nested spans are within their parents on the same track
+    assert spans["llm"]["ts"] >= spans["tool:view_file"]["ts"] >= spans["datapoint"]["ts"]
+    assert len({event["tid"] for event in events}) == 1
+
+
+def test_prepared_run():
+    released = []
+    run = PreparedRun(lambda: "diff", release=lambda: released.append(1))
+    # The resources are released by the run, cancelling it afterwards does nothing
+    assert run() == "diff"
+    run.cancel()
+    assert released == []
+
+    # A run that is cancelled before it starts is released once and can not be run
+    run = PreparedRun(lambda: "diff", release=lambda: released.append(1))
+    run.cancel()
+    run.cancel()
+    assert released == [1]
+    with pytest.raises(RuntimeError):
+        run()
+
+
+def test_staged_pipeline():
+    current = contextvars.ContextVar("current", default=None)
+    released = []
+
+    def enter(key, value):
+        current.set(key)
+        if key == 2:
+            raise ValueError("bad item")
+        return value * 10
+
+    def run(key, value):
+        # Set by the previous stage of the same item in another thread
+        assert current.get() == key
+        return value + 1
+
+    stages = [
+        Stage("enter", enter, workers=2),
+        Stage("run", run, workers=2),
+        Stage("release", lambda key, value: released.append(key), cleanup=True),
+    ]
+    with StagedPipeline(stages, queue_size=1) as pipeline:
+        for key in range(5):
+            pipeline.put(key, key)
+        results = {}
+        for _ in range(5):
+            key, value, error = pipeline.get(timeout=5)
+            results[key] = value if error is None else str(error)
+        assert pipeline.get(timeout=0.01) is None
+        stats = pipeline.stats()
+    assert results == {0: 1, 1: 11, 2: "bad item", 3: 31, 4: 41}
+    # Failed items are cleaned up too
+    assert sorted(released) == list(range(5))
+    assert stats["enter"]["errors"] == 1 and stats["run"]["items"] == 4 and stats["release"]["items"] == 5
+    assert all(0 <= stage["utilisation"] <= 1 for stage in stats.values())
+
+
+def test_workspace(tmp_path):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "a.py").write_text("def foo():\n    pass\n\nfoo()")
+    file = str(repo / "a.py")
+    expected = [read_file(0, file, index)[2] for index in range(-1, 30)]
+    expected_lines = read_file_lines(file, 2, 3, True)
+
+    workspace = Workspace(str(repo))
+    with use_workspace(workspace):
+        # Same results as from the disk, the file is read once
+        assert parse_file("a.py", str(repo)) == file
+        assert [read_file(0, file, index)[2] for index in range(-1, 30)] == expected
+        assert read_file_lines(file, 2, 3, True) == expected_lines
+        assert workspace.stats["reads"] == 1
+        with pytest.raises(ToolException):
+            parse_file("../a.py", str(repo))
+
+        # Writes go through to the disk
+        write_file_full(file, "bar()\n")
+        assert read_file_full(file) == "bar()\n" and (repo / "a.py").read_text() == "bar()\n"
+        assert read_file(0, file, 3)[1] == ["bar()\n"]
+        assert workspace.stats == {"reads": 1, "hits": workspace.stats["hits"], "writes": 1}
+
+    # Files outside the workspace are read from the disk
+    assert get_workspace() is None
+    with use_workspace(workspace):
+        assert get_workspace(str(tmp_path / "other.py")) is None